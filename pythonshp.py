@@ -26,6 +26,13 @@ import sys
 import os
 import io
 import base64
+import array
+import heapq
+import tempfile
+try:
+	import mmap
+except ImportError:
+	mmap=None
 try:
 	import zlib
 except ImportError:
@@ -34,11 +41,18 @@ try:
 	import zipfile
 except ImportError:
 	zipfile=None
+try:
+	import numpy
+except ImportError:
+	numpy=None
 
 version_global='1.0.5'
 isverbose_global=False
 ispartlabeltop_global=True
 debug_global=0
+shpcachedir_global=None
+isnumpy_global=True # numpy is used for projection if it's loaded
+lodpixels_global=0.0 # if set, vertices with a smaller Visvalingam area (in square pixels, halved) are dropped before projection
 
 NULL_TYPE_SHP=0
 POINT_TYPE_SHP=1
@@ -185,10 +199,24 @@ class OutputPath():
 		return True
 
 class Output():
+	chunksize=1024*1024
 	def __init__(self):
 		self.lines=[]
 		self.csscounts={}
 		self.path=None
+		self.spool=None # with setstream(), lines go to a temporary file once they add up to chunksize
+		self.size=0
+		self.head=[] # prepend()ed lines, when streaming
+		self.gziplevel=None # with setgzip(), writeto() writes svgz
+	def setstream(self,spoolsize=16*1024*1024): # keep memory flat, the body is in a file if it's bigger than spoolsize
+		self.spool=tempfile.SpooledTemporaryFile(max_size=spoolsize,mode='w+',encoding='utf-8',newline='')
+		self.movetospool()
+	def setgzip(self,level=6):
+		self.gziplevel=level
+	def movetospool(self):
+		self.spool.write(''.join(self.lines))
+		self.lines=[]
+		self.size=0
 	def countcss(self,cssclass):
 		cs=cssclass.split(' ')
 		for c in cs:
@@ -199,6 +227,9 @@ class Output():
 		self.file=outf
 	def rawprint(self,s):
 		self.lines.append(s)
+		if self.spool:
+			self.size+=len(s)
+			if self.size>=Output.chunksize: self.movetospool()
 	def print(self,s):
 		self.flush()
 		self.rawprint(s)
@@ -220,10 +251,46 @@ class Output():
 		self.path.write(self)
 		self.path=None
 	def prepend(self,output):
-		self.lines[0:0]=output.lines
+		if self.spool: self.head[0:0]=output.lines
+		else: self.lines[0:0]=output.lines
 #		for c in output.csscounts: self.csscounts[c]=self.csscounts.get(c,0)+output.csscounts[c] # untested, unused
 	def writeto(self,file):
-		for l in self.lines: print(l,end='',file=file)
+		if self.gziplevel!=None: return self.writeto_gzip(file)
+		if not self.spool:
+			file.writelines(self.lines)
+			return
+		file.writelines(self.head)
+		self.movetospool()
+		self.spool.seek(0)
+		while True:
+			s=self.spool.read(Output.chunksize)
+			if not s: break
+			file.write(s)
+	def writeto_gzip(self,file): # file is binary or has a binary buffer, each chunk is compressed as it's written
+		if hasattr(file,'buffer'):
+			file.flush()
+			file=file.buffer
+		z=zlib.compressobj(self.gziplevel,zlib.DEFLATED,31) # 31: gzip header
+		chunk=[]
+		size=0
+		lines=self.head if self.spool else self.lines
+		for l in lines:
+			chunk.append(l)
+			size+=len(l)
+			if size>=Output.chunksize:
+				file.write(z.compress(''.join(chunk).encode()))
+				chunk=[]
+				size=0
+		file.write(z.compress(''.join(chunk).encode()))
+		if self.spool:
+			self.movetospool()
+			self.spool.seek(0)
+			while True:
+				s=self.spool.read(Output.chunksize)
+				if not s: break
+				file.write(z.compress(s.encode()))
+		file.write(z.flush())
+		file.flush()
 		
 
 class Mbr():
@@ -267,7 +334,63 @@ class Mbr():
 			if self.maxx<mbr.maxx: self.maxx=mbr.maxx
 			if self.maxy<mbr.maxy: self.maxy=mbr.maxy
 
+class LonLatWindow(): # a set of lon/lat boxes, for skipping shp records that can't be seen
+	@staticmethod
+	def makefrommbr(mbr):
+		w=LonLatWindow()
+		w.mbrs.append(mbr)
+		return w
+	@staticmethod
+	def makefromcap(lon,lat,radius): # radius in degrees from lon,lat
+		w=LonLatWindow()
+		minlat=lat-radius
+		maxlat=lat+radius
+		if minlat<=-90.0 or maxlat>=90.0 or radius>=90.0:
+			mbr=Mbr()
+			mbr.set(-180.0,max(minlat,-90.0),180.0,min(maxlat,90.0))
+			w.mbrs.append(mbr)
+			return w
+		dlon=math.degrees(math.asin(min(1.0,math.sin(math.radians(radius))/math.cos(math.radians(lat)))))
+		minlon=lon-dlon
+		maxlon=lon+dlon
+		while minlon<-180.0:
+			minlon+=360.0
+			maxlon+=360.0
+		while minlon>180.0:
+			minlon-=360.0
+			maxlon-=360.0
+		mbr=Mbr()
+		mbr.set(minlon,minlat,min(maxlon,180.0),maxlat)
+		w.mbrs.append(mbr)
+		if maxlon>180.0:
+			mbr=Mbr()
+			mbr.set(-180.0,minlat,maxlon-360.0,maxlat)
+			w.mbrs.append(mbr)
+		return w
+	@staticmethod
+	def makefromview(rotation,boxzoomcleave,margin=1.0): # what can be seen after rotation and boxzoomcleave
+		(lon,lat)=rotation.deg_getcenter()
+		if not boxzoomcleave: return LonLatWindow.makefromcap(lon,lat,90.0+margin)
+		h=math.sqrt(boxzoomcleave.right*boxzoomcleave.right+boxzoomcleave.top*boxzoomcleave.top)
+		return LonLatWindow.makefromcap(lon,lat,math.degrees(math.asin(min(1.0,h)))+margin)
+	@staticmethod
+	def makefromzoom(lon,lat,zoom,margin=1.0): # what a BoxZoomCleave of 1/zoom can see, None if it's most of the hemisphere
+		if zoom<2: return None
+		radius=math.degrees(math.asin(min(1.0,math.sqrt(2.0)/zoom)))+margin
+		return LonLatWindow.makefromcap(lon,lat,radius)
+	def __init__(self):
+		self.mbrs=[]
+	def __str__(self):
+		a=[]
+		for m in self.mbrs: a.append(str(m))
+		return 'window: '+', '.join(a)
+	def isintersects(self,mbr):
+		for m in self.mbrs:
+			if m.isintersects(mbr): return True
+		return False
+
 class DegLonLat():
+	__slots__=('lon','lat','side','patchtype')
 	@staticmethod
 	def issame(one,two):
 		if one.lon==two.lon and one.lat==two.lat: return True
@@ -707,10 +830,14 @@ class Polygon():
 	@staticmethod
 	def make(shape,pointstart,pointlimit,index,partindex,ccwtype=NONE_CCWTYPE):
 		pg=Polygon(index,partindex,ccwtype)
-		for i in range(pointstart,pointlimit):
-			p=shape.pointlist[i]
-			pg.addDegLonLat(p)
+		if isinstance(shape.pointlist,PointList):
+			pg.points=shape.pointlist.getpart(pointstart,pointlimit)[:]
+		else:
+			for i in range(pointstart,pointlimit):
+				p=shape.pointlist[i]
+				pg.addDegLonLat(p)
 		pg.finish()
+		pg.source=(shape,pointstart,pointlimit)
 		return pg
 	@staticmethod
 	def makecheap(points):
@@ -730,21 +857,28 @@ class Polygon():
 		ccwtype=shape.ccwtypes.get(partindex,NONE_CCWTYPE)
 		return Polygon.make(shape,start,limit,shape.index,partindex,ccwtype)
 	@staticmethod
-	def issame(pg1,pg2):
+	def issame(pg1,pg2): # pg2 is pg1 with its points rotated
 		num=len(pg1.points)
 		if num!=len(pg2.points): return False
-		for i in range(num):
-			for j in range(num):
-				k=(i+j)%num
-				if not DegLonLat.issame(pg1.points[j],pg2.points[k]): break
-			else: return True
+		p=pg1.points[0] if num else None
+		lonlats1=None
+		for i in range(num): # only offsets where the first points match need a full check
+			if not DegLonLat.issame(p,pg2.points[i]): continue
+			if not lonlats1:
+				lonlats1=[]
+				for q in pg1.points: lonlats1.append((q.lon,q.lat))
+				lonlats2=[]
+				for q in pg2.points: lonlats2.append((q.lon,q.lat))
+			if lonlats2[i:]+lonlats2[:i]==lonlats1: return True
 		return False
 	@staticmethod
 	def isclose(pg1,pg2):
 		num=len(pg1.points)
 		if num!=len(pg2.points): return False
+		p=pg1.points[0] if num else None
 		for i in range(num):
-			for j in range(num):
+			if not DegLonLat.isclose(p,pg2.points[i]): continue
+			for j in range(1,num):
 				k=(i+j)%num
 				if not DegLonLat.isclose(pg1.points[j],pg2.points[k]): break
 			else: return True
@@ -823,6 +957,9 @@ class Polygon():
 			return (lats[lat],j)
 	def __init__(self,index,partindex,ccwtype=NONE_CCWTYPE):
 		self.points=[]
+		self.source=None # (shape,pointstart,pointlimit) if points came from shape.pointlist
+		self.sourceindices=None # for a getlod() copy, where each point is in PointList.getpart() of source
+		self.importance=None
 		self.index=index
 		self.partindex=partindex
 		self.ccwtype=ccwtype
@@ -833,6 +970,21 @@ class Polygon():
 		else:
 			lp=self.points[-1]
 			if p.lon!=lp.lon or p.lat!=lp.lat: self.points.append(p)
+	def getcap(self): # None if points didn't come from a shp
+		if not self.source or not isinstance(self.source[0].pointlist,PointList): return None
+		return Shape.getcap(*self.source)
+	def getimportance(self):
+		return importance_frompart(self)
+	def getlod(self,area): # self, or a copy without the points less important than area
+		r=lod_frompart(self,area,3)
+		if not r: return self
+		pg=Polygon(self.index,self.partindex,self.ccwtype)
+		pg.points=r[0]
+		pg.iscw=self.iscw
+		if r[1]!=None:
+			pg.source=self.source
+			pg.sourceindices=r[1]
+		return pg
 	def finish0(self):
 		lp=self.points[-1]
 		fp=self.points[0]
@@ -904,9 +1056,13 @@ class Polyline():
 	@staticmethod
 	def make(shape,pointstart,pointlimit,index,partindex):
 		pl=Polyline(index,partindex)
-		for i in range(pointstart,pointlimit):
-			p=shape.pointlist[i]
-			pl.addDegLonLat(p)
+		if isinstance(shape.pointlist,PointList):
+			pl.points=shape.pointlist.getpart(pointstart,pointlimit)[:]
+		else:
+			for i in range(pointstart,pointlimit):
+				p=shape.pointlist[i]
+				pl.addDegLonLat(p)
+		pl.source=(shape,pointstart,pointlimit)
 		return pl
 	@staticmethod
 	def makefrompoints(points,index,partindex):
@@ -922,6 +1078,9 @@ class Polyline():
 		return pl
 	def __init__(self,index,partindex):
 		self.points=[]
+		self.source=None
+		self.sourceindices=None
+		self.importance=None
 		self.index=index
 		self.partindex=partindex
 	def addDegLonLat(self,p):
@@ -929,6 +1088,19 @@ class Polyline():
 		else:
 			lp=self.points[-1]
 			if p.lon!=lp.lon or p.lat!=lp.lat: self.points.append(p)
+	def getcap(self):
+		if not self.source or not isinstance(self.source[0].pointlist,PointList): return None
+		return Shape.getcap(*self.source)
+	def getimportance(self):
+		return importance_frompart(self)
+	def getlod(self,area):
+		r=lod_frompart(self,area,2)
+		if not r: return self
+		pl=Polyline.makefrompoints(r[0],self.index,self.partindex)
+		if r[1]!=None:
+			pl.source=self.source
+			pl.sourceindices=r[1]
+		return pl
 	def print(self,index):
 		print('polyline '+str(index)+': '+str(len(self.points)))
 
@@ -1127,6 +1299,49 @@ class ShapePolyline():
 		self.pointlist.append(p)
 		self.pointscount+=1
 
+class PointList(): # read-only view of lon,lat pairs in a flat array, DegLonLat objects are made on first access
+	def __init__(self,coords,start,count):
+		self.coords=coords
+		self.start=start
+		self.count=count
+		self.cache=None # [DegLonLat or None]*count once anything is accessed, so a point is always the same object
+		self.parts={}
+	def __len__(self): return self.count
+	def __getitem__(self,i):
+		if isinstance(i,slice):
+			ret=[]
+			for j in range(*i.indices(self.count)): ret.append(self[j])
+			return ret
+		if i<0: i+=self.count
+		if i<0 or i>=self.count: raise IndexError
+		if not self.cache: self.cache=[None]*self.count
+		p=self.cache[i]
+		if not p:
+			j=(self.start+i)<<1
+			p=DegLonLat(self.coords[j],self.coords[j+1])
+			self.cache[i]=p
+		return p
+	def __iter__(self):
+		for i in range(self.count): yield self[i]
+	def getpart(self,start,limit): # points without repeats, as Polygon.addDegLonLat would keep them, made once
+		ret=self.parts.get((start,limit),None)
+		if ret!=None: return ret
+		ret=[]
+		lp=None
+		for i in range(start,limit):
+			p=self[i]
+			if lp and p.lon==lp.lon and p.lat==lp.lat: continue
+			ret.append(p)
+			lp=p
+		self.parts[(start,limit)]=ret
+		return ret
+	def getlonlat(self,i):
+		j=(self.start+i)<<1
+		return (self.coords[j],self.coords[j+1])
+	def addtombr(self,mbr,start,limit):
+		c=self.coords
+		for j in range((self.start+start)<<1,(self.start+limit)<<1,2): mbr.add(c[j],c[j+1])
+
 class Shape():
 	@staticmethod
 	def getpartstartlimit(shape,partindex):
@@ -1135,6 +1350,42 @@ class Shape():
 		start=shape.partlist[partindex]
 		return (start,limit)
 	@staticmethod
+	def getunitxyz(shape): # (lons,lats,unit xyz) numpy arrays for a PointList, made once per shape
+		if shape.unitxyz and shape.unitxyz[0] is shape.pointlist: return shape.unitxyz[1]
+		pl=shape.pointlist
+		lonlats=numpy.frombuffer(pl.coords,dtype=numpy.float64)[pl.start*2:(pl.start+pl.count)*2]
+		lons=lonlats[0::2]
+		lats=lonlats[1::2]
+		ret=(lons,lats,unitxyz_fromlonlats(lons,lats))
+		shape.unitxyz=(pl,ret)
+		return ret
+	@staticmethod
+	def getcap(shape,start,limit): # SphereCap of a part of a PointList, made once
+		if not shape.caps or shape.caps[0] is not shape.pointlist: shape.caps=(shape.pointlist,{})
+		caps=shape.caps[1]
+		cap=caps.get((start,limit),None)
+		if cap: return cap
+		if numpy and isnumpy_global: cap=SphereCap.makefromunitxyz(Shape.getunitxyz(shape)[2][:,start:limit])
+		else: cap=SphereCap.makefromlonlats(shape.pointlist,start,limit)
+		caps[(start,limit)]=cap
+		return cap
+	@staticmethod
+	def getimportance(shape,start,limit): # importance_frompoints() of a part of a PointList, made once
+		if not shape.importances or shape.importances[0] is not shape.pointlist: shape.importances=(shape.pointlist,{})
+		importances=shape.importances[1]
+		ret=importances.get((start,limit),None)
+		if ret: return ret
+		ret=importance_frompoints(shape.pointlist.getpart(start,limit))
+		importances[(start,limit)]=ret
+		return ret
+	@staticmethod
+	def getprepareds(shape): # PreparedPolygons for the first polygon of each ShapePlus, made once
+		if shape.prepareds and shape.prepareds[0] is shape.pointlist: return shape.prepareds[1]
+		ret=[]
+		for plus in ShapePlus.make(shape): ret.append(PreparedPolygon(plus.polygons[0]))
+		shape.prepareds=(shape.pointlist,ret)
+		return ret
+	@staticmethod
 	def make(index,shapenumber,shapedata):
 		ret=Shape(index,shapenumber)
 		ret.type=uint32_little(shapedata,0)
@@ -1169,9 +1420,51 @@ class Shape():
 		else:
 			raise ValueError
 		return ret
+	@staticmethod
+	def makeskipped(index,shapenumber,shapetype,mbr): # placeholder for a record that wasn't decoded, see Shp.loadshape
+		ret=Shape(index,shapenumber)
+		ret.type=shapetype
+		ret.isskipped=True
+		ret.ccwtypes={}
+		ret.partlist=[]
+		ret.pointlist=[]
+		ret.draworderlist=[]
+		ret.mbr=mbr
+		ret.partscount=0
+		ret.pointscount=0
+		return ret
+	@staticmethod
+	def makefrombuffer(index,shapenumber,data,offset,coords): # like make() but points are appended to coords and viewed with a PointList
+		ret=Shape(index,shapenumber)
+		ret.type=struct.unpack_from('<I',data,offset)[0]
+		if ret.type==POLYGON_TYPE_SHP or ret.type==POLYLINE_TYPE_SHP:
+			ret.ccwtypes={}
+			(minx,miny,maxx,maxy,ret.partscount,ret.pointscount)=struct.unpack_from('<4d2I',data,offset+4)
+			mbr=Mbr()
+			mbr.set(minx,miny,maxx,maxy)
+			ret.mbr=mbr
+			ret.partlist=list(struct.unpack_from('<%dI'%ret.partscount,data,offset+44))
+			ret.draworderlist=[0]*ret.partscount
+			start=offset+44+4*ret.partscount
+			ret.pointlist=PointList(coords,len(coords)>>1,ret.pointscount)
+			coords.frombytes(data[start:start+16*ret.pointscount])
+		elif ret.type==POINT_TYPE_SHP:
+			(x,y)=struct.unpack_from('<2d',data,offset+4)
+			ret.point=DegLonLat(x,y)
+			ret.draworder=0
+		elif ret.type==NULL_TYPE_SHP:
+			pass
+		else:
+			raise ValueError
+		return ret
 	def __init__(self,index,shapenumber):
 		self.index=index
 		self.number=shapenumber
+		self.isskipped=False
+		self.unitxyz=None
+		self.caps=None
+		self.importances=None
+		self.prepareds=None
 	def setdraworder(self,partidx,draworder):
 		if partidx<0:
 			if hasattr(self,'draworder'): self.draworder=draworder
@@ -1224,21 +1517,30 @@ class Shape():
 			else:
 				print('%d: %d points (%d..%d)'%(i,k-j,j,k),file=file)
 	def removepoints(self,start,count): # points shouldn't cross parts # TODO remove this
+		if isinstance(self.pointlist,PointList): self.pointlist=self.pointlist[:]
 		del self.pointlist[start:start+count]
 		self.pointscount-=count
 		for i in range(self.partscount):
 			if self.partlist[i]>start: self.partlist[i]-=count
 	def getmbr(self,partindices):
 		mbr=Mbr()
+		isview=isinstance(self.pointlist,PointList)
 		if partindices==-1:
-			for p in self.pointlist: mbr.add(p.lon,p.lat)
+			if isview: self.pointlist.addtombr(mbr,0,self.pointscount)
+			else:
+				for p in self.pointlist: mbr.add(p.lon,p.lat)
 		else:
 			for partidx in partindices:
 				if partidx<0:
-					for p in self.pointlist: mbr.add(p.lon,p.lat)
+					if isview: self.pointlist.addtombr(mbr,0,self.pointscount)
+					else:
+						for p in self.pointlist: mbr.add(p.lon,p.lat)
 				else:
 					limit=self.pointscount
 					if partidx+1<self.partscount: limit=self.partlist[partidx+1]
+					if isview:
+						self.pointlist.addtombr(mbr,self.partlist[partidx],limit)
+						continue
 					for ptidx in range(self.partlist[partidx],limit):
 						p=self.pointlist[ptidx]
 						mbr.add(p.lon,p.lat)
@@ -1257,6 +1559,8 @@ class Shp(): # don't try to extend shp, just store data as literally as possible
 		self.shapes=[]
 		self.installfile=installfile
 		self.bynickname={}
+		self.coords=None
+		self.offsets=None
 	def printinfo(self):
 		if self.installfile: f=self.installfile.open()
 		else: f=open(self.filename,"rb")
@@ -1284,25 +1588,113 @@ class Shp(): # don't try to extend shp, just store data as literally as possible
 			
 			offset+=8+rlength
 		f.close()
-	def loadshapes(self):
+	def readdata(self): # mmap if possible, zip members are read in one go
 		if self.installfile: f=self.installfile.open()
 		else: f=open(self.filename,"rb")
-		header=f.read(100)
-		bytes_filelength=2*uint32_big(header,24)
-		offset=100
-		index=0
-		while True:
-			if offset==bytes_filelength: break
-			f.seek(offset)
-			buff8=f.read(8)
-			rnumber=uint32_big(buff8,0)
-			rlength=2*uint32_big(buff8,4)
-			shapedata=f.read(rlength)
-			shape=Shape.make(index,rnumber,shapedata)
-			self.shapes.append(shape)
-			offset+=8+rlength
-			index+=1
+		data=None
+		if mmap:
+			try:
+				data=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+			except (OSError,ValueError):
+				pass
+		if data==None: data=f.read()
+		f.close()
+		return data
+	def loadindex(self,data=None): # record offsets, from the .shx file if there is one
+		if self.offsets!=None: return self.offsets
+		offsets=[]
+		f=None
+		if self.installfile: f=self.installfile.opencompanion('shx')
+		elif self.filename and os.path.isfile(self.filename[:-3]+'shx'): f=open(self.filename[:-3]+'shx','rb')
+		if f:
+			shx=f.read()
+			f.close()
+			bytes_filelength=2*uint32_big(shx,24)
+			for offset in range(100,bytes_filelength,8):
+				offsets.append(2*uint32_big(shx,offset))
+			if isverbose_global: print('Loaded %d record offsets from shx'%len(offsets),file=sys.stderr)
+		else:
+			isclose=False
+			if data==None:
+				data=self.readdata()
+				isclose=True
+			bytes_filelength=2*uint32_big(data,24)
+			offset=100
+			while offset<bytes_filelength:
+				offsets.append(offset)
+				offset+=8+2*uint32_big(data,offset+4)
+			if isclose and mmap and isinstance(data,mmap.mmap): data.close()
+		self.offsets=offsets
+		return offsets
+	@staticmethod
+	def getrecordmbr(data,offset): # offset is the start of record content, after the 8 byte header
+		shapetype=struct.unpack_from('<I',data,offset)[0]
+		if shapetype!=POLYGON_TYPE_SHP and shapetype!=POLYLINE_TYPE_SHP: return (shapetype,None)
+		mbr=Mbr()
+		mbr.set(*struct.unpack_from('<4d',data,offset+4))
+		return (shapetype,mbr)
+	def loadshapes(self,window=None): # window is a LonLatWindow, records outside it are left as placeholders
+		data=self.readdata()
+		coords=array.array('d')
+		if window:
+			skipped=0
+			for index,offset in enumerate(self.loadindex(data)):
+				rnumber=uint32_big(data,offset)
+				(shapetype,mbr)=Shp.getrecordmbr(data,offset+8)
+				if mbr and not window.isintersects(mbr):
+					shape=Shape.makeskipped(index,rnumber,shapetype,mbr)
+					skipped+=1
+				else:
+					shape=Shape.makefrombuffer(index,rnumber,data,offset+8,coords)
+				self.shapes.append(shape)
+			if isverbose_global: print('Skipped %d of %d records outside of %s'%(skipped,len(self.shapes),str(window)),file=sys.stderr)
+		else:
+			bytes_filelength=2*uint32_big(data,24)
+			offset=100
+			index=0
+			while True:
+				if offset>=bytes_filelength: break
+				(rnumber,rlength)=struct.unpack_from('>II',data,offset)
+				rlength*=2
+				shape=Shape.makefrombuffer(index,rnumber,data,offset+8,coords)
+				self.shapes.append(shape)
+				offset+=8+rlength
+				index+=1
+		if sys.byteorder=='big': coords.byteswap()
+		self.coords=coords
+		if mmap and isinstance(data,mmap.mmap): data.close()
+	def loadskipped(self,window=None): # decode placeholders from loadshapes(window) that are in the new window
+		indices=[]
+		for shape in self.shapes:
+			if not shape.isskipped: continue
+			if window and not window.isintersects(shape.mbr): continue
+			indices.append(shape.index)
+		if not indices: return indices
+		offsets=self.loadindex()
+		data=self.readdata()
+		coords=array.array('d')
+		for i in indices:
+			offset=offsets[i]
+			self.shapes[i]=Shape.makefrombuffer(i,uint32_big(data,offset),data,offset+8,coords)
+		if sys.byteorder=='big': coords.byteswap()
+		if mmap and isinstance(data,mmap.mmap): data.close()
+		if isverbose_global: print('Loaded %d skipped records'%len(indices),file=sys.stderr)
+		return indices
+	def loadshape(self,index): # decode one record, replacing a placeholder from loadshapes(window)
+		offsets=self.loadindex()
+		if self.installfile: f=self.installfile.open()
+		else: f=open(self.filename,"rb")
+		f.seek(offsets[index])
+		buff8=f.read(8)
+		rnumber=uint32_big(buff8,0)
+		rlength=2*uint32_big(buff8,4)
+		shapedata=f.read(rlength)
 		f.close()
+		coords=array.array('d')
+		shape=Shape.makefrombuffer(index,rnumber,shapedata,0,coords)
+		if sys.byteorder=='big': coords.byteswap()
+		if index<len(self.shapes): self.shapes[index]=shape
+		return shape
 	def setdraworder(self,index,partidx,draworder):
 		shape=self.shapes[index]
 		shape.setdraworder(partidx,draworder)
@@ -1317,6 +1709,214 @@ class Shp(): # don't try to extend shp, just store data as literally as possible
 		self.bynickname[nickname]=s
 		
 
+def unitxyz_fromlonlats(lons,lats): # numpy, a 3xN array
+	rlon=(lons*math.pi)/180.0
+	rlat=(lats*math.pi)/180.0
+	r=numpy.cos(rlat)
+	ret=numpy.empty((3,len(lons)))
+	ret[0]=r*numpy.cos(rlon)
+	ret[1]=r*numpy.sin(rlon)
+	ret[2]=numpy.sin(rlat)
+	return ret
+
+def issourcepoints(points,source,indices=None): # True if points are still the PointList.getpart() points of source (at indices), object by object
+	if not source or not isinstance(source[0].pointlist,PointList) or not points: return False
+	(shape,start,limit)=source
+	part=shape.pointlist.getpart(start,limit)
+	n=len(points)
+	if indices!=None:
+		if len(indices)!=n: return False
+		for i in range(n):
+			if points[i] is not part[indices[i]]: return False
+		return True
+	if not n<=len(part)<=n+1: return False # Polygon.finish0() drops the closing point
+	for i in range(n):
+		if points[i] is not part[i]: return False
+	return True
+
+def lonlats_frompoints(points,source,indices=None): # numpy lons and lats for Polygon/Polyline points, from the shape's arrays if points weren't changed
+	n=len(points)
+	if issourcepoints(points,source,indices):
+		(shape,start,limit)=source
+		(lons,lats,_)=Shape.getunitxyz(shape)
+		keep=numpy.ones(limit-start,dtype=bool) # same as getpart()
+		keep[1:]=(lons[start+1:limit]!=lons[start:limit-1])|(lats[start+1:limit]!=lats[start:limit-1])
+		idx=numpy.flatnonzero(keep)+start
+		if indices!=None: idx=idx[indices]
+		else: idx=idx[:n]
+		return (lons[idx],lats[idx])
+	lons=numpy.empty(n)
+	lats=numpy.empty(n)
+	for i,p in enumerate(points):
+		lons[i]=p.lon
+		lats[i]=p.lat
+	return (lons,lats)
+
+def importance_frompart(part): # Polygon.getimportance() and Polyline.getimportance(), shared through the shape if points came from a shp
+	if part.importance and part.importance[0] is part.points: return part.importance[1]
+	ret=None
+	if part.sourceindices==None and issourcepoints(part.points,part.source): ret=Shape.getimportance(*part.source)
+	if not ret: ret=importance_frompoints(part.points)
+	part.importance=(part.points,ret)
+	return ret
+
+def lod_frompart(part,area,minpoints): # (points,sourceindices) without the points less important than area, None to keep part
+	importance=importance_frompart(part)
+	points=[]
+	indices=[]
+	for i,p in enumerate(part.points):
+		if importance[i]>=area:
+			points.append(p)
+			indices.append(i)
+	if len(points)==len(part.points) or len(points)<minpoints: return None
+	if part.sourceindices!=None:
+		for j in range(len(indices)): indices[j]=part.sourceindices[indices[j]]
+	elif not issourcepoints(part.points,part.source): indices=None
+	return (points,indices)
+
+def importance_frompoints(points): # Visvalingam effective area of each point on the unit sphere, the ends are kept with inf
+	n=len(points)
+	ret=[math.inf]*n
+	if n<3: return ret
+	xs=[]
+	ys=[]
+	zs=[]
+	for p in points:
+		rlon=(p.lon*math.pi)/180.0
+		rlat=(p.lat*math.pi)/180.0
+		r=math.cos(rlat)
+		xs.append(r*math.cos(rlon))
+		ys.append(r*math.sin(rlon))
+		zs.append(math.sin(rlat))
+	def getarea(a,b,c):
+		(ux,uy,uz)=(xs[b]-xs[a],ys[b]-ys[a],zs[b]-zs[a])
+		(vx,vy,vz)=(xs[c]-xs[a],ys[c]-ys[a],zs[c]-zs[a])
+		cx=uy*vz-uz*vy
+		cy=uz*vx-ux*vz
+		cz=ux*vy-uy*vx
+		return 0.5*math.sqrt(cx*cx+cy*cy+cz*cz)
+	prev=list(range(-1,n-1))
+	next=list(range(1,n+1))
+	areas=[None]*n
+	heap=[]
+	for i in range(1,n-1):
+		a=getarea(i-1,i,i+1)
+		areas[i]=a
+		heap.append((a,i))
+	heapq.heapify(heap)
+	last=0.0
+	while heap:
+		(a,i)=heapq.heappop(heap)
+		if a!=areas[i]: continue # stale, the neighbors changed
+		areas[i]=None
+		if a<last: a=last # a point can't be less important than one removed before it
+		else: last=a
+		ret[i]=a
+		(l,r)=(prev[i],next[i])
+		next[l]=r
+		prev[r]=l
+		if l>0:
+			a=getarea(prev[l],l,r)
+			areas[l]=a
+			heapq.heappush(heap,(a,l))
+		if r<n-1:
+			a=getarea(l,r,next[r])
+			areas[r]=a
+			heapq.heappush(heap,(a,r))
+	return ret
+
+def getlodarea(width,height,boxzoomcleave=None): # the importance below which points are dropped, 0.0 if lodpixels_global isn't set
+	if not lodpixels_global: return 0.0
+	(right,top)=(1.0,1.0)
+	if boxzoomcleave: (right,top)=(boxzoomcleave.right,boxzoomcleave.top)
+	pixel=min((right*2)/width,(top*2)/height)
+	d=lodpixels_global*pixel
+	return 0.5*d*d
+
+class SphereCap(): # a circle on the unit sphere that holds every vertex of a part
+	def __init__(self,x,y,z,radius):
+		self.x=x
+		self.y=y
+		self.z=z
+		self.radius=radius
+	@staticmethod
+	def make(sx,sy,sz,n):
+		h=math.sqrt(sx*sx+sy*sy+sz*sz)
+		if h<=n*0.000001: return SphereCap(1.0,0.0,0.0,math.pi) # spread around the sphere
+		return SphereCap(sx/h,sy/h,sz/h,0.0)
+	@staticmethod
+	def makefromunitxyz(xyz): # numpy 3xN
+		n=len(xyz[0])
+		cap=SphereCap.make(float(xyz[0].sum()),float(xyz[1].sum()),float(xyz[2].sum()),n)
+		if cap.radius==0.0 and n:
+			d=float((xyz[0]*cap.x+xyz[1]*cap.y+xyz[2]*cap.z).min())
+			cap.radius=math.acos(max(-1.0,min(1.0,d)))+0.000000001
+		return cap
+	@staticmethod
+	def makefromlonlats(pointlist,start,limit):
+		xyzs=[]
+		(sx,sy,sz)=(0.0,0.0,0.0)
+		for i in range(start,limit):
+			(lon,lat)=pointlist.getlonlat(i)
+			rlon=(lon*math.pi)/180.0
+			rlat=(lat*math.pi)/180.0
+			r=math.cos(rlat)
+			(x,y,z)=(r*math.cos(rlon),r*math.sin(rlon),math.sin(rlat))
+			xyzs.append((x,y,z))
+			sx+=x
+			sy+=y
+			sz+=z
+		cap=SphereCap.make(sx,sy,sz,len(xyzs))
+		if cap.radius==0.0 and len(xyzs):
+			d=1.0
+			for (x,y,z) in xyzs: d=min(d,x*cap.x+y*cap.y+z*cap.z)
+			cap.radius=math.acos(max(-1.0,min(1.0,d)))+0.000000001
+		return cap
+	def getrange(self,row): # (min,max) of row.p for p in the cap, row is a unit vector
+		d=row[0]*self.x+row[1]*self.y+row[2]*self.z
+		a=math.acos(max(-1.0,min(1.0,d)))
+		return (math.cos(min(math.pi,a+self.radius)),math.cos(max(0.0,a-self.radius)))
+
+class SphereCull(): # uses SphereCaps to skip parts that are hidden and cleaves that wouldn't change anything
+	def __init__(self,rotation,boxzoomcleave=None,cornercleave=None):
+		self.rows=rotation.getmatrixrows()
+		self.boxzoomcleave=boxzoomcleave
+		self.cornercleave=cornercleave
+		if cornercleave and cornercleave.corner!=0: self.cornercleave=None
+		self.isusecorner=bool(cornercleave)
+	def checkcap(self,cap): # None if it's hidden, else (ishemi,iscorner,isbox) for the cleaves it needs
+		eps=0.000000001
+		(xmin,xmax)=cap.getrange(self.rows[0])
+		if xmax<-eps: return None
+		ishemi=xmin<=eps
+		if not self.boxzoomcleave and not self.cornercleave: return (ishemi,self.isusecorner,False)
+		(ymin,ymax)=cap.getrange(self.rows[1])
+		(zmin,zmax)=cap.getrange(self.rows[2])
+		isbox=False
+		bzc=self.boxzoomcleave
+		if bzc: # HemiCleave only pushes points away from the center, so outside stays outside
+			if ymin>bzc.right+eps or ymax<-bzc.right-eps or zmin>bzc.top+eps or zmax<-bzc.top-eps: return None
+			isbox=ishemi or not (ymax<bzc.right-eps and ymin>-bzc.right+eps and zmax<bzc.top-eps and zmin>-bzc.top+eps)
+		iscorner=self.isusecorner
+		cc=self.cornercleave
+		if cc:
+			if cc.xval>=0.0 and cc.yval<=0.0 and ymin>cc.xval+eps and zmax<cc.yval-eps: return None
+			iscorner=ishemi or not (ymax<cc.xval-eps or zmin>cc.yval+eps)
+		return (ishemi,iscorner,isbox)
+	def check(self,plus): # like checkcap() for a ShapePlus
+		if plus.type==POLYGON_TYPE_SHP: parts=plus.polygons
+		elif plus.type==POLYLINE_TYPE_SHP: parts=plus.polylines
+		else: return (True,True,True)
+		ret=None
+		for part in parts:
+			cap=part.getcap()
+			if not cap: return (True,True,True)
+			r=self.checkcap(cap)
+			if not r: continue
+			if not ret: ret=r
+			else: ret=(ret[0] or r[0],ret[1] or r[1],ret[2] or r[2])
+		return ret
+
 class SphereRotation():
 	def __init__(self):
 		self.isy=False
@@ -1344,6 +1944,30 @@ class SphereRotation():
 		self.c=math.sin(rlat)
 		self.e=math.cos(rlon)
 		self.f=math.sin(rlon)
+	def getmatrixrows(self): # xyz_fromdll() as a rotation of unit vectors
+		(a,c,e,f)=(1.0,0.0,1.0,0.0)
+		if self.isx:
+			rlon=(self.dlon*math.pi)/180.0
+			e=math.cos(rlon)
+			f=math.sin(rlon)
+		if self.isy: (a,c)=(self.a,self.c)
+		return ((a*e,a*f,c),(-f,e,0.0),(-c*e,-c*f,a))
+	def xyzs_fromlonlats(self,lons,lats): # xyz_fromdll() for numpy arrays, with the same float math
+		if self.isx: lons=lons-self.dlon
+		rlon=(lons*math.pi)/180.0
+		rlat=(lats*math.pi)/180.0
+		r=numpy.cos(rlat)
+		x=r*numpy.cos(rlon)
+		z=numpy.sin(rlat)
+		ret=numpy.empty((3,len(lons)))
+		ret[1]=r*numpy.sin(rlon)
+		if self.isy:
+			ret[0]=x*self.a+z*self.c
+			ret[2]=-x*self.c+z*self.a
+		else:
+			ret[0]=x
+			ret[2]=z
+		return ret
 	def xyz_fromdll(self,lon,lat):
 		if self.isx:
 			lon-=self.dlon
@@ -1370,7 +1994,7 @@ class SphereRotation():
 		if abs(r)<0.001:
 			lon=0.0
 		else:
-			lon=math.asin(y/r)
+			lon=math.asin(max(-1.0,min(1.0,y/r))) # y/r can round past 1
 			if x<0.0:
 				if lon<0.0: lon=-math.pi-lon
 				else: lon=math.pi-lon
@@ -1413,6 +2037,7 @@ class SphereRectangle():
 		return FlatRectangle( self.bottomleft.flatten(width,height,right,top), self.topright.flatten(width,height,right,top))
 
 class SpherePoint():
+	__slots__=('lon','lat','side','patchtype','x','y','z','next','ssindex','ux','uy') # next and ssindex are for Segments, ux and uy for flatten
 	@staticmethod
 	def makefromcircle(angledeg,rotation):
 		sp=SpherePoint()
@@ -1438,6 +2063,21 @@ class SpherePoint():
 	@staticmethod
 	def makefromdll(dll,rotation):
 		return SpherePoint.makefromlonlat(dll.lon,dll.lat,rotation)
+	@staticmethod
+	def makefromxyzs(dlls,xyzs): # a list of points from numpy 3xN xyz
+		ret=[]
+		(xs,ys,zs)=(xyzs[0].tolist(),xyzs[1].tolist(),xyzs[2].tolist())
+		for i,dll in enumerate(dlls):
+			sp=SpherePoint()
+			sp.patchtype=NONE_PATCHTYPE
+			sp.side=0
+			sp.lon=dll.lon
+			sp.lat=dll.lat
+			sp.x=xs[i]
+			sp.y=ys[i]
+			sp.z=zs[i]
+			ret.append(sp)
+		return ret
 	def print(self,file=sys.stdout):
 		print('point: %s' % (str(self)),file=file)
 	def __str__(self): return '(%.1f,%.1f):(%.3f,%.3f,%.3f)%s'%(self.lon,self.lat,self.x,self.y,self.z,patchtype_tostring(self.patchtype))
@@ -1468,6 +2108,7 @@ class SpherePoint():
 		
 
 class MercatorPoint():
+	__slots__=('lon','lat','side','patchtype','next','ssindex')
 	def __init__(self,obj):
 		if isinstance(obj,DegLonLat):
 			dll=obj
@@ -1491,6 +2132,7 @@ def TripelPoint(a): return MercatorPoint(a)
 
 
 class FlatPoint():
+	__slots__=('ux','uy','patchtype')
 	@staticmethod
 	def distance2(ux1,uy1,ux2,uy2):
 		dx=ux2-ux1
@@ -1604,6 +2246,10 @@ class BoxZoomCleave():
 		flatpoint=spherepoint.flatten(self.width,self.height,self.right,self.top)
 		if self.shift: flatpoint.shift(self.shift)
 		return flatpoint
+	def getnegpos(self,xyzs):
+		a=xyzs[2] if self.isz else xyzs[1]
+		if self.ishigh: return (a>self.val,a<self.val)
+		return (a<self.val,a>self.val)
 	def stitchsegments(self,one,two,onecrossu,twocrossu):
 		if self.isz: one.patchtype=HORIZ_PATCHTYPE
 		else: one.patchtype=VERT_PATCHTYPE
@@ -1834,7 +2480,7 @@ class AutoZoom():
 		bzc=BoxZoomCleave(boxw,boxh,width,height,splitlimit)
 		return bzc
 
-class SvgFragment():
+class SvgPath(): # points are kept as flat int lists, write() reduces inline points and encodes each fragment in one pass
 	@staticmethod
 	def isinline(x1,y1,x2,y2,x3,y3):
 		dx=x3-x1
@@ -1848,128 +2494,126 @@ class SvgFragment():
 			ex=dxdy*(y2-y1)+x1
 			if abs(ex-x2)<0.2: return True
 		return False
-	@staticmethod
-	def inlinecount(points,start):
-		num=0
-		k=len(points)
-		stop=start+2
-		p=points[start]
-		x1=p[0]
-		y1=p[1]
-		startp1=start+1
-		while True:
-			if stop>=k: return num
-			p=points[stop]
-			x3=p[0]
-			y3=p[1]
-			if x1==x3 and y1==y3: return num
-			for j in range(startp1,stop):
-				p=points[j]
-				if not SvgFragment.isinline(x1,y1,p[0],p[1],x3,y3): return num
-			num+=1
-			stop+=1
-	def __init__(self):
-		self.isclosed=False
-		self.isreduced=False
-		self.points=[]
-	def reduce(self,isforce):
-#		print('Reducing points: ',self.points,file=sys.stderr) #cdebug
-		if self.isclosed:
-			while True:
-				if len(self.points)>1 and self.points[0]==self.points[-1]:
-					self.points.pop()
-					continue
-				break
-
-		if True: # TODO make another version for self.isclosed
-			# this always preserves first and last points, ignoring if they are inline
-			k=len(self.points) -1
-			i=0
-			while i<k:
-				j=SvgFragment.inlinecount(self.points,i)
-				if j>0:
-					del self.points[i+1:i+j+1]
-					k-=j
-				i+=1
-
-		if not isforce:
-			if len(self.points)<2: self.points=[]
-
-class SvgPath():
 	def __init__(self,cssclass):
 		self.cssclass=cssclass
-		self.fragments=[]
-		self._addfragment()
-	def _addfragment(self):
-		fragment=SvgFragment()
-		self.curfragment=fragment
-		self.fragments.append(fragment)
+		self.xs=[]
+		self.ys=[]
+		self.starts=[0]
+		self.closeds=[False]
 	def moveto(self,x,y):
-		if len(self.curfragment.points)!=0: self._addfragment()
-		self.curfragment.points.append((int(x),int(y)))
+		if len(self.xs)!=self.starts[-1]:
+			self.starts.append(len(self.xs))
+			self.closeds.append(False)
+		self.xs.append(int(x))
+		self.ys.append(int(y))
 	def lineto(self,x,y):
-		self.curfragment.points.append((int(x),int(y)))
+		self.xs.append(int(x))
+		self.ys.append(int(y))
 	def closepath(self):
-		self.curfragment.isclosed=True
+		self.closeds[-1]=True
+	def addring(self,points): # moveto, lineto and closepath for a list of FlatPoints
+		self.moveto(points[0].ux,points[0].uy)
+		xs=self.xs
+		ys=self.ys
+		for i in range(1,len(points)):
+			p=points[i]
+			xs.append(int(p.ux))
+			ys.append(int(p.uy))
+		self.closeds[-1]=True
+	def isinlineall(self,a,stop): # every point between a and stop is inline, this is the float test that encode() narrows down
+		xs=self.xs
+		ys=self.ys
+		(x1,y1,x3,y3)=(xs[a],ys[a],xs[stop],ys[stop])
+		for j in range(a+1,stop):
+			if not SvgPath.isinline(x1,y1,xs[j],ys[j],x3,y3): return False
+		return True
+	def encode(self,d,start,limit,isclosed,isforce): # appends the path data for one fragment to d
+		xs=self.xs
+		ys=self.ys
+		if isclosed:
+			while limit-start>1 and xs[limit-1]==xs[start] and ys[limit-1]==ys[start]: limit-=1
+		n=limit-start
+		if n==0: return
+		if n<2:
+			if isforce: d.append('M%d,%d'%(xs[start],ys[start])+'h1') # forces drawing of the pixel
+			return
+		d.append('M%d,%d'%(xs[start],ys[start]))
+# Points between an anchor and a candidate are dropped if each is within 0.2 of the line, measured along
+# the candidate's minor axis. For each axis, that's an interval of slopes, kept as exact fractions with
+# positive denominators and narrowed as points are added. A candidate exactly on an edge gets the float test.
+		a=start
+		last=limit-1
+		while a<last:
+			x1=xs[a]
+			y1=ys[a]
+			(isx,isy,hasx,hasy)=(True,True,False,False)
+			stop=a+2
+			while stop<limit:
+				u=xs[stop-1]-x1
+				v=ys[stop-1]-y1
+				if isx and u:
+					if u>0: (ln,ld,hn,hd)=(5*v-1,5*u,5*v+1,5*u)
+					else: (ln,ld,hn,hd)=(-5*v-1,-5*u,-5*v+1,-5*u)
+					if not hasx:
+						(xln,xld,xhn,xhd)=(ln,ld,hn,hd)
+						hasx=True
+					else:
+						if ln*xld>xln*ld: (xln,xld)=(ln,ld)
+						if hn*xhd<xhn*hd: (xhn,xhd)=(hn,hd)
+					if xln*xhd>xhn*xld: isx=False
+				elif v: isx=False
+				if isy and v:
+					if v>0: (ln,ld,hn,hd)=(5*u-1,5*v,5*u+1,5*v)
+					else: (ln,ld,hn,hd)=(-5*u-1,-5*v,-5*u+1,-5*v)
+					if not hasy:
+						(yln,yld,yhn,yhd)=(ln,ld,hn,hd)
+						hasy=True
+					else:
+						if ln*yld>yln*ld: (yln,yld)=(ln,ld)
+						if hn*yhd<yhn*hd: (yhn,yhd)=(hn,hd)
+					if yln*yhd>yhn*yld: isy=False
+				elif u: isy=False
+				dx=xs[stop]-x1
+				dy=ys[stop]-y1
+				if not dx and not dy: break
+				if abs(dx)>abs(dy):
+					if not isx: break
+					if hasx:
+						c1=dy*xld-xln*dx
+						c2=xhn*dx-dy*xhd
+						if dx<0: (c1,c2)=(-c1,-c2)
+						if c1<0 or c2<0: break
+						if (not c1 or not c2) and not self.isinlineall(a,stop): break
+				else:
+					if not isy: break
+					if hasy:
+						c1=dx*yld-yln*dy
+						c2=yhn*dy-dx*yhd
+						if dy<0: (c1,c2)=(-c1,-c2)
+						if c1<0 or c2<0: break
+						if (not c1 or not c2) and not self.isinlineall(a,stop): break
+				stop+=1
+			k=stop-1
+			if xs[k]==x1: d.append('v%d'%(ys[k]-y1))
+			elif ys[k]==y1: d.append('h%d'%(xs[k]-x1))
+			else: d.append('l%d,%d'%(xs[k]-x1,ys[k]-y1))
+			a=k
+		if isclosed: d.append('Z')
+	def getd(self,isforce=False):
+		d=[]
+		starts=self.starts
+		for i in range(len(starts)):
+			limit=starts[i+1] if i+1<len(starts) else len(self.xs)
+			self.encode(d,starts[i],limit,self.closeds[i],isforce)
+		return d
 	def write(self,output,isforce=False):
-		found=0
-		for fragment in self.fragments:
-			if not fragment.isreduced:
-				fragment.reduce(isforce)
-				fragment.isreduced=True
-			found+=len(fragment.points)
-		if not found: return
+		d=self.getd(isforce)
+		if not d: return
 		output.newpath(self.cssclass)
-		for fragment in self.fragments:
-			points=fragment.points
-			if len(points)==0: continue
-			p=points[0]
-			if False: # human readable for debugging #ldebug
-				output.addtopath('M %d,%d'%(p[0],p[1]))
-				for i in range(1,len(points)):
-					p=points[i]
-					output.addtopath('\n L %d,%d'%(p[0],p[1]))
-			else:
-				output.addtopath('M%d,%d'%(p[0],p[1]))
-				for i in range(1,len(points)):
-					p=points[i]
-					q=points[i-1]
-					if p[0]==q[0]:
-						output.addtopath('v%d'%(p[1]-q[1]))
-					elif p[1]==q[1]:
-						output.addtopath('h%d'%(p[0]-q[0]))
-					else:
-						output.addtopath('l%d,%d'%(p[0]-q[0],p[1]-q[1]))
-			if len(points)<2:
-				output.addtopath('h1') # isforce, forces drawing of the pixel
-			elif fragment.isclosed:
-				output.addtopath('Z')
+		output.addtopath(''.join(d))
 	def write_raw(self,output):
 		output.print0('<path class=\"'+self.cssclass+'\" d=\"')
-		for fragment in self.fragments:
-			if not fragment.isreduced:
-				fragment.reduce()
-				fragment.isreduced=True
-			points=fragment.points
-			if len(points)==0: continue
-			p=points[0]
-			if True:
-				output.print0('M%d,%d'%(p[0],p[1]))
-				for i in range(1,len(points)):
-					p=points[i]
-					q=points[i-1]
-					if p[0]==q[0]:
-						output.print0('v%d'%(p[1]-q[1]))
-					elif p[1]==q[1]:
-						output.print0('h%d'%(p[0]-q[0]))
-					else:
-						output.print0('l%d,%d'%(p[0]-q[0],p[1]-q[1]))
-			else: # human readable for debugging
-				output.print0('M %d,%d'%(p[0],p[1]))
-				for i in range(1,len(points)):
-					p=points[i]
-					output.print(' L %d,%d'%(p[0],p[1]))
-			if fragment.isclosed: output.print0('Z')
+		output.print0(''.join(self.getd()))
 		output.print('\"/>')
 
 class SvgPolyline():
@@ -2034,24 +2678,14 @@ class FlatShape():
 	def cutout_printsvg(self,output,cssclass):
 		svg=SvgPath(cssclass)
 		for pg in self.polygons:
-			p=pg.points[0]
-			svg.moveto(p.ux,p.uy)
-			for j in range(1,len(pg.points)):
-				p=pg.points[j]
-				svg.lineto(p.ux,p.uy)
-			svg.closepath()
+			svg.addring(pg.points)
 		svg.write(output)
 	def path_printsvg(self,output,cssclass,cssreverse,isforcedpixel):
 		hasreverse=False
 		svg=SvgPath(cssclass)
 		i=0
 		pg=self.polygons[i]
-		p=pg.points[0]
-		svg.moveto(p.ux,p.uy)
-		for j in range(1,len(pg.points)):
-			p=pg.points[j]
-			svg.lineto(p.ux,p.uy)
-		svg.closepath()
+		svg.addring(pg.points)
 		while True:
 			i+=1
 			if i==len(self.polygons): break
@@ -2060,24 +2694,14 @@ class FlatShape():
 			if cssreverse and pg.ccwtype==REVERSE_CCWTYPE:
 				hasreverse=True
 				continue
-			p=pg.points[0]
-			svg.moveto(p.ux,p.uy)
-			for j in range(1,len(pg.points)):
-				p=pg.points[j]
-				svg.lineto(p.ux,p.uy)
-			svg.closepath()
+			svg.addring(pg.points)
 		svg.write(output,isforce=isforcedpixel)
 		if hasreverse:
 			svg=SvgPath(cssreverse)
 			for i in range(1,len(self.polygons)):
 				pg=self.polygons[i]
 				if pg.ccwtype!=REVERSE_CCWTYPE: continue
-				p=pg.points[0]
-				svg.moveto(p.ux,p.uy)
-				for j in range(1,len(pg.points)):
-					p=pg.points[j]
-					svg.lineto(p.ux,p.uy)
-				svg.closepath()
+				svg.addring(pg.points)
 			svg.write(output,isforce=isforcedpixel)
 	def border_printsvg(self,output,csspatch,cssborder):
 		svg=None
@@ -2265,9 +2889,10 @@ class Intersections():
 				return i
 			if pside==side: (px,py,pz)=(nx,ny,nz)
 			else: (qx,qy,qz)=(nx,ny,nz)
-	def __init__(self,cleave,segments,limit=None):
+	def __init__(self,cleave,segments=None,limit=None): # segments=None to fill list yourself
 		self.cleave=cleave
 		self.list=[]
+		if not segments: return
 		s=segments.first # doesn't start with a side:0
 		if limit==None: limit=s
 		while True:
@@ -2358,7 +2983,9 @@ class WebMercatorCleave():
 		x=s.lon+t*dx
 		y=v
 
-		i=DegLonLat(x,y)
+		i=MercatorPoint(None)
+		i.lon=x
+		i.lat=y
 		i.side=0
 		i.patchtype=s.patchtype # s0 will change later after stitching
 		return i
@@ -2385,6 +3012,8 @@ class HemiCleave():
 		if hasneg and haspos: return 0
 		if hasneg: return 1
 		return 2
+	def getnegpos(self,xyzs): # setsides() for numpy xyz, boolean arrays for side -1 and side 1
+		return (xyzs[0]<0.0,xyzs[0]>0.0)
 	def stitchsegments(self,one,two,onecrossu,twocrossu):
 		one.patchtype=HEMI_PATCHTYPE
 		one.next=two
@@ -2513,10 +3142,583 @@ class SegmentSet():
 		for seg in oldlist:
 			if seg.hasposside(): self.list.append(seg)
 
+class ArrayCleave(): # SpherePolygon.cleave() for numpy xyz, gives the same points as Segments and SegmentSet.split2()
+	def __init__(self,c,spherepolygon,neg,pos):
+		self.c=c
+		self.spherepolygon=spherepolygon
+		xyzs=spherepolygon.xyzs
+		self.n=len(xyzs[0])
+		self.xyzs=xyzs
+		sides=numpy.zeros(self.n,dtype=numpy.int8)
+		sides[neg]=-1
+		sides[pos]=1
+		self.sides=sides
+		self.points={} # SpherePoints made so far, by vertex index
+	def getpoint(self,i):
+		p=self.points.get(i,None)
+		if p: return p
+		dll=self.spherepolygon.polygon.points[i]
+		p=SpherePoint()
+		p.patchtype=NONE_PATCHTYPE
+		p.side=int(self.sides[i])
+		p.lon=dll.lon
+		p.lat=dll.lat
+		p.x=float(self.xyzs[0][i])
+		p.y=float(self.xyzs[1][i])
+		p.z=float(self.xyzs[2][i])
+		self.points[i]=p
+		return p
+	def getpoints(self,start,stop,ret): # vertices start..stop inclusive, wrapping around
+		if stop<start:
+			self.getpoints(start,self.n-1,ret)
+			start=0
+		if stop-start<8:
+			for i in range(start,stop+1): ret.append(self.getpoint(i))
+			return
+		dlls=self.spherepolygon.polygon.points
+		xs=self.xyzs[0][start:stop+1].tolist()
+		ys=self.xyzs[1][start:stop+1].tolist()
+		zs=self.xyzs[2][start:stop+1].tolist()
+		sides=self.sides[start:stop+1].tolist()
+		for j in range(stop+1-start):
+			p=self.points.get(start+j,None)
+			if not p:
+				dll=dlls[start+j]
+				p=SpherePoint()
+				p.patchtype=NONE_PATCHTYPE
+				p.side=sides[j]
+				p.lon=dll.lon
+				p.lat=dll.lat
+				p.x=xs[j]
+				p.y=ys[j]
+				p.z=zs[j]
+			ret.append(p)
+	def getcrossings(self): # [(s,n),...] vertex indices around each crossing, None if there's a side:0 touch that doesn't cross
+		nz=numpy.flatnonzero(self.sides)
+		sa=self.sides[nz]
+		nb=numpy.roll(nz,-1)
+		sb=numpy.roll(sa,-1)
+		gap=(nb-nz)%self.n!=1
+		events=numpy.flatnonzero((sa!=sb)|gap)
+		if (sa[events]==sb[events]).any(): return None
+		ret=[]
+		for e in events.tolist(): ret.append((int(nz[e]),int(nb[e])))
+		return ret
+	def addpiece(self,j,points,isotherzero=True): # piece j is otherzero of crossing j, vertices up to firstzero of crossing j+1 and any midpoint
+		k=len(self.crossings)
+		if isotherzero: points.append(self.otherzeros[j])
+		self.getpoints(self.crossings[j][1],self.crossings[(j+1)%k][0],points)
+		points.append(self.firstzeros[(j+1)%k])
+		if self.mids[j]: points.append(self.mids[j])
+	def cleave(self): # a list of SpherePolygon, None if Segments should be used instead
+		c=self.c
+		n=self.n
+		crossings=self.getcrossings()
+		if crossings==None or len(crossings)%2: return None
+		self.crossings=crossings
+		k=len(crossings)
+		self.firstzeros=[]
+		self.otherzeros=[]
+		intersections=Intersections(c)
+		for j,(s,nxt) in enumerate(crossings):
+			if (s+1)%n==nxt: # same as Intersections(), no side:0 vertex between them
+				firstzero=c.makeintersectionpoint(self.getpoint(s),self.getpoint(nxt))
+				otherzero=firstzero.clone()
+			else:
+				firstzero=self.getpoint((s+1)%n)
+				if (s+2)%n==nxt: otherzero=firstzero.clone()
+				else: otherzero=self.getpoint((nxt-1)%n)
+			self.firstzeros.append(firstzero)
+			self.otherzeros.append(otherzero)
+			x=Intersection(self.getpoint(s),firstzero,otherzero,self.getpoint(nxt))
+			x.index=j
+			intersections.list.append(x)
+		c.setcrossus(intersections,self.spherepolygon)
+		intersections.sort()
+		nextpiece=[]
+		for j in range(k): nextpiece.append((j+1)%k)
+		labels=[0]*k # SegmentSet index of each piece
+		self.mids=[None]*k
+		starts=[None] # SegmentSet.list, as (crossing,isfroms)
+		m=0
+		while m<k:
+			one=intersections.list[m]
+			two=intersections.list[m+1]
+			(a,b)=(one.index,two.index)
+			index=labels[(a-1)%k]
+			if index!=labels[(b-1)%k]: raise ValueError
+			c.stitchsegments(one.s0,two.n0,one.crossu,two.crossu)
+			c.stitchsegments(two.s0,one.n0,two.crossu,one.crossu)
+			if one.s0.next is not two.n0: self.mids[(a-1)%k]=one.s0.next
+			if two.s0.next is not one.n0: self.mids[(b-1)%k]=two.s0.next
+			nextpiece[(a-1)%k]=b
+			nextpiece[(b-1)%k]=a
+			starts[index]=(a,True)
+			newindex=len(starts)
+			starts.append((a,False))
+			j=a
+			while True:
+				labels[j]=newindex
+				j=nextpiece[j]
+				if j==a: break
+			m+=2
+		ret=[]
+		for (a,isfroms) in starts:
+			points=[]
+			if isfroms: # from s of crossing a, near the end of piece a-1
+				last=(a-1)%k
+				s=crossings[a][0]
+				points.append(self.getpoint(s))
+				points.append(self.firstzeros[a])
+				if self.mids[last]: points.append(self.mids[last])
+				j=nextpiece[last]
+				while j!=last:
+					self.addpiece(j,points)
+					j=nextpiece[j]
+				points.append(self.otherzeros[last])
+				if crossings[last][1]!=s: self.getpoints(crossings[last][1],(s-1)%n,points)
+			else: # from n of crossing a
+				self.addpiece(a,points,False)
+				j=nextpiece[a]
+				while j!=a:
+					self.addpiece(j,points)
+					j=nextpiece[j]
+				points.append(self.otherzeros[a])
+			for p in points:
+				if p.side>0: break
+			else: continue # SegmentSet.culllist()
+			pg=SpherePolygon(self.spherepolygon.polygon,self.spherepolygon.rotation)
+			pg.points=points
+			ret.append(pg)
+		return ret
+
+class ViewCrossing(): # where a part crosses the edge of a ViewCleave
+	@staticmethod
+	def sortkey(o): return (o.th,o.dth)
+	def __init__(self,th,dth,point):
+		self.th=th
+		self.dth=dth
+		self.point=point
+
+class ViewCleave(): # HemiCleave, CornerCleave and BoxZoomCleave in one pass over each part
+	def __init__(self,boxzoomcleave=None,cornercleave=None):
+		self.hemicleave=HemiCleave()
+		self.boxzoomcleave=boxzoomcleave
+		self.cornercleave=cornercleave
+		self.isright=bool(boxzoomcleave) and boxzoomcleave.right!=1
+		self.istop=bool(boxzoomcleave) and boxzoomcleave.top!=1
+		if self.isright: self.right=boxzoomcleave.right
+		if self.istop: self.top=boxzoomcleave.top
+		self.iscorner=bool(cornercleave)
+		self.isonepass=self.isright or self.istop or self.iscorner
+		if self.iscorner:
+			self.xval=cornercleave.xval
+			self.yval=cornercleave.yval
+			# the view has to be star shaped around its center for crossings to sort by angle
+			if cornercleave.corner!=0 or self.xval<0.0 or self.yval>0.0: self.isonepass=False
+		if self.isonepass: self.setangles()
+	def getboundary(self,th): # (distance from the center,patchtype) of the view's edge at angle th
+		c=math.cos(th)
+		s=math.sin(th)
+		d=1.0
+		patchtype=HEMI_PATCHTYPE
+		if self.isright and d*abs(c)>self.right:
+			d=self.right/abs(c)
+			patchtype=VERT_PATCHTYPE
+		if self.istop and d*abs(s)>self.top:
+			d=self.top/abs(s)
+			patchtype=HORIZ_PATCHTYPE
+		if self.iscorner and c>0.0 and s<0.0:
+			a=self.xval/c
+			b=self.yval/s
+			if a>=b:
+				if a<d: (d,patchtype)=(a,VERT_PATCHTYPE)
+			elif b<d: (d,patchtype)=(b,HORIZ_PATCHTYPE)
+		return (d,patchtype)
+	def setangles(self): # angles where the view's edge can change patchtype, and more for long horizon arcs
+		angles=[]
+		for k in range(8):
+			th=(k*math.pi)/4
+			if self.getboundary(th)[1]==HEMI_PATCHTYPE: angles.append(th)
+		(right,top)=(1.0,1.0)
+		if self.isright:
+			right=self.right
+			if right<1:
+				h=math.sqrt(1-right*right)
+				angles.extend([math.atan2(h,right),math.atan2(-h,right),math.atan2(h,-right),math.atan2(-h,-right)])
+		if self.istop:
+			top=self.top
+			if top<1:
+				w=math.sqrt(1-top*top)
+				angles.extend([math.atan2(top,w),math.atan2(-top,w),math.atan2(top,-w),math.atan2(-top,-w)])
+		if self.isright and self.istop:
+			angles.extend([math.atan2(top,right),math.atan2(-top,right),math.atan2(top,-right),math.atan2(-top,-right)])
+		if self.iscorner:
+			(xval,yval)=(self.xval,self.yval)
+			angles.append(math.atan2(yval,xval))
+			if xval<1: angles.append(math.atan2(-min(top,math.sqrt(1-xval*xval)),xval))
+			if yval>-1: angles.append(math.atan2(yval,min(right,math.sqrt(1-yval*yval))))
+		self.angles=[]
+		for th in angles:
+			th=th%math.tau
+			if th not in self.angles: self.angles.append(th)
+		self.angles.sort()
+	def makeboundarypoint(self,th,patchtype=NONE_PATCHTYPE):
+		(d,_)=self.getboundary(th)
+		p=SpherePoint()
+		p.lon=0
+		p.lat=0
+		p.side=0
+		p.y=d*math.cos(th)
+		p.z=d*math.sin(th)
+		p.x=math.sqrt(max(0.0,1-p.y*p.y-p.z*p.z))
+		p.patchtype=patchtype
+		return p
+	def getoutcode(self,x,y,z): # like classify(), 0 if the point is in view
+		code=0
+		if x<0.0: code=1
+		if self.isright:
+			if y>self.right: code+=2
+			elif y<-self.right: code+=4
+		if self.istop:
+			if z>self.top: code+=8
+			elif z<-self.top: code+=16
+		if self.iscorner and y>self.xval and z<self.yval: code+=32
+		return code
+	def isnotchsafe(self,y1,z1,y2,z2): # True if the edge can't cut through the corner
+		if not self.iscorner: return True
+		return (y1<=self.xval and y2<=self.xval) or (z1>=self.yval and z2>=self.yval)
+	def getintervals(self,x1,y1,z1,x2,y2,z2): # [(ta,tb),...], the parts of the chord that are in view
+		t0=0.0
+		t1=1.0
+		forms=[(x1,x2)]
+		if self.isright: forms.extend([(self.right-y1,self.right-y2),(self.right+y1,self.right+y2)])
+		if self.istop: forms.extend([(self.top-z1,self.top-z2),(self.top+z1,self.top+z2)])
+		for (f0,f1) in forms:
+			if f0<0.0:
+				if f1<0.0: return []
+				t=f0/(f0-f1)
+				if t>t0: t0=t
+			elif f1<0.0:
+				t=f0/(f0-f1)
+				if t<t1: t1=t
+		if t0>t1: return []
+		if not self.iscorner: return [(t0,t1)]
+		qa=0.0
+		qb=1.0
+		for (f0,f1) in ((y1-self.xval,y2-self.xval),(self.yval-z1,self.yval-z2)):
+			if f0<0.0:
+				if f1<0.0: return [(t0,t1)]
+				t=f0/(f0-f1)
+				if t>qa: qa=t
+			elif f1<0.0:
+				t=f0/(f0-f1)
+				if t<qb: qb=t
+		if qa>qb: return [(t0,t1)]
+		isa=qa==0.0 and y1>self.xval and z1<self.yval # a vertex inside the corner is itself cut
+		isb=qb==1.0 and y2>self.xval and z2<self.yval
+		if qa==qb and not isa and not isb: return [(t0,t1)]
+		ret=[]
+		if t0<qa or (t0==qa and not isa): ret.append((t0,min(t1,qa)))
+		if qb<t1 or (qb==t1 and not isb): ret.append((max(t0,qb),t1))
+		return ret
+	def makecrossing(self,xs,ys,zs,i,j,t,tin): # where edge i,j crosses the view's edge at t, tin is a bit further in view
+		y=ys[i]+t*(ys[j]-ys[i])
+		z=zs[i]+t*(zs[j]-zs[i])
+		if y==0.0 and z==0.0: return None
+		th=math.atan2(z,y)%math.tau
+		dth=math.atan2(zs[i]+tin*(zs[j]-zs[i]),ys[i]+tin*(ys[j]-ys[i]))-th # breaks ties between crossings at the same point
+		if dth>math.pi: dth-=math.tau
+		elif dth<=-math.pi: dth+=math.tau
+		return ViewCrossing(th,dth,self.makeboundarypoint(th))
+	def getpieces(self,n,xs,ys,zs,inside,hards,isloop):
+		# [[items,entry,exit],...], items are vertex ranges (a,b) and SpherePoints, entry and exit are ViewCrossings or None
+		# None if the floats don't add up, the cleaves one at a time can handle those
+		pieces=[]
+		cur=None
+		if inside[0]: cur=[[],None,None]
+		last=0
+		for i in hards: # the vertices between hards are all in view or all out
+			if inside[i]:
+				if not cur: return None
+				cur[0].append((last,i))
+			j=i+1
+			if j==n: j=0
+			for (ta,tb) in self.getintervals(xs[i],ys[i],zs[i],xs[j],ys[j],zs[j]):
+				tin=(ta+tb)/2
+				if ta!=0.0 or not inside[i]:
+					if cur: return None
+					e=self.makecrossing(xs,ys,zs,i,j,ta,tin)
+					if not e: return None
+					cur=[[e.point],e,None]
+				if tb!=1.0 or not inside[j]:
+					if not cur: return None
+					e=self.makecrossing(xs,ys,zs,i,j,tb,tin)
+					if not e: return None
+					if cur[1] and cur[1].th==e.th and len(cur[0])<3 and (len(cur[0])==1 or cur[0][1][0]==cur[0][1][1]):
+						cur=None # just touching the view's edge
+						continue
+					cur[0].append(e.point)
+					cur[2]=e
+					pieces.append(cur)
+					cur=None
+			last=i+1
+		if last<n and inside[last]:
+			if not cur: return None
+			cur[0].append((last,n-1))
+		if not isloop:
+			if cur: pieces.append(cur)
+			return pieces
+		if cur:
+			if not pieces:
+				if cur[1]: return None
+				return [cur] # nothing crossed
+			if pieces[0][1] or not cur[1]: return None
+			first=pieces[0]
+			cur[0].extend(first[0])
+			first[0]=cur[0]
+			first[1]=cur[1]
+		if pieces and not pieces[0][1]: return None
+		return pieces
+	def getarcpoints(self,tha,thb,isup): # boundary points from angle tha to thb, patchtypes set for the arc after each
+		ths=[tha]
+		if isup:
+			if thb<=tha: thb+=math.tau
+			for th in self.angles:
+				if th<=tha: th+=math.tau
+				if th<thb: ths.append(th)
+			ths.sort()
+		else:
+			if thb>=tha: thb-=math.tau
+			for th in self.angles:
+				if th>=tha: th-=math.tau
+				if th>thb: ths.append(th)
+			ths.sort(reverse=True)
+		ths.append(thb)
+		ret=[]
+		for k in range(len(ths)-1):
+			patchtype=self.getboundary((ths[k]+ths[k+1])/2)[1]
+			if k: ret.append(self.makeboundarypoint(ths[k],patchtype))
+			else: ret.append(patchtype)
+		return ret
+	def getenclosing(self,spherepolygon): # for a polygon that doesn't cross the view's edge, [] or the whole edge
+		polygon=spherepolygon.polygon
+		rotation=spherepolygon.rotation
+		angles=self.angles
+		k=len(angles)
+		for i in range(k):
+			d=angles[(i+1)%k]-angles[i]
+			if d<=0.0: d+=math.tau
+			p=self.makeboundarypoint(angles[i]+d/2)
+			(lon,lat)=rotation.dll_fromxyz(p.x,p.y,p.z)
+			if polygon.isvertex(lon,lat): continue
+			if not polygon.isinterior(lon,lat): return []
+			pg=SpherePolygon(polygon,rotation)
+			th=angles[0]
+			pg.points=self.getarcpoints(th,th,not polygon.iscw) # cw in lon,lat is cw in y,z
+			pg.points[0]=self.makeboundarypoint(th,pg.points[0])
+			return [pg]
+		return None
+	def stitch(self,pieces,iscw): # lists of items for each new ring, None on trouble
+		crossings=[]
+		for k,piece in enumerate(pieces):
+			(entry,exit)=(piece[1],piece[2])
+			entry.piece=k
+			entry.isentry=True
+			exit.piece=k
+			exit.isentry=False
+			crossings.append(entry)
+			crossings.append(exit)
+		crossings.sort(key=ViewCrossing.sortkey)
+		m=len(crossings)
+		for k in range(m):
+			one=crossings[k]
+			one.index=k
+			two=crossings[(k+1)%m]
+			if one.th==two.th and one.dth==two.dth and m>1: return None
+		isup=not iscw # the inside is on the right, so a cw part goes down the view's edge after leaving
+		rings=[]
+		isdone=[False]*len(pieces)
+		for start in range(len(pieces)):
+			if isdone[start]: continue
+			items=[]
+			k=start
+			while not isdone[k]:
+				isdone[k]=True
+				piece=pieces[k]
+				items.extend(piece[0])
+				one=piece[2]
+				if isup: two=crossings[(one.index+1)%m]
+				else: two=crossings[one.index-1]
+				if not two.isentry: return None
+				if one.th==two.th: one.point.patchtype=self.getboundary(one.th)[1]
+				else:
+					arc=self.getarcpoints(one.th,two.th,isup)
+					one.point.patchtype=arc[0]
+					items.extend(arc[1:])
+				k=two.piece
+			if k!=start: return None
+			rings.append(items)
+		return rings
+	def classify(self,part,isloop): # (xs,ys,zs,inside,hards), hards are the edges that need getintervals(), None if it's all out of view
+		# outcodes have a bit for each side of the view a vertex is past, an edge with both ends past the same side is out of view
+		if part.xyzs is not None:
+			(x,y,z)=(part.xyzs[0],part.xyzs[1],part.xyzs[2])
+			codes=(x<0.0).astype(numpy.int8)
+			if self.isright: codes+=2*(y>self.right)+4*(y<-self.right)
+			if self.istop: codes+=8*(z>self.top)+16*(z<-self.top)
+			if self.iscorner: codes+=32*((y>self.xval)&(z<self.yval))
+			if numpy.bitwise_and.reduce(codes): return None
+			inside=codes==0
+			nextcodes=numpy.roll(codes,-1)
+			issimple=inside&(nextcodes==0)
+			if self.iscorner:
+				ylow=y<=self.xval
+				zhigh=z>=self.yval
+				issimple&=(ylow&numpy.roll(ylow,-1))|(zhigh&numpy.roll(zhigh,-1))
+			ishard=~issimple&((codes&nextcodes)==0)
+			if not isloop: ishard[-1]=False
+			return (x.tolist(),y.tolist(),z.tolist(),inside.tolist(),numpy.flatnonzero(ishard).tolist())
+		xs=[]
+		ys=[]
+		zs=[]
+		codes=[]
+		allcode=63
+		for p in part.points:
+			xs.append(p.x)
+			ys.append(p.y)
+			zs.append(p.z)
+			code=self.getoutcode(p.x,p.y,p.z)
+			codes.append(code)
+			allcode&=code
+		if allcode: return None
+		n=len(xs)
+		inside=[]
+		for code in codes: inside.append(code==0)
+		hards=[]
+		last=n
+		if not isloop: last=n-1
+		for i in range(last):
+			j=i+1
+			if j==n: j=0
+			if codes[i]&codes[j]: continue
+			if not codes[i] and not codes[j] and self.isnotchsafe(ys[i],zs[i],ys[j],zs[j]): continue
+			hards.append(i)
+		return (xs,ys,zs,inside,hards)
+	def getpoints(self,part,dlls,xs,ys,zs,items):
+		ret=[]
+		for item in items:
+			if not isinstance(item,tuple):
+				ret.append(item)
+				continue
+			(a,b)=item
+			if part.xyzs is None:
+				ret.extend(part.points[a:b+1])
+				continue
+			for i in range(a,b+1):
+				dll=dlls[i]
+				p=SpherePoint()
+				p.patchtype=NONE_PATCHTYPE
+				p.side=1
+				p.lon=dll.lon
+				p.lat=dll.lat
+				p.x=xs[i]
+				p.y=ys[i]
+				p.z=zs[i]
+				ret.append(p)
+		return ret
+	def cleavepolygon(self,spherepolygon): # a list of SpherePolygon, None if the cleaves should be done one at a time
+		r=self.classify(spherepolygon,True)
+		if not r: return []
+		(xs,ys,zs,inside,hards)=r
+		if not hards:
+			if inside[0]: return [spherepolygon]
+			return self.getenclosing(spherepolygon)
+		pieces=self.getpieces(len(xs),xs,ys,zs,inside,hards,True)
+		if pieces==None: return None
+		if not pieces: return self.getenclosing(spherepolygon)
+		if not pieces[0][1]: return [spherepolygon]
+		rings=self.stitch(pieces,spherepolygon.polygon.iscw)
+		if rings==None: return None
+		ret=[]
+		for items in rings:
+			pg=SpherePolygon(spherepolygon.polygon,spherepolygon.rotation)
+			pg.points=self.getpoints(spherepolygon,spherepolygon.polygon.points,xs,ys,zs,items)
+			ret.append(pg)
+		return ret
+	def cleavepolyline(self,spherepolyline): # like cleavepolygon(), without stitching
+		r=self.classify(spherepolyline,False)
+		if not r: return []
+		(xs,ys,zs,inside,hards)=r
+		if not hards:
+			if inside[0]: return [spherepolyline]
+			return []
+		pieces=self.getpieces(len(xs),xs,ys,zs,inside,hards,False)
+		if pieces==None: return None
+		dlls=None
+		if spherepolyline.polyline: dlls=spherepolyline.polyline.points
+		ret=[]
+		for piece in pieces:
+			pl=SpherePolyline(spherepolyline.rotation)
+			pl.points=self.getpoints(spherepolyline,dlls,xs,ys,zs,piece[0])
+			ret.append(pl)
+		return ret
+	def cleaveshape(self,onesphere): # False if a part needs the cleaves one at a time, onesphere is unchanged then
+		if onesphere.type==POLYGON_TYPE_SHP:
+			polygons=[]
+			for x in onesphere.polygons:
+				r=self.cleavepolygon(x)
+				if r==None: return False
+				for pg in r: polygons.append(pg)
+			onesphere.polygons=polygons
+			if len(polygons)==0: onesphere.type=NULL_TYPE_SHP
+		elif onesphere.type==POLYLINE_TYPE_SHP:
+			polylines=[]
+			for x in onesphere.polylines:
+				r=self.cleavepolyline(x)
+				if r==None: return False
+				for pl in r: polylines.append(pl)
+			onesphere.polylines=polylines
+			if len(polylines)==0: onesphere.type=NULL_TYPE_SHP
+		elif onesphere.type==POINT_TYPE_SHP:
+			p=onesphere.point
+			if self.getoutcode(p.x,p.y,p.z): onesphere.type=NULL_TYPE_SHP
+		return True
+	def cleave(self,onesphere,need): # need is from SphereCull.check()
+		if self.isonepass and (need[1] or need[2]):
+			if self.cleaveshape(onesphere): return
+		if need[0]: self.hemicleave.cleave(onesphere)
+		if self.cornercleave and need[1]: self.cornercleave.cleave(onesphere)
+		if self.boxzoomcleave and need[2]: self.boxzoomcleave.cleave(onesphere)
+
+def flatten_xyzs(xyzs,width,height,right,top): # numpy version of the SpherePolygon.flatten() math, repeated points are dropped
+	uxs=(0.5+((xyzs[1]+right)*(width))/(right*2)).astype(numpy.int64)
+	uys=(0.5+((top-xyzs[2])*(height))/(top*2)).astype(numpy.int64)
+	keep=numpy.ones(len(uxs),dtype=bool)
+	keep[1:]=(uxs[1:]!=uxs[:-1])|(uys[1:]!=uys[:-1])
+	return (uxs[keep].tolist(),uys[keep].tolist())
+
+def mbr_fromxyzs(mbr,xyzs):
+	if not len(xyzs[0]): return mbr
+	mbr.add(float(xyzs[1].min()),float(xyzs[2].min()))
+	mbr.add(float(xyzs[1].max()),float(xyzs[2].max()))
+	return mbr
+
+def getsides_numpy(neg,pos): # neg and pos are boolean arrays, returns the same as setsides()
+	hasneg=bool(neg.any())
+	haspos=bool(pos.any())
+	if hasneg and haspos: return 0
+	if hasneg: return 1
+	return 2
+
 class SpherePolygon():
 	@staticmethod
 	def make(polygon,rotation):
 		pg=SpherePolygon(polygon,rotation)
+		if numpy and isnumpy_global and len(polygon.points)>=32: # SpherePoints are made later, if a cleave needs them
+			pg.xyzs=rotation.xyzs_fromlonlats(*lonlats_frompoints(polygon.points,polygon.source,polygon.sourceindices))
+			pg.points=None
+			return pg
 		for x in polygon.points: pg.points.append(SpherePoint.makefromdll(x,rotation))
 		return pg
 	@staticmethod
@@ -2538,7 +3740,12 @@ class SpherePolygon():
 		self.polygon=polygon
 		self.rotation=rotation
 		self.points=[]
+		self.xyzs=None
+	def makepoints(self):
+		self.points=SpherePoint.makefromxyzs(self.polygon.points,self.xyzs)
+		self.xyzs=None
 	def print(self,file=sys.stdout):
+		if self.xyzs is not None: self.makepoints()
 		print('polygon: '+str(len(self.points))+' iscw:'+str(self.polygon.iscw),file=file)
 		for p in self.points:
 			p.print(file=file)
@@ -2546,22 +3753,24 @@ class SpherePolygon():
 		return self.polygon.isvertex(self,lon,lat)
 	def flatten(self,width,height,splitlimit,right,top):
 		r=FlatPolygon(self.polygon.iscw,self.polygon.index,self.polygon.partindex,self.polygon.ccwtype)
+		if self.xyzs is not None: # no patches to interpolate
+			(uxs,uys)=flatten_xyzs(self.xyzs,width,height,right,top)
+			for i in range(len(uxs)): r.addpoint(uxs[i],uys[i],NONE_PATCHTYPE)
+			return r
 		rightx2=right*2
 		topx2=top*2
 		for p in self.points:
 			p.ux=int(0.5+((p.y+right)*(width))/rightx2) # for <path>, we extend to the edge (no width-1)
 			p.uy=int(0.5+((top-p.z)*(height))/topx2)
-		i=0
-		fuse=20000 # 1000 is too few for ocean.110m on a sphere
-		while True:
+		k=len(self.points)
+		for i in range(k):
 			p=self.points[i]
 			r.addpoint(p.ux,p.uy,p.patchtype)
-			if p.patchtype==HEMI_PATCHTYPE:
-				q=self.points[0]
-				if i+1<len(self.points): q=self.points[i+1]
+			if p.patchtype!=HEMI_PATCHTYPE: continue
+			stack=[self.points[(i+1)%k]] # bisect p to q, depth first, so points come out in order
+			while True:
+				q=stack[-1]
 				if SpherePolygon.shouldsplit(p,q,splitlimit):
-					fuse-=1
-					if fuse==0: raise ValueError('Too many interpolations, fuse expired')
 					n=SpherePoint()
 
 					# HEMI_PATCHTYPE is pretty generic
@@ -2584,15 +3793,26 @@ class SpherePolygon():
 	#					n.z=(p.z+q.z)/2.0
 	#					n.x=math.sqrt(1-n.y*n.y-n.z*n.z)
 			
-					n.patchtype=p.patchtype
-					n.ux=int(0.5+((n.y+right)*(width))/rightx2)
-					n.uy=int(0.5+((top-n.z)*(height))/topx2)
-					self.points.insert(i+1,n)
-					continue
-			i+=1
-			if i==len(self.points): break
+					if (n.x!=p.x or n.y!=p.y or n.z!=p.z) and (n.x!=q.x or n.y!=q.y or n.z!=q.z): # else p and q are as close as floats get
+						n.patchtype=p.patchtype
+						n.ux=int(0.5+((n.y+right)*(width))/rightx2)
+						n.uy=int(0.5+((top-n.z)*(height))/topx2)
+						stack.append(n)
+						continue
+				stack.pop()
+				if not stack: break
+				r.addpoint(q.ux,q.uy,q.patchtype)
+				p=q
 		return r
 	def cleave(self,c):
+		if self.xyzs is not None:
+			(neg,pos)=c.getnegpos(self.xyzs)
+			t=getsides_numpy(neg,pos)
+			if t==1: return []
+			if t==2: return [self]
+			ret=ArrayCleave(c,self,neg,pos).cleave()
+			if ret!=None: return ret
+			self.makepoints()
 		t=c.setsides(self.points)
 		if t==1: return []
 		if t==2: return [self]
@@ -2609,6 +3829,7 @@ class SpherePolygon():
 		return ret
 	def getmbr(self):
 		mbr=Mbr()
+		if self.xyzs is not None: return mbr_fromxyzs(mbr,self.xyzs)
 		for p in self.points: mbr.add(p.y,p.z)
 		return mbr
 
@@ -2692,6 +3913,11 @@ class SpherePolyline():
 	@staticmethod
 	def make(polyline,rotation):
 		pl=SpherePolyline(rotation)
+		if numpy and isnumpy_global and len(polyline.points)>=32:
+			pl.polyline=polyline
+			pl.xyzs=rotation.xyzs_fromlonlats(*lonlats_frompoints(polyline.points,polyline.source,polyline.sourceindices))
+			pl.points=None
+			return pl
 		for x in polyline.points: pl.points.append(SpherePoint.makefromdll(x,rotation))
 		return pl
 	@staticmethod
@@ -2706,10 +3932,20 @@ class SpherePolyline():
 	def __init__(self,rotation):
 		self.rotation=rotation
 		self.points=[]
+		self.polyline=None
+		self.xyzs=None
+	def makepoints(self):
+		self.points=SpherePoint.makefromxyzs(self.polyline.points,self.xyzs)
+		self.xyzs=None
 	def print(self):
+		if self.xyzs is not None: self.makepoints()
 		print('polyline: '+str(len(self.points)))
 	def flatten(self,width,height,right,top):
 		r=FlatPolyline()
+		if self.xyzs is not None:
+			(uxs,uys)=flatten_xyzs(self.xyzs,width,height,right,top)
+			for i in range(len(uxs)): r.addpoint(uxs[i],uys[i])
+			return r
 		rightx2=right*2
 		topx2=top*2
 		for p in self.points:
@@ -2718,6 +3954,11 @@ class SpherePolyline():
 			r.addpoint(ux,uy)
 		return r
 	def cleave(self,c):
+		if self.xyzs is not None:
+			t=getsides_numpy(*c.getnegpos(self.xyzs))
+			if t==1: return []
+			if t==2: return [self]
+			self.makepoints()
 		t=c.setsides(self.points)
 		if t==1: return []
 		if t==2: return [self]
@@ -2731,6 +3972,7 @@ class SpherePolyline():
 		return ret
 	def getmbr(self):
 		mbr=Mbr()
+		if self.xyzs is not None: return mbr_fromxyzs(mbr,self.xyzs)
 		for p in self.points: mbr.add(p.y,p.z)
 		return mbr
 
@@ -2806,16 +4048,18 @@ class TripelPolyline():
 		return r
 
 class SphereShape():
-	def __init__(self,shapeplus,rotation):
+	def __init__(self,shapeplus,rotation,lodarea=0.0):
 		self.type=shapeplus.type
 		self.shapeplus=shapeplus
 		if self.type==POLYGON_TYPE_SHP:
 			self.polygons=[]
 			for x in shapeplus.polygons:
+				if lodarea: x=x.getlod(lodarea)
 				self.polygons.append(SpherePolygon.make(x,rotation))
 		elif self.type==POLYLINE_TYPE_SHP:
 			self.polylines=[]
 			for x in shapeplus.polylines:
+				if lodarea: x=x.getlod(lodarea)
 				self.polylines.append(SpherePolyline.make(x,rotation))
 		elif self.type==POINT_TYPE_SHP:
 			self.point=SpherePoint.makefromdll(shapeplus.point,rotation)
@@ -2981,13 +4225,15 @@ def text_sphere_print_svg(output,dll,text,rotation,width,height,cssfont=TEXT_FON
 def pluses_sphere_print_svg(output,pluses,rotation,width,height,splitlimit,cssline=None,cssfull=None,csspatch=None,
 		cssreverse=None,cssreversepatch=None,
 		boxzoomcleave=None, cornercleave=None):
-	hc=HemiCleave()
+	vc=ViewCleave(boxzoomcleave,cornercleave)
+	cull=SphereCull(rotation,boxzoomcleave,cornercleave)
+	lodarea=getlodarea(width,height,boxzoomcleave)
 
 	for oneplus in pluses:
-		onesphere=SphereShape(oneplus,rotation)
-		hc.cleave(onesphere)
-		if cornercleave: cornercleave.cleave(onesphere)
-		if boxzoomcleave: boxzoomcleave.cleave(onesphere)
+		need=cull.check(oneplus)
+		if not need: continue
+		onesphere=SphereShape(oneplus,rotation,lodarea)
+		vc.cleave(onesphere,need)
 		if onesphere.type!=NULL_TYPE_SHP:
 			if boxzoomcleave:
 				flatshape=boxzoomcleave.flatten(onesphere)
@@ -3030,12 +4276,14 @@ def cutout_sphere_print_svg(output,shapes,draworder,rotation,width,height,splitl
 	else:
 		pluses=ShapePlus.make(shapes) # shapes is assumed to be just a shape
 
-	hc=HemiCleave()
+	vc=ViewCleave(boxzoomcleave,cornercleave)
+	cull=SphereCull(rotation,boxzoomcleave,cornercleave)
+	lodarea=getlodarea(width,height,boxzoomcleave)
 	for oneplus in pluses:
-		onesphere=SphereShape(oneplus,rotation)
-		hc.cleave(onesphere)
-		if cornercleave: cornercleave.cleave(onesphere)
-		if boxzoomcleave: boxzoomcleave.cleave(onesphere)
+		need=cull.check(oneplus)
+		if not need: continue
+		onesphere=SphereShape(oneplus,rotation,lodarea)
+		vc.cleave(onesphere,need)
 		if onesphere.type!=NULL_TYPE_SHP:
 			if boxzoomcleave:
 				flatshape=boxzoomcleave.flatten(onesphere)
@@ -3057,16 +4305,18 @@ def one_sphere_print_svg(output,one,draworder,rotation,width,height,splitlimit,c
 		boxzoomcleave=None, cornercleave=None,
 		isforcedpixel=False,
 		islabels=False):
-	hc=HemiCleave()
+	vc=ViewCleave(boxzoomcleave,cornercleave)
+	cull=SphereCull(rotation,boxzoomcleave,cornercleave)
+	lodarea=getlodarea(width,height,boxzoomcleave)
 
 	needmore=False
 	if draworder==-1:
 		pluses=ShapePlus.make(one)
 		for oneplus in pluses:
-			onesphere=SphereShape(oneplus,rotation)
-			hc.cleave(onesphere)
-			if cornercleave: cornercleave.cleave(onesphere)
-			if boxzoomcleave: boxzoomcleave.cleave(onesphere)
+			need=cull.check(oneplus)
+			if not need: continue
+			onesphere=SphereShape(oneplus,rotation,lodarea)
+			vc.cleave(onesphere,need)
 			if onesphere.type!=NULL_TYPE_SHP:
 				if boxzoomcleave:
 					flatshape=boxzoomcleave.flatten(onesphere)
@@ -3085,10 +4335,10 @@ def one_sphere_print_svg(output,one,draworder,rotation,width,height,splitlimit,c
 		for i in range(len(pluses)):
 			oneplus=pluses[i]
 			if oneplus.draworder==draworder:
-				onesphere=SphereShape(oneplus,rotation)
-				hc.cleave(onesphere)
-				if cornercleave: cornercleave.cleave(onesphere)
-				if boxzoomcleave: boxzoomcleave.cleave(onesphere)
+				need=cull.check(oneplus)
+				if not need: continue
+				onesphere=SphereShape(oneplus,rotation,lodarea)
+				vc.cleave(onesphere,need)
 				if onesphere.type!=NULL_TYPE_SHP:
 					if boxzoomcleave:
 						flatshape=boxzoomcleave.flatten(onesphere)
@@ -3833,15 +5083,32 @@ def combo_print_svg(output,options,full_admin0,sphere_admin0,zoom_admin0,labels)
 
 	if 'gsg' in options and options['gsg'] in ('US1.USA','CAN.CAN'): isusacan=True
 
+	rotation=SphereRotation()
+	if True:
+		lon=options['lon']
+		lat=options['lat']
+		hlc=lat/2
+		if hlc<-23.436: hlc=-23.436
+		elif hlc>23.436: hlc=23.436
+		rotation.set_deglonlat(lon,hlc)
+		if isverbose_global: print('Rotation center: (lon,lat)=(%f,%f)'%(lon,hlc),file=sys.stderr)
+		if not options['zoomlon']: options['zoomlon']=lon
+		if not options['zoomlat']: options['zoomlat']=lat
+	rotation2=SphereRotation()
+	rotation2.set_deglonlat(options['zoomlon'],options['zoomlat'])
+
 	if True: #cdebug
-		sphere_wc=WorldCompress(sphere_admin0,-1)
-		sphere_wc.addcontinents('sphere',isusacan)
+		sphere_wc=WorldCompress(sphere_admin0,-1,rotation=rotation)
 		if options['iszoom']:
+			coeff=0.3 if options['iszoom34'] else 0.4
+			zoombzc=BoxZoomCleave.makefromzoom(options['zoom']/coeff,int(coeff*width),int(coeff*height),splitlimit) # only for culling
 			if options['zoomm']==options['spherem']:
 				zoom_wc=sphere_wc
+				zoom_wc.addview(rotation2,zoombzc)
 			else:
-				zoom_wc=WorldCompress(zoom_admin0,-1)
-				zoom_wc.addcontinents('zoom')
+				zoom_wc=WorldCompress(zoom_admin0,-1,rotation=rotation2,boxzoomcleave=zoombzc)
+		sphere_wc.addcontinents('sphere',isusacan)
+		if options['iszoom'] and zoom_wc is not sphere_wc: zoom_wc.addcontinents('zoom')
 
 	if 'halflightgsgs' in options:
 		for gsg in options['halflightgsgs']:
@@ -3854,20 +5121,6 @@ def combo_print_svg(output,options,full_admin0,sphere_admin0,zoom_admin0,labels)
 		for partindex in full_partindices:
 			full_admin0.setdraworder(full_index,partindex,2)
 
-	rotation=SphereRotation()
-	if True:
-		lon=options['lon']
-		lat=options['lat']
-		hlc=lat/2
-		if hlc<-23.436: hlc=-23.436
-		elif hlc>23.436: hlc=23.436
-		rotation.set_deglonlat(lon,hlc)
-		if isverbose_global: print('Rotation center: (lon,lat)=(%f,%f)'%(lon,hlc),file=sys.stderr)
-		if not options['zoomlon']: options['zoomlon']=lon
-		if not options['zoomlat']: options['zoomlat']=lat
-	rotation2=SphereRotation()
-	rotation2.set_deglonlat(options['zoomlon'],options['zoomlat'])
-
 	cornercleave=None
 	if options['iszoom']:
 		if not options['istopinsets']:
@@ -3984,8 +5237,7 @@ def combo_print_svg(output,options,full_admin0,sphere_admin0,zoom_admin0,labels)
 		sasi=ShpAdminShapeIntersection()
 		sasi.addfromshapes(sphere_admin0.shapes,2)
 		if options['isdisputed']: sasi.addfromshapes(sphere_admin0.disputed.shapes,1)
-		for l in sphere_admin0.lakes.shapes:
-			sasi.setinside(l)
+		sasi.setinsidepart(sphere_admin0.lakes)
 		borderlakeshapes=sasi.exportlines()
 		if options['iszoom']:
 			if options['spherem']==options['zoomm']:
@@ -3995,8 +5247,7 @@ def combo_print_svg(output,options,full_admin0,sphere_admin0,zoom_admin0,labels)
 				sasi=ShpAdminShapeIntersection()
 				sasi.addfromshapes(zoom_admin0.shapes,2)
 				if options['isdisputed']: sasi.addfromshapes(zoom_admin0.disputed.shapes,1)
-				for l in zoom_admin0.lakes.shapes:
-					sasi.setinside(l)
+				sasi.setinsidepart(zoom_admin0.lakes)
 				zoom_borderlakeshapes=sasi.exportlines()
 
 		for plus in borderlakeshapes:
@@ -4195,6 +5446,23 @@ class FieldDbf():
 		self.length=buff32[16]
 		self.offset=offset
 
+class DbfRecord(): # a record of a columnar Dbf, it reads and writes through to the columns
+	__slots__=('dbf','index')
+	def __init__(self,dbf,index):
+		self.dbf=dbf
+		self.index=index
+	def __getitem__(self,n): return self.dbf.getcolumn(n)[self.index]
+	def __setitem__(self,n,v): self.dbf.setvalue(self.index,n,v)
+	def __contains__(self,n): return n in self.dbf.selectedcfields or n=='_index' or n=='_isdeleted'
+	def get(self,n,d=None):
+		if n not in self: return d
+		return self[n]
+	def todict(self):
+		d={'_isdeleted':self['_isdeleted'],'_index':self.index}
+		for n in self.dbf.selectedcfields: d[n]=self[n]
+		return d
+	def __str__(self): return str(self.todict())
+
 class Dbf():
 	def __init__(self,filename=None,installfile=None):
 		self.installfile=installfile
@@ -4204,8 +5472,12 @@ class Dbf():
 		else:
 			self.filename=filename
 			self.f=open(filename,"rb")
+		self.raw=None # records with loadcolumns(), may be an mmap
 		self._loadheader()
-	def close(self):
+	def close(self): # columns that weren't fetched with getcolumn() can't be read after this
+		if mmap and isinstance(self.raw,mmap.mmap):
+			self.raw.close()
+			self.raw=None
 		self.f.close()
 	def print(self):
 		print('byte0: %d'%(self.byte0))
@@ -4226,7 +5498,8 @@ class Dbf():
 		if f==None: raise ValueError
 		if f.type!=67 and f.type!=78: raise ValueError # C=67 N=78
 		self.selectedcfields[nickname]=f
-	def loadrecords(self):
+	def loadrecords(self,iscolumnar=False): # iscolumnar: keep the raw records and decode fields as they're needed
+		if iscolumnar: return self.loadcolumns()
 		self.f.seek(self.headersize)
 		for idx in range(self.numrecords):
 			recorddata=self.f.read(self.recordsize)
@@ -4250,6 +5523,7 @@ class Dbf():
 		self.fields=[]
 		self.selectedcfields={}
 		self.records=[]
+		self.iscolumnar=False
 		fieldsoffset=1
 		for i in range(self.fieldcount):
 			buff32=self.f.read(32)
@@ -4258,8 +5532,69 @@ class Dbf():
 			fieldsoffset+=f.length
 		buff32=self.f.read(1)
 		if buff32[0]!=0x0d: raise ValueError
+	def loadcolumns(self):
+		self.raw=None
+		self.rawoffset=self.headersize
+		if mmap:
+			try:
+				self.raw=mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+			except (OSError,ValueError):
+				pass
+		if self.raw==None:
+			self.f.seek(self.headersize)
+			self.raw=self.f.read(self.numrecords*self.recordsize)
+			self.rawoffset=0
+		self.iscolumnar=True
+		self.columns={}
+		self.indexes={}
+		for idx in range(self.numrecords): self.records.append(DbfRecord(self,idx))
+	def getcolumn(self,nickname): # list of values for every record, decoded on first use
+		column=self.columns.get(nickname,None)
+		if column!=None: return column
+		if not self.iscolumnar:
+			column=[]
+			for r in self.records: column.append(r[nickname])
+			return column
+		raw=self.raw
+		offset=self.rawoffset
+		size=self.recordsize
+		column=[]
+		if nickname=='_index':
+			column=list(range(self.numrecords))
+		elif nickname=='_isdeleted':
+			for idx in range(self.numrecords): column.append(raw[offset+idx*size]==42)
+		else:
+			f=self.selectedcfields[nickname]
+			start=offset+f.offset
+			for idx in range(self.numrecords):
+				i=start+idx*size
+				column.append(raw[i:i+f.length].decode().rstrip(' \t\x00\ufeff').lstrip(' \t\ufeff'))
+		self.columns[nickname]=column
+		return column
+	def setvalue(self,idx,nickname,value):
+		self.getcolumn(nickname)[idx]=value
+		if nickname in self.indexes: del self.indexes[nickname]
+	def getindex(self,nickname): # value -> list of record indices, for columnar query()
+		index=self.indexes.get(nickname,None)
+		if index!=None: return index
+		index={}
+		for idx,v in enumerate(self.getcolumn(nickname)):
+			l=index.get(v,None)
+			if l==None: index[v]=[idx]
+			else: l.append(idx)
+		self.indexes[nickname]=index
+		return index
 	def query(self,q):
 		ret=[]
+		if self.iscolumnar:
+			if not q: return self.records[:]
+			names=list(q)
+			indices=self.getindex(names[0]).get(q[names[0]],[])
+			for idx in indices:
+				for n in names[1:]:
+					if q[n]!=self.getcolumn(n)[idx]: break
+				else: ret.append(self.records[idx])
+			return ret
 		for r in self.records:
 			for n in q:
 				if q[n]!=r[n]: break
@@ -4277,12 +5612,26 @@ class InstallFile():
 		self.dclass=dclass
 		self.filenames=filenames
 		self.isfound=False
+		self.isprobed=False
 		self.filename=None
 		self.log=[]
-	def findfile(self):
+		self.cachekey=None # (size,mtime,key) from getcachekey()
+	def getdirs(self):
 		dirs=['./','ned/']
 		dirs.append('ned/'+self.scale+'/')
 		dirs.append('ned/'+self.scale+'-'+self.dclass+'/')
+		return dirs
+	def getdirssignature(self): # changes when a file is added to a dir we'd search
+		a=[]
+		for d in self.getdirs():
+			try:
+				a.append(str(os.stat(d).st_mtime_ns))
+			except OSError:
+				a.append('-')
+		return ','.join(a)
+	def findfile(self):
+		self.isprobed=True
+		dirs=self.getdirs()
 		names=[]
 		names.append(self.scale+'-'+self.nickname)
 		for n in self.filenames: names.append(n)
@@ -4306,19 +5655,51 @@ class InstallFile():
 		if not zipfile:
 			print('%s was found only as a zip file, but zipfile module isn\'t loaded'%self.filename,file=sys.stderr)
 			raise ValueError
-		zf=zipfile.ZipFile(self.filename)
+		zf=install.getzipfile(self.filename)
 		namelist=zf.namelist()
 		for fn in self.filenames:
 			if fn not in namelist: continue
-			return zf.open(fn)
+			return install.openzipmember(self.filename,zf,fn)
 		print('Couldn\'t find',self.filenames,'in',namelist,file=sys.stderr)
 		raise ValueError
+	def getcachekey(self): # changes if the file changes, the crc covers all of it, made once per size and mtime
+		st=os.stat(self.filename)
+		if self.cachekey and self.cachekey[0]==st.st_size and self.cachekey[1]==st.st_mtime_ns: return self.cachekey[2]
+		crc=0
+		if zlib:
+			f=self.open()
+			while True:
+				data=f.read(1<<20)
+				if not data: break
+				crc=zlib.crc32(data,crc)
+			f.close()
+		key='%s:%d:%d:%08x'%(self.filename,st.st_size,st.st_mtime_ns,crc)
+		self.cachekey=(st.st_size,st.st_mtime_ns,key)
+		return key
+	def opencompanion(self,ext): # the same file with another extension (shx for shp), None if it's missing
+		if not self.isfound: return None
+		if not self.filename.endswith('zip'):
+			fn=self.filename[:-3]+ext
+			if not os.path.isfile(fn): return None
+			return open(fn,'rb')
+		if not zipfile: return None
+		zf=install.getzipfile(self.filename)
+		namelist=zf.namelist()
+		for fn in self.filenames:
+			if fn not in namelist: continue
+			fn=fn[:-3]+ext
+			if fn in namelist: return install.openzipmember(self.filename,zf,fn)
+		return None
 
 class Install():
 	def __init__(self):
 		self.filenames_10m={}
 		self.filenames_50m={}
 		self.filenames_110m={}
+		self.manifest=None
+		self.manifestfilename=None
+		self.ismanifestchanged=False # saved once by flushmanifest()
+		self.zipfiles={}
 		self.addfile('admin0-lakes.shp','10m','admin', ['ne_10m_admin_0_countries_lakes.shp','ne_10m_admin_0_countries_lakes.zip'])
 		self.addfile('admin0-lakes.shp','50m','admin', ['ne_50m_admin_0_countries_lakes.shp','ne_50m_admin_0_countries_lakes.zip'])
 		self.addfile('admin0-lakes.shp','110m','admin', ['ne_110m_admin_0_countries_lakes.shp','ne_110m_admin_0_countries_lakes.zip'])
@@ -4400,9 +5781,8 @@ class Install():
 		self.addfile('hypso-hr_sr_ob_dr.pnm','10m','hypso', [ 'hyp_hr_sr_ob_dr.pnm','hyp_hr_sr_ob_dr.zip' ])
 
 
-	def addfile(self,nickname,scale,dclass,filenames):
+	def addfile(self,nickname,scale,dclass,filenames): # files are found when they're first needed
 		f=InstallFile(nickname,scale,dclass,filenames)
-		f.findfile()
 		if scale=='10m': self.filenames_10m[nickname]=f
 		elif scale=='50m': self.filenames_50m[nickname]=f
 		elif scale=='110m': self.filenames_110m[nickname]=f
@@ -4422,9 +5802,92 @@ class Install():
 				elif scale=='50m': f=self.filenames_50m.get(nickname,None)
 				elif scale=='110m': f=self.filenames_110m.get(nickname,None)
 				else: raise ValueError("Unsupported scale: "+str(scale))
+				if f and not f.isprobed: self.findfile(f)
 				if f and f.isfound: return f
 		if not failok: raise ValueError("Couldn't find base file for %s (%s)"%(nicknames,str(scales)))
 		return None
+	def findfile(self,f): # uses the manifest if the file there and the dirs we'd search are unchanged
+		if self.manifest!=None:
+			m=self.manifest.get(f.scale+'/'+f.nickname,None)
+			if m:
+				if m[0]:
+					try:
+						signature=str(os.stat(m[0]).st_mtime_ns)+';'+f.getdirssignature()
+					except OSError:
+						signature=None
+				else:
+					signature=f.getdirssignature()
+				if signature==m[1]:
+					f.isprobed=True
+					if m[0]:
+						f.filename=m[0]
+						f.isfound=True
+						f.log.append('Found %s (%s) -> %s, from manifest %s'%(f.nickname,f.scale,m[0],self.manifestfilename))
+					else:
+						f.log.append('Couldn\'t find file: %s (%s), from manifest %s. No files were added to the dirs we look in.'%(f.nickname,
+								f.scale,self.manifestfilename))
+					return
+		f.findfile()
+		if self.manifest!=None:
+			if f.isfound: self.manifest[f.scale+'/'+f.nickname]=(f.filename,str(os.stat(f.filename).st_mtime_ns)+';'+f.getdirssignature())
+			else: self.manifest[f.scale+'/'+f.nickname]=('',f.getdirssignature())
+			self.ismanifestchanged=True
+	def loadmanifest(self,filename):
+		self.manifestfilename=filename
+		self.manifest={}
+		try:
+			fp=open(filename,'r',encoding='utf-8')
+		except FileNotFoundError:
+			if isverbose_global: print('Checked install manifest %s'%filename,file=sys.stderr)
+			return
+		for line in fp:
+			a=line.rstrip('\n').split('\t')
+			if len(a)!=3: continue
+			self.manifest[a[0]]=(a[1],a[2])
+		fp.close()
+		if isverbose_global: print('Loaded install manifest from %s'%filename,file=sys.stderr)
+	def flushmanifest(self):
+		if not self.ismanifestchanged: return
+		self.savemanifest()
+		self.ismanifestchanged=False
+	def savemanifest(self):
+		fn=self.manifestfilename
+		if isverbose_global: print('Saving install manifest to %s'%fn,file=sys.stderr)
+		fp=open(fn+'.tmp','w',encoding='utf-8')
+		for n in self.manifest:
+			m=self.manifest[n]
+			fp.write('%s\t%s\t%s\n'%(n,m[0],m[1]))
+		fp.close()
+		os.replace(fn+'.tmp',fn)
+	def getzipfile(self,filename): # archives stay open and are shared
+		zf=self.zipfiles.get(filename,None)
+		if not zf:
+			zf=zipfile.ZipFile(filename)
+			self.zipfiles[filename]=zf
+		return zf
+	def openzipmember(self,filename,zf,member): # with shpcachedir_global, members are extracted once and opened as files
+		if not shpcachedir_global: return zf.open(member)
+		mtime=os.stat(filename).st_mtime_ns
+		pathcrc=zlib.crc32(os.path.abspath(filename).encode()) if zlib else 0 # archives with the same name in different dirs
+		dirname=shpcachedir_global+'/unzip-'+os.path.basename(filename)[:-4]+'-%08x'%pathcrc
+		dest=dirname+'/'+os.path.basename(member)
+		try:
+			if os.stat(dest).st_mtime_ns==mtime: return open(dest,'rb')
+		except FileNotFoundError:
+			pass
+		if isverbose_global: print('Extracting %s from %s to %s'%(member,filename,dest),file=sys.stderr)
+		if not os.access(dirname,os.X_OK): os.mkdir(dirname)
+		fin=zf.open(member)
+		fout=open(dest+'.tmp','wb')
+		while True:
+			data=fin.read(1<<20)
+			if not data: break
+			fout.write(data)
+		fout.close()
+		fin.close()
+		os.utime(dest+'.tmp',ns=(mtime,mtime)) # the archive's mtime marks the extracted copy as current
+		os.replace(dest+'.tmp',dest)
+		return open(dest,'rb')
 	def getfilename(self,nickname,scales=None):
 		f=self.getinstallfile(nickname,scales)
 		if not f: raise ValueError("Couldn't find base file for %s (%s)"%(nickname,str(scales)))
@@ -4463,6 +5926,7 @@ class Install():
 		for d in [self.filenames_10m,self.filenames_50m,self.filenames_110m]:
 			for n in d:
 				f=d[n]
+				if not f.isprobed: self.findfile(f)
 				for l in f.log: print(l,file=sys.stdout)
 
 
@@ -4662,6 +6126,209 @@ def webmercator_test(): # webmercator test
 	print_footer_svg(output)
 	output.writeto(sys.stdout)
 
+def test_shapecoords(shape): # (type,partlist,lon/lat list) of a shape, for comparing loads
+	coords=[]
+	if shape.type==POLYGON_TYPE_SHP or shape.type==POLYLINE_TYPE_SHP:
+		for p in shape.pointlist:
+			coords.append(p.lon)
+			coords.append(p.lat)
+		return (shape.type,list(shape.partlist),coords)
+	if shape.type==POINT_TYPE_SHP: return (shape.type,None,[shape.point.lon,shape.point.lat])
+	return (shape.type,None,None)
+
+def test_sphere_svg(shapes,lon,lat,zoom,iscorner): # svg body of shapes on a sphere, for comparing renders
+	output=Output()
+	width=1000
+	height=1000
+	rotation=SphereRotation()
+	rotation.set_deglonlat(lon,lat)
+	boxzoomcleave=None
+	if zoom!=1: boxzoomcleave=BoxZoomCleave.makefromzoom(zoom,width,height,8)
+	cornercleave=None
+	if iscorner: cornercleave=CornerCleave(0,0.2,-0.2)
+	for one in shapes:
+		one_sphere_print_svg(output,one,0,rotation,width,height,8,cssfull=LAND_SPHERE_CSS,csspatch=PATCH_LAND_SPHERE_CSS,
+				boxzoomcleave=boxzoomcleave,cornercleave=cornercleave)
+	output.flush()
+	return ''.join(output.lines)
+
+def test_webmercator_svg(shapes): # svg body of shapes in webmercator, for comparing renders
+	output=Output()
+	wmc=WebMercatorCleave(True)
+	for shape in shapes:
+		for oneplus in ShapePlus.make(shape):
+			onewm=WebMercatorShape(oneplus)
+			wmc.cleave(onewm)
+			if onewm.type!=NULL_TYPE_SHP:
+				flatshape=onewm.flatten(1000,1000)
+				flatshape.printsvg(output,cssfull=LAND_SPHERE_CSS,csspatch=PATCH_LAND_SPHERE_CSS)
+	output.flush()
+	return ''.join(output.lines)
+
+def shpload_test(): # check that mmap, windowed, columnar and numpy loading match the plain ways, prints failures
+	global mmap
+	global isnumpy_global
+	errors=[]
+	scales=['110m','50m','10m']
+	installfile=install.getinstallfile('admin0.shp',scales)
+	print('Checking %s (%s)'%(installfile.filename,installfile.scale))
+
+	full=Shp(installfile=installfile)
+	full.loadshapes()
+	fulls=[]
+	for shape in full.shapes: fulls.append(test_shapecoords(shape))
+
+	savedmmap=mmap
+	mmap=None
+	read=Shp(installfile=installfile)
+	read.loadshapes()
+	mmap=savedmmap
+	for i,shape in enumerate(read.shapes):
+		if test_shapecoords(shape)!=fulls[i]: errors.append('shape %d differs when read without mmap'%i)
+
+	for shape in full.shapes:
+		if shape.type!=POLYGON_TYPE_SHP and shape.type!=POLYLINE_TYPE_SHP: continue
+		pl=shape.pointlist
+		if not isinstance(pl,PointList):
+			errors.append('shape %d has no PointList'%shape.index)
+			continue
+		for i in range(pl.count):
+			if pl[i] is not pl[i] or pl.getlonlat(i)!=(pl[i].lon,pl[i].lat):
+				errors.append('shape %d point %d differs in its PointList'%(shape.index,i))
+				break
+		for partindex in range(shape.partscount):
+			(start,limit)=Shape.getpartstartlimit(shape,partindex)
+			part=pl.getpart(start,limit)
+			if part is not pl.getpart(start,limit): errors.append('shape %d part %d is made twice'%(shape.index,partindex))
+			for i in range(1,len(part)):
+				if part[i].lon==part[i-1].lon and part[i].lat==part[i-1].lat:
+					errors.append('shape %d part %d has a repeated point'%(shape.index,partindex))
+					break
+		if numpy:
+			for oneplus in ShapePlus.make(shape):
+				for pg in oneplus.polygons if oneplus.type==POLYGON_TYPE_SHP else oneplus.polylines:
+					(lons,lats)=lonlats_frompoints(pg.points,pg.source,pg.sourceindices)
+					if len(lons)!=len(pg.points):
+						errors.append('shape %d part %d has %d numpy points for %d points'%(shape.index,pg.partindex,len(lons),len(pg.points)))
+						continue
+					for i,p in enumerate(pg.points):
+						if lons[i]!=p.lon or lats[i]!=p.lat:
+							errors.append('shape %d part %d point %d differs in numpy'%(shape.index,pg.partindex,i))
+							break
+
+	window=LonLatWindow.makefromcap(10,50,30)
+	windowed=Shp(installfile=installfile)
+	windowed.loadshapes(window)
+	if len(windowed.shapes)!=len(full.shapes): errors.append('windowed load has %d shapes, not %d'%(len(windowed.shapes),len(full.shapes)))
+	skipped=0
+	for i,shape in enumerate(windowed.shapes):
+		if shape.isskipped:
+			skipped+=1
+			if window.isintersects(shape.mbr): errors.append('shape %d was skipped inside the window'%i)
+		elif test_shapecoords(shape)!=fulls[i]: errors.append('shape %d differs in the windowed load'%i)
+	print('Window skipped %d of %d shapes'%(skipped,len(windowed.shapes)))
+	if skipped:
+		index=windowed.loadskipped(window)
+		if index: errors.append('loadskipped(window) decoded %d shapes that were in the window'%len(index))
+		for i in windowed.loadskipped():
+			if test_shapecoords(windowed.shapes[i])!=fulls[i]: errors.append('shape %d differs after loadskipped'%i)
+	for i in range(len(full.shapes)):
+		if windowed.shapes[i].isskipped: errors.append('shape %d is still skipped'%i)
+	if test_shapecoords(windowed.loadshape(len(full.shapes)-1))!=fulls[-1]: errors.append('loadshape differs')
+
+	dbfinstallfile=install.getinstallfile('admin0.dbf',[installfile.scale])
+	rows=Dbf(installfile=dbfinstallfile)
+	rows.selectcfield('SOV_A3','sov3')
+	rows.selectcfield('ADM0_A3','adm3')
+	rows.loadrecords()
+	rows.close()
+	columns=Dbf(installfile=dbfinstallfile)
+	columns.selectcfield('SOV_A3','sov3')
+	columns.selectcfield('ADM0_A3','adm3')
+	columns.loadrecords(iscolumnar=True)
+	if len(columns.records)!=len(rows.records): errors.append('columnar dbf has %d records, not %d'%(len(columns.records),len(rows.records)))
+	for i,r in enumerate(rows.records):
+		if columns.records[i].todict()!=r:
+			errors.append('dbf record %d differs when columnar'%i)
+			break
+	for r in rows.records:
+		q={'sov3':r['sov3'],'adm3':r['adm3']}
+		if len(rows.query(q))!=len(columns.query(q)) or rows.query1(q)!=columns.query1(q):
+			errors.append('dbf query %s differs when columnar'%str(q))
+			break
+	column=columns.getcolumn('adm3')
+	columns.close()
+	if columns.getcolumn('adm3') is not column: errors.append('dbf column was lost on close')
+
+	if numpy:
+		savedisnumpy=isnumpy_global
+		for (lon,lat,zoom,iscorner) in ((0,0,1,False),(-96,40,1.5,True),(100,-30,2,False),(20,89,3,True)):
+			isnumpy_global=True
+			one=test_sphere_svg(full.shapes,lon,lat,zoom,iscorner)
+			isnumpy_global=False
+			two=test_sphere_svg(full.shapes,lon,lat,zoom,iscorner)
+			if one!=two: errors.append('sphere render at %d,%d zoom %s differs without numpy'%(lon,lat,str(zoom)))
+		isnumpy_global=savedisnumpy
+	svg=test_webmercator_svg(full.shapes)
+	if not svg or 'nan' in svg: errors.append('webmercator render is empty or has nan')
+
+	for e in errors: print(e)
+	print('%d errors'%len(errors))
+
+def shpcache_test(): # check that cached admin0 and worldcompress blobs match the uncached ones, use with shpcache
+	global shpcachedir_global
+	if not shpcachedir_global:
+		print('shpcache_test needs the shpcache option first')
+		return
+	errors=[]
+	scales=['110m','50m','10m']
+
+	cachedir=shpcachedir_global
+	shpcachedir_global=None
+	plain=ShpAdmin('admin0-nolakes.shp',scales,isfixup=True)
+	shpcachedir_global=cachedir
+	print('Checking %s (%s)'%(plain.installfile.filename,plain.scale))
+	fn=ShpAdminCache.getfilename(plain.admin0,'fixup')
+	if os.path.isfile(fn): os.remove(fn)
+	made=ShpAdmin('admin0-nolakes.shp',scales,isfixup=True)
+	if not os.path.isfile(fn): errors.append('no shape cache was saved to %s'%fn)
+	cached=ShpAdmin('admin0-nolakes.shp',scales,isfixup=True)
+	if cached.admin0.shp: errors.append('shape cache wasn\'t loaded')
+	for one in (made,cached):
+		if len(one.shapes)!=len(plain.shapes):
+			errors.append('%d shapes, not %d'%(len(one.shapes),len(plain.shapes)))
+			continue
+		for i,sas in enumerate(one.shapes):
+			p=plain.shapes[i]
+			if test_shapecoords(sas)!=test_shapecoords(p) or sas.nickname!=p.nickname or sas.ccwtypes!=p.ccwtypes:
+				errors.append('shape %d (%s) differs when cached'%(i,p.nickname))
+
+	if plain.scale=='10m':
+		print('Not checking the worldcompress cache for 10m')
+	else:
+		renders=[]
+		for isplain in (True,False,False):
+			if isplain: shpcachedir_global=None
+			admin0=ShpAdmin('admin0-nolakes.shp',scales,isfixup=True)
+			wc=WorldCompress(admin0,-1)
+			wc.addcontinents('shpcache_test')
+			shpcachedir_global=cachedir
+			output=Output()
+			rotation=SphereRotation()
+			rotation.set_deglonlat(60,20)
+			pluses_sphere_print_svg(output,wc.getpluses(isnegatives=False,isoverlaps=False),rotation,1000,1000,4,
+					cssfull=LAND_SPHERE_CSS,csspatch=PATCH_LAND_SPHERE_CSS)
+			output.flush()
+			draworders=[]
+			for shape in admin0.shapes:
+				if shape.type==POLYGON_TYPE_SHP: draworders.append(list(shape.draworderlist))
+			renders.append((''.join(output.lines),draworders))
+		if renders[1]!=renders[0]: errors.append('worldcompress differs when saving its cache')
+		if renders[2]!=renders[0]: errors.append('worldcompress differs when loaded from its cache')
+
+	for e in errors: print(e)
+	print('%d errors'%len(errors))
+
 def ocean_test(): # ocean shp test
 	output=Output()
 	width=1630
@@ -4747,6 +6414,7 @@ def land_test(): # land shp test
 	output.writeto(sys.stdout)
 
 class MinusPoint():
+	__slots__=('mlonlat','dll','shapeindex','dupeindex')
 	@staticmethod
 	def getmlonlat(dll): return ( int(dll.lon*10000000) , int(dll.lat*10000000) )
 	@staticmethod
@@ -4763,18 +6431,28 @@ class MinusPoint():
 
 class WorldMinus():
 	@staticmethod
-	def isreversepolygons2(one,two,offset):
-		k=len(one.points)
-		for p in one.points:
-			q=two.points[offset]
-			if MinusPoint.getmlonlat(p)!=MinusPoint.getmlonlat(q): return False
-			offset=(offset-1)%k
-		return True
+	def getmlonlats(polygon):
+		ret=[]
+		for p in polygon.points: ret.append(MinusPoint.getmlonlat(p))
+		return ret
+	@staticmethod
+	def getringkey(polygon): # the same for any rotation or reversal of the points, to find isreversepolygons() candidates
+		mlonlats=WorldMinus.getmlonlats(polygon)
+		if not mlonlats: return (0,)
+		(lons,lats)=(0,0)
+		for (lon,lat) in mlonlats:
+			lons+=lon
+			lats+=lat
+		return (len(mlonlats),min(mlonlats),lons,lats)
 	@staticmethod
-	def isreversepolygons(one,two):
-		if len(one.points)!=len(two.points): return False
-		for i in range(len(one.points)):
-			if WorldMinus.isreversepolygons2(one,two,i): return True
+	def isreversepolygons(one,two): # two is one reversed and rotated
+		k=len(one.points)
+		if k!=len(two.points): return False
+		ones=WorldMinus.getmlonlats(one)
+		twos=WorldMinus.getmlonlats(two)
+		for offset in range(k): # one[0] has to line up with two[offset]
+			if twos[offset]!=ones[0]: continue
+			if twos[offset::-1]+twos[:offset:-1]==ones: return True
 		return False
 	def __init__(self,polygon,nickname=None):
 		self.nickname=nickname
@@ -4910,14 +6588,21 @@ class WorldBlob():
 	def makefromplus(plus):
 		wb=WorldBlob.makefrompolygon(plus.polygons[0])
 		for i in range(1,len(plus.polygons)):
-			wb.negatives.append(plus.polygons[i])
+			wb.addnegative(plus.polygons[i])
 		wb.plus=plus
 		return wb
 	def __init__(self,minus):
 		self.negatives=[]
+		self.negativeindex={} # WorldMinus.getringkey() => [negative,...]
 		self.blob=minus
 		self.blob.buildindex()
 		self.overlaps=[]
+	def addnegative(self,pg):
+		key=WorldMinus.getringkey(pg)
+		a=self.negativeindex.get(key,None)
+		if a: a.append(pg)
+		else: self.negativeindex[key]=[pg]
+		self.negatives.append(pg)
 	def addtoblob_minus(self,minus):
 		lastindex=self.blob.findlastmatch(minus)
 		if lastindex==None:
@@ -4939,7 +6624,7 @@ class WorldBlob():
 		minus=WorldMinus(plus.polygons[0])
 		if not self.addtoblob_minus(minus): return False
 		for i in range(1,len(plus.polygons)):
-			self.negatives.append(plus.polygons[i])
+			self.addnegative(plus.polygons[i])
 		return True
 	def skipfromblob(self,plus):
 		minus=WorldMinus(plus.polygons[0])
@@ -4947,11 +6632,16 @@ class WorldBlob():
 		return True
 	def subtractfromblob(self,plus):
 		pg=plus.polygons[0]
-		for i in range(len(self.negatives)):
-			neg=self.negatives[i]
+		a=self.negativeindex.get(WorldMinus.getringkey(pg),None)
+		if not a: return False
+		for neg in a:
 			if not WorldMinus.isreversepolygons(neg,pg): continue
 #			print('Found subtract match, %d points'%(len(pg.points)),file=sys.stderr)
-			del self.negatives[i]
+			a.remove(neg)
+			for i in range(len(self.negatives)):
+				if self.negatives[i] is neg:
+					del self.negatives[i]
+					break
 			minus=WorldMinus(neg,'subtraction')
 			points=minus.points
 			points.append(points[0])
@@ -5001,6 +6691,288 @@ class WorldBlob():
 				i+=1
 			if len(o)>1: self.overlaps.append(o)
 
+class WorldTopology(): # every polygon part of a shp as a ring of MinusPoint mlonlats, split into runs by the ring across each edge
+	def __init__(self,shapes):
+		self.pointlists=[]
+		self.ringids={} # (shape.index,partindex) => index in rings
+		self.rings=[] # (mlonlats,dlls)
+		self.edges={} # (mlonlat,mlonlat) => index in rings, a tuple of indices if rings overlap
+		self.runs={}
+		for shape in shapes:
+			if shape.type!=POLYGON_TYPE_SHP:
+				self.pointlists.append(None)
+				continue
+			self.pointlists.append(shape.pointlist)
+			for i in range(shape.partscount):
+				(start,limit)=Shape.getpartstartlimit(shape,i)
+				if start!=limit: self.addring(shape,i,start,limit)
+	def isvalid(self,shapes): # False if shapes were added or changed since this was made
+		if len(shapes)!=len(self.pointlists): return False
+		for i in range(len(shapes)):
+			if shapes[i].type!=POLYGON_TYPE_SHP:
+				if self.pointlists[i] is not None: return False
+			elif shapes[i].pointlist is not self.pointlists[i]: return False
+		return True
+	def addring(self,shape,partindex,start,limit):
+		mlonlats=[]
+		dlls=[]
+		for j in range(start,limit):
+			p=shape.pointlist[j]
+			m=MinusPoint.getmlonlat(p)
+			if mlonlats and m==mlonlats[-1]: continue
+			mlonlats.append(m)
+			dlls.append(p)
+		while len(mlonlats)>1 and mlonlats[-1]==mlonlats[0]:
+			mlonlats.pop()
+			dlls.pop()
+		r=len(self.rings)
+		self.ringids[(shape.index,partindex)]=r
+		self.rings.append((mlonlats,dlls))
+		n=len(mlonlats)
+		edges=self.edges
+		for i in range(n):
+			e=(mlonlats[i],mlonlats[(i+1)%n])
+			if e[0]==e[1]: continue
+			a=edges.get(e,None)
+			if a==None: edges[e]=r
+			elif isinstance(a,tuple):
+				if r not in a: edges[e]=a+(r,)
+			elif a!=r: edges[e]=(a,r)
+	def getringid(self,shape,partindex):
+		return self.ringids.get((shape.index,partindex),None)
+	def getruns(self,r): # [(ring across,start,count),...] in order, -1 if there's no ring across, made once
+		runs=self.runs.get(r,None)
+		if runs!=None: return runs
+		runs=[]
+		mlonlats=self.rings[r][0]
+		n=len(mlonlats)
+		if n>1:
+			edges=self.edges
+			acrosses=[]
+			for i in range(n): acrosses.append(edges.get((mlonlats[(i+1)%n],mlonlats[i]),-1))
+			first=0
+			while first<n and acrosses[first]==acrosses[first-1]: first+=1
+			if first==n: runs.append((acrosses[0],0,n))
+			else:
+				i=first
+				while True:
+					start=i
+					i=(i+1)%n
+					while i!=first and acrosses[i]==acrosses[start]: i=(i+1)%n
+					runs.append((acrosses[start],start,(i-start)%n or n))
+					if i==first: break
+		self.runs[r]=runs
+		return runs
+	def getpoints(self,r,start,count): # [(mlonlat,dll),...] for count edges from start
+		(mlonlats,dlls)=self.rings[r]
+		n=len(mlonlats)
+		ret=[]
+		for k in range(count+1):
+			i=(start+k)%n
+			ret.append((mlonlats[i],dlls[i]))
+		return ret
+
+class WorldTopoBlob(): # a WorldBlob made by picking runs from a WorldTopology, no ring surgery
+	@staticmethod
+	def makefromplus(topology,plus):
+		blob=WorldTopoBlob(topology)
+		blob.plus=plus
+		blob.addring(topology.getringid(plus.shape,plus.polygons[0].partindex))
+		for i in range(1,len(plus.polygons)): blob.addnegative(plus.polygons[i])
+		return blob
+	@staticmethod
+	def makefromcache(outline,negatives,arcs): # see WorldCompressCache, there's no topology so it can't be changed
+		blob=WorldTopoBlob(None)
+		blob.outline=outline
+		blob.arcs=arcs
+		for neg in negatives: blob.addnegative(neg)
+		return blob
+	def __init__(self,topology):
+		self.topology=topology
+		self.ringids=[] # members and skips, in the order they were added
+		self.ringset=set()
+		self.negatives=[]
+		self.negativeindex={} # WorldMinus.getringkey() => [negative,...]
+		self.subtractions=[]
+		self.trimmed=set() # edges that are left out of overlaps
+		self.outline=None
+		self.arcs=None
+		self.plus=None
+		self.group=0 # see WorldCompress.addcontinents()
+	def addring(self,r):
+		self.ringids.append(r)
+		self.ringset.add(r)
+		self.outline=None
+		self.arcs=None
+	def addnegative(self,pg):
+		key=WorldMinus.getringkey(pg)
+		a=self.negativeindex.get(key,None)
+		if a: a.append(pg)
+		else: self.negativeindex[key]=[pg]
+		self.negatives.append(pg)
+	def isacross(self,across): # a ring across from getruns() is in the blob
+		if not isinstance(across,tuple): return across in self.ringset
+		for a in across:
+			if a in self.ringset: return True
+		return False
+	def isarcowner(self,r,across): # r is the lowest blob ring on a shared border, so each border is drawn once
+		if not isinstance(across,tuple): return across>r and across in self.ringset
+		found=False
+		for a in across:
+			if a in self.ringset:
+				if a<=r: return False
+				found=True
+		return found
+	def istouching(self,r): # r shares an edge with the blob
+		if not self.topology: raise ValueError # made by makefromcache()
+		if r==None or r in self.ringset: return False
+		for run in self.topology.getruns(r):
+			if self.isacross(run[0]): return True
+		return False
+	def addtoblob(self,plus):
+		r=self.topology.getringid(plus.shape,plus.polygons[0].partindex)
+		if not self.istouching(r): return False
+		self.addring(r)
+		for i in range(1,len(plus.polygons)): self.addnegative(plus.polygons[i])
+		return True
+	def skipfromblob(self,plus): # skips are filled in but their borders aren't overlaps
+		r=self.topology.getringid(plus.shape,plus.polygons[0].partindex)
+		if not self.istouching(r): return False
+		self.addring(r)
+		return True
+	def subtractfromblob(self,plus):
+		if not self.topology: raise ValueError # made by makefromcache()
+		pg=plus.polygons[0]
+		a=self.negativeindex.get(WorldMinus.getringkey(pg),None)
+		if not a: return False
+		for neg in a:
+			if not WorldMinus.isreversepolygons(neg,pg): continue
+			a.remove(neg)
+			for i in range(len(self.negatives)):
+				if self.negatives[i] is neg:
+					del self.negatives[i]
+					break
+			self.subtractions.append(neg)
+			self.arcs=None
+			return True
+		return False
+	def trimoverlaps(self,edges):
+		self.trimmed|=edges
+	@staticmethod
+	def splitloop(loop,rings): # loop is [(mlonlat,mlonlat,dll),...], rings gets a Polygon for each simple ring, split where loop touches itself
+		stack=[]
+		positions={}
+		for edge in loop:
+			positions[edge[0]]=len(stack)
+			stack.append(edge)
+			i=positions.get(edge[1],None)
+			if i==None: continue
+			pg=Polygon(0,0)
+			for x in stack[i:]:
+				del positions[x[0]]
+				pg.points.append(x[2])
+			del stack[i:]
+			rings.append(pg)
+		if stack: # the walk didn't close
+			pg=Polygon(0,0)
+			for x in stack: pg.points.append(x[2])
+			rings.append(pg)
+	def getoutline(self): # polygons from the edges that don't have a blob ring across, the biggest cw first
+		if self.outline: return self.outline
+		topology=self.topology
+		edges=[]
+		starts={}
+		for r in self.ringids:
+			(mlonlats,dlls)=topology.rings[r]
+			n=len(mlonlats)
+			for (across,start,count) in topology.getruns(r):
+				if self.isacross(across): continue
+				for k in range(count):
+					i=(start+k)%n
+					a=starts.get(mlonlats[i],None)
+					if a: a.append(len(edges))
+					else: starts[mlonlats[i]]=[len(edges)]
+					edges.append((mlonlats[i],mlonlats[(i+1)%n],dlls[i]))
+		used=[False]*len(edges)
+		cws=[]
+		ccws=[]
+		for e0 in range(len(edges)):
+			if used[e0]: continue
+			first=edges[e0][0]
+			loop=[]
+			e=e0
+			while True:
+				used[e]=True
+				loop.append(edges[e])
+				last=edges[e][1]
+				if last==first: break
+				for e in starts.get(last,()):
+					if not used[e]: break
+				else: break
+			rings=[]
+			WorldTopoBlob.splitloop(loop,rings)
+			for pg in rings:
+				if len(pg.points)<3: continue
+				pg.iscw=pg._iscw()
+				if pg.iscw: cws.append(pg)
+				else: ccws.append(pg)
+		if len(cws)>1: # lobes that touch at a point, callers take polygons[0] as the outer ring
+			k=0
+			for i in range(1,len(cws)):
+				if len(cws[i].points)>len(cws[k].points): k=i
+			cws.insert(0,cws.pop(k))
+		self.outline=cws+ccws
+		return self.outline
+	def getplus(self,isnegatives=True):
+		sp=ShapePlus.makefrompolygons(list(self.getoutline()),0)
+		if isnegatives:
+			for neg in self.negatives: sp.polygons.append(neg)
+		return sp
+	def trimarc(self,points): # points is [(mlonlat,dll),...], split where edges are trimmed
+		ret=[]
+		piece=[points[0]]
+		for i in range(1,len(points)):
+			if (points[i-1][0],points[i][0]) in self.trimmed:
+				if len(piece)>1: ret.append(piece)
+				piece=[]
+			piece.append(points[i])
+		if len(piece)>1: ret.append(piece)
+		return ret
+	def getarcs(self): # each shared border once, from the lower ring, as [(mlonlat,dll),...]
+		if self.arcs!=None: return self.arcs
+		topology=self.topology
+		arcs=[]
+		for r in self.ringids:
+			for (across,start,count) in topology.getruns(r):
+				if not self.isarcowner(r,across): continue
+				arcs.append(topology.getpoints(r,start,count))
+		for neg in self.subtractions:
+			points=[]
+			for p in neg.points: points.append((MinusPoint.getmlonlat(p),p))
+			points.append(points[0])
+			arcs.append(points)
+		self.arcs=arcs
+		return arcs
+	def getoverlaps(self):
+		pls=[]
+		for points in self.getarcs():
+			for piece in self.trimarc(points):
+				pl=Polyline(0,0)
+				for (m,p) in piece: pl.addDegLonLat(p)
+				if len(pl.points)>1: pls.append(pl)
+		if not len(pls): return None
+		sp=ShapePlus(0,None)
+		sp.type=POLYLINE_TYPE_SHP
+		sp.polylines=pls
+		return sp
+	def getnegative(self):
+		if not len(self.negatives): return None
+		sp=ShapePlus(0,None)
+		sp.type=POLYGON_TYPE_SHP
+		sp.polygons=[]
+		for neg in self.negatives: sp.polygons.append(neg)
+		return sp
+
 class ShapeCompress():
 	def __init__(self,dest_draworder,source_draworder=0):
 		self.dest_draworder=dest_draworder
@@ -5028,21 +7000,76 @@ class ShapeCompress():
 		shape=sp.toshape()
 		return shape
 		
+class WorldCompressGsgs(): # stands in for WorldCompress in an add method, to list the gsgs it would use
+	def __init__(self,shp):
+		self.shp=shp
+		self.gsgs=[]
+	def startblob(self,gsg): self.gsgs.append(gsg)
+	def addtoblob(self,gsg,isfindall=False): self.gsgs.append(gsg)
+	def skipfromblob(self,gsg,isfindall=False): self.gsgs.append(gsg)
+	def subtractfromblob(self,gsg): self.gsgs.append(gsg)
+	def removeskips(self): pass
+
 class WorldCompress():
-	def __init__(self,shp,dest_draworder,source_draworder=0):
+	def __init__(self,shp,dest_draworder,source_draworder=0,rotation=None,boxzoomcleave=None): # with rotation, hidden continents are skipped
 		self.shp=shp
+		self.topology=shp.gettopology()
 		self.dest_draworder=dest_draworder
 		self.source_draworder=source_draworder
 		self.blobs=[]
 		self.currentblob=None
 		self.skiplist=[]
+		self.setdraworders=[] # (index,partindex,group) of parts moved to dest_draworder, for WorldCompressCache
+		self.cachekey=None
+		self.culls=[]
+		self.group=0 # set by addcontinents() for each continent, kept with blobs and draworders
+		if rotation: self.addview(rotation,boxzoomcleave)
+	def addview(self,rotation,boxzoomcleave=None): # continents are made if they can be seen in any view
+		self.culls.append(SphereCull(rotation,boxzoomcleave))
+	def isshapevisible(self,s):
+		if s.isskipped or s.type!=POLYGON_TYPE_SHP: return False
+		if not isinstance(s.pointlist,PointList): return True
+		for i in range(s.partscount):
+			(start,limit)=Shape.getpartstartlimit(s,i)
+			if start==limit: continue
+			cap=Shape.getcap(s,start,limit)
+			for cull in self.culls:
+				if cull.checkcap(cap): return True
+		return False
+	def isvisible(self,f,*args): # True if any shape that f(self,*args) would use can be seen
+		if not self.culls: return True
+		gsgs=WorldCompressGsgs(self.shp)
+		f(gsgs,*args)
+		for gsg in gsgs.gsgs:
+			s=self.shp.bynickname.get(gsg,None)
+			if s and self.isshapevisible(s): return True
+		return False
+	def removegroup(self,group): # undo the blobs and draworders of a group
+		blobs=[]
+		for blob in self.blobs:
+			if blob.group!=group: blobs.append(blob)
+		self.blobs=blobs
+		self.currentblob=blobs[-1] if blobs else None
+		setdraworders=[]
+		for (index,partindex,g) in self.setdraworders:
+			if g==group: self.shp.shapes[index].draworderlist[partindex]=self.source_draworder
+			else: setdraworders.append((index,partindex,g))
+		self.setdraworders=setdraworders
+	def setdraworder(self,s,partindex):
+		s.draworderlist[partindex]=self.dest_draworder
+		self.setdraworders.append((s.index,partindex,self.group))
+	def loadcache(self,name): # True if the blobs were loaded from shpcachedir_global
+		return WorldCompressCache.load(self,name)
+	def savecache(self,name): # after loadcache() returned False
+		WorldCompressCache.save(self,name)
 	def startblob(self,gsg):
 		s=self.shp.bynickname[gsg]
 		if not s: raise ValueError
 		plus=ShapePlus.pickbiggest(ShapePlus.make(s))
 		if self.source_draworder!=s.draworderlist[plus.polygons[0].partindex]: raise ValueError # this is plus.draworder
-		blob=WorldBlob.makefromplus(plus)
-		s.draworderlist[plus.polygons[0].partindex]=self.dest_draworder
+		blob=WorldTopoBlob.makefromplus(self.topology,plus)
+		blob.group=self.group
+		self.setdraworder(s,plus.polygons[0].partindex)
 		self.blobs.append(blob)
 		self.currentblob=blob
 	def addtoblob(self,gsg,isfindall=False):
@@ -5055,7 +7082,7 @@ class WorldCompress():
 			if self.currentblob.addtoblob(pl):
 				found+=1
 #				print('adding to blob: %s.%d'%(pl.shape.nickname,pl.polygons[0].partindex),file=sys.stderr) #cdebug
-				s.draworderlist[pl.polygons[0].partindex]=self.dest_draworder
+				self.setdraworder(s,pl.polygons[0].partindex)
 				if not isfindall: break
 #		if not found: print('NOT adding to blob: %s'%(pl.shape.nickname),file=sys.stderr) #cdebug
 	def skipfromblob(self,gsg,isfindall=False):
@@ -5077,7 +7104,7 @@ class WorldCompress():
 		for pl in pluses: # this removes ccw as well as removing a redundant floodfill
 			if self.source_draworder!=s.draworderlist[pl.polygons[0].partindex]: continue # this is pl.draworder
 			if self.currentblob.subtractfromblob(pl):
-				s.draworderlist[pl.polygons[0].partindex]=self.dest_draworder
+				self.setdraworder(s,pl.polygons[0].partindex)
 				break
 	def getpluses(self,ispositives=True,isnegatives=True,isoverlaps=True):
 		ret=[]
@@ -5255,46 +7282,53 @@ class WorldCompress():
 		if self.shp.installfile.scale=='10m':
 			if isverbose_global: print('Not making worldcompress for 10m: %s'%label,file=sys.stderr)
 			return
-		if len(label): label+=' '
-		if isverbose_global: print('Creating %sblobs: '%label,end='',file=sys.stderr,flush=True)
-		if isverbose_global: print('Europe ',end='',file=sys.stderr,flush=True)
-		self.addeurope()
-		if isverbose_global: print('North America ',end='',file=sys.stderr,flush=True)
-		self.addnorthamerica(isusacan)
-		if isverbose_global: print('South America ',end='',file=sys.stderr,flush=True)
-		self.addsouthamerica()
-		if isverbose_global: print('Africa ',end='',file=sys.stderr,flush=True)
-		self.addafrica()
-		if isverbose_global: print('Middle East ',end='',file=sys.stderr,flush=True)
-		self.addmiddleeast()
-		if isverbose_global: print('Asia ',end='',file=sys.stderr,flush=True)
-		self.addasia()
-		if isverbose_global: print('done',file=sys.stderr,flush=True)
+		continents=(('Europe',WorldCompress.addeurope,()),('North America',WorldCompress.addnorthamerica,(isusacan,)),
+				('South America',WorldCompress.addsouthamerica,()),('Africa',WorldCompress.addafrica,()),
+				('Middle East',WorldCompress.addmiddleeast,()),('Asia',WorldCompress.addasia,()))
+		hiddens=[]
+		for i in range(len(continents)):
+			(continent,f,args)=continents[i]
+			if not self.isvisible(f,*args): hiddens.append(i+1)
+		name='continents-usacan' if isusacan else 'continents'
+		if not self.loadcache(name):
+			if len(label): label+=' '
+			if isverbose_global: print('Creating %sblobs: '%label,end='',file=sys.stderr,flush=True)
+			for i in range(len(continents)):
+				(continent,f,args)=continents[i]
+				if isverbose_global: print(continent+' ',end='',file=sys.stderr,flush=True)
+				self.group=i+1
+				f(self,*args)
+			self.group=0
+			if isverbose_global: print('done',file=sys.stderr,flush=True)
+			self.savecache(name)
+		for group in hiddens: self.removegroup(group) # hidden continents still claim their parts, only their outlines aren't made
 	def addeuro(self,isscand=True):
+		name='euro-scand' if isscand else 'euro'
+		if self.loadcache(name): return
 		label='euro '
 		if isverbose_global: print('Creating %sblobs: '%label,end='',file=sys.stderr,flush=True)
 		if isverbose_global: print('Euro ',end='',file=sys.stderr,flush=True)
 		self._addeuro(isscand)
 		if isverbose_global: print('done',file=sys.stderr,flush=True)
+		self.savecache(name)
 	def removeskips(self):
 		self.removeoverlaps(self.skiplist,None)
 		self.skiplist=[]
 	def removeoverlaps(self,shapes,draworder):
-		minus=WorldMinus(None)
-		minus.buildindex()
+		edges=set()
 		for shape in shapes:
 			for i in range(len(shape.draworderlist)):
 				if draworder!=None and shape.draworderlist[i]!=draworder: continue
-				start=shape.partlist[i]
-				limit=shape.pointscount
-				if i+1<shape.partscount: limit=shape.partlist[i+1]
-				mpoints=[]
+				(start,limit)=Shape.getpartstartlimit(shape,i)
+				if start==limit: continue
+				lastp=MinusPoint.getmlonlat(shape.pointlist[limit-1])
 				for j in range(start,limit):
-					p=shape.pointlist[j]
-					mpoints.append(MinusPoint(p,shape.index))
-				minus.addtoindex2(mpoints)
+					p=MinusPoint.getmlonlat(shape.pointlist[j])
+					edges.add((lastp,p))
+					edges.add((p,lastp))
+					lastp=p
 		for blob in self.blobs:
-			blob.trimoverlaps(minus)
+			blob.trimoverlaps(edges)
 
 
 def worldcompress_test():
@@ -5683,6 +7717,10 @@ class CornerCleave():
 		if hasneg and haspos: return 0
 		if hasneg: return 1
 		return 2
+	def getnegpos(self,xyzs):
+		if self.corner!=0: raise ValueError
+		(y,z)=(xyzs[1],xyzs[2])
+		return ((z<self.yval)&(y>self.xval),~((z<=self.yval)&(y>=self.xval)))
 	def makeintersectionpoint(self,s,n):
 		if self.corner!=0: raise ValueError
 		if s.patchtype==HEMI_PATCHTYPE:
@@ -5768,10 +7806,17 @@ class ShpAdminShape():
 	def __init__(self,shape,nickname):
 		self.nickname=nickname
 		self.ccwtypes={}
+		self.setshape(shape)
+	def setshape(self,shape):
 		self.index=shape.index
 		self.number=shape.number
 		self.type=shape.type
+		self.isskipped=shape.isskipped
 		self.isclone=False
+		self.unitxyz=None
+		self.caps=None
+		self.importances=shape.importances
+		self.prepareds=None
 		if self.type==POLYGON_TYPE_SHP or self.type==POLYLINE_TYPE_SHP:
 			self.partlist=shape.partlist
 			self.pointlist=shape.pointlist
@@ -5905,6 +7950,67 @@ class ShpAdminShape():
 		self.replacepart(partindex,points)
 		if isverbose_global: print('Fixed %d points in fixegypt'%len(cut),file=sys.stderr)
 
+class PreparedPolygon(): # Polygon.isvertex() and isinterior() for many points, with hashed vertices and edges bucketed by lat
+	def __init__(self,pg,vertexcell=0.02):
+		self.polygon=pg
+		self.vertexcell=vertexcell
+		self.vertices={}
+		self.mbr=Mbr()
+		points=pg.points
+		for p in points:
+			self.mbr.add(p.lon,p.lat)
+			key=(math.floor(p.lon/vertexcell),math.floor(p.lat/vertexcell))
+			l=self.vertices.get(key,None)
+			if l: l.append(p)
+			else: self.vertices[key]=[p]
+		n=len(points)
+		self.nbands=int(math.sqrt(n))+1
+		if self.mbr.isset and self.mbr.maxy>self.mbr.miny: self.bandheight=(self.mbr.maxy-self.mbr.miny)/self.nbands
+		else: self.bandheight=1.0
+		self.bands=[]
+		for i in range(self.nbands): self.bands.append([])
+		for i in range(n):
+			p=points[i-1]
+			q=points[i]
+			edge=(p.lon,p.lat,q.lon,q.lat)
+			for j in range(self.getband(min(p.lat,q.lat)),self.getband(max(p.lat,q.lat))+1): self.bands[j].append(edge)
+	def getband(self,lat):
+		i=int((lat-self.mbr.miny)/self.bandheight)
+		if i<0: return 0
+		if i>=self.nbands: return self.nbands-1
+		return i
+	def isvertex(self,lon,lat): # same as Polygon.isvertex()
+		c=self.vertexcell
+		(x,y)=(math.floor(lon/c),math.floor(lat/c))
+		for i in (x-1,x,x+1):
+			for j in (y-1,y,y+1):
+				l=self.vertices.get((i,j),None)
+				if not l: continue
+				for p in l:
+					if abs(p.lon-lon)<0.01 and abs(p.lat-lat)<0.01: return True
+		return False
+	def isinterior(self,lon,lat): # nonzero winding, which is what Polygon.isinterior() finds with angles
+		if not self.mbr.isset: return False
+		if lon<self.mbr.minx or lon>self.mbr.maxx or lat<self.mbr.miny or lat>self.mbr.maxy: return False
+		wn=0
+		for (x1,y1,x2,y2) in self.bands[self.getband(lat)]:
+			if y1<=lat:
+				if y2<lat: continue
+			elif y2>lat: continue
+			cross=(x2-x1)*(lat-y1)-(lon-x1)*(y2-y1)
+			if abs(cross)<=1e-9*(abs(x2-x1)+abs(y2-y1)): # on or next to the edge, let the angles decide
+				return self.polygon.isinterior(lon,lat)
+			if y1<=lat:
+				if y2>lat and cross>0: wn+=1
+			elif y2<=lat and cross<0: wn-=1
+		return wn!=0
+	def setinside(self,points): # sets side=1 for the points that are vertices or interior, returns the others
+		ret=[]
+		for p in points:
+			if self.isvertex(p.lon,p.lat) or self.isinterior(p.lon,p.lat): p.side=1
+			else: ret.append(p)
+		return ret
+
 class ShpAdminShapeIntersection():
 	def __init__(self):
 		self.pointslist=[]
@@ -5930,21 +8036,24 @@ class ShpAdminShapeIntersection():
 	def clearside(self):
 		for points in self.pointslist:
 			for p in points: p.side=-1
+	def setinsidepart(self,part): # setinside() for the shapes of a ShpAdminPart that could touch
+		if not self.mbr.isset: return
+		for shape in part.getshapes(LonLatWindow.makefrommbr(self.mbr)): self.setinside(shape)
 	def setinside(self,shape):
 		if not self.mbr.isset: return
 		mbr=shape.mbr
 		if not self.mbr.isintersects(mbr): return
-		pluses=ShapePlus.make(shape)
+		prepareds=Shape.getprepareds(shape)
 #		mbr=shape.getmbr([-1])
 		for points in self.pointslist:
+			query=[]
 			for p in points:
 				if p.side==1: continue
 				if not p.isinmbr(mbr): continue
-				for plus in pluses:
-					pg=plus.polygons[0]
-					if pg.isvertex(p.lon,p.lat) or pg.isinterior(p.lon,p.lat):
-						p.side=1
-						break
+				query.append(p)
+			for prepared in prepareds:
+				if not query: break
+				query=prepared.setinside(query)
 	def exportlines(self):
 		ret=[]
 		cur=None
@@ -5973,26 +8082,108 @@ class ShpAdminShapeIntersection():
 				cur=None
 		return ret
 
+class ShpAdminPartIndex(): # a lon/lat grid over every (shape,part), to find what's in a window without checking every shape
+	def __init__(self,shapes,cellsize=10.0):
+		self.shapes=shapes
+		self.cellsize=cellsize
+		self.nlon=int(math.ceil(360.0/cellsize))
+		self.nlat=int(math.ceil(180.0/cellsize))
+		self.entries=[] # (shapeindex,partindex,mbr), partindex is -1 for a whole shape
+		self.cells={}
+		for i,shape in enumerate(shapes):
+			if shape.type==POINT_TYPE_SHP:
+				mbr=Mbr()
+				mbr.add(shape.point.lon,shape.point.lat)
+				self.addentry(i,-1,mbr)
+			elif shape.type!=POLYGON_TYPE_SHP and shape.type!=POLYLINE_TYPE_SHP: continue
+			elif shape.isskipped: self.addentry(i,-1,shape.mbr)
+			else:
+				for j in range(shape.partscount): self.addentry(i,j,shape.getmbr([j]))
+		if isverbose_global: print('Indexed %d parts of %d shapes'%(len(self.entries),len(shapes)),file=sys.stderr)
+	def getcells(self,mbr):
+		i0=max(0,min(self.nlon-1,int((mbr.minx+180.0)//self.cellsize)))
+		i1=max(0,min(self.nlon-1,int((mbr.maxx+180.0)//self.cellsize)))
+		j0=max(0,min(self.nlat-1,int((mbr.miny+90.0)//self.cellsize)))
+		j1=max(0,min(self.nlat-1,int((mbr.maxy+90.0)//self.cellsize)))
+		ret=[]
+		for i in range(i0,i1+1):
+			for j in range(j0,j1+1): ret.append(i*self.nlat+j)
+		return ret
+	def addentry(self,shapeindex,partindex,mbr):
+		if not mbr.isset: return
+		k=len(self.entries)
+		self.entries.append((shapeindex,partindex,mbr))
+		for cell in self.getcells(mbr):
+			l=self.cells.get(cell,None)
+			if l==None: self.cells[cell]=[k]
+			else: l.append(k)
+	def getparts(self,window): # [(shape,[partindex,...]),...] in shapes order, window is a LonLatWindow or None for everything
+		if not window: found=range(len(self.entries))
+		else:
+			found=set()
+			for m in window.mbrs:
+				for cell in self.getcells(m):
+					for k in self.cells.get(cell,()):
+						if k in found: continue
+						if m.isintersects(self.entries[k][2]): found.add(k)
+			found=sorted(found)
+		ret=[]
+		lastindex=-1
+		for k in found:
+			(shapeindex,partindex,_)=self.entries[k]
+			if shapeindex!=lastindex:
+				ret.append((self.shapes[shapeindex],[]))
+				lastindex=shapeindex
+			ret[-1][1].append(partindex)
+		return ret
+	def getshapes(self,window):
+		ret=[]
+		for sp in self.getparts(window): ret.append(sp[0])
+		return ret
+
 class ShpAdminPart():
-	def __init__(self,filenickname,scales):
+	def __init__(self,filenickname,scales,window=None,isload=True): # isload=False leaves shapes empty, for ShpAdminCache
 		self.filename=filenickname
 		self.installfile=install.getinstallfile(filenickname,scales)
 		if not self.installfile:
 			print('Couldn\'t find %s file (%s)'%(filenickname,str(scales)),file=sys.stderr)
 			raise ValueError
 		self.scale=self.installfile.scale
-		self.shp=Shp(installfile=self.installfile)
-		if isverbose_global: print('Loading %s shape data (%s)'%(filenickname,self.scale),file=sys.stderr)
-		self.shp.loadshapes()
 		self.shapes=[]
 		self.bynickname={}
 		self.dbfname=self.installfile.nickname[:-3]+'dbf'
+		self.shp=None
+		self.dbf=None
+		self.index=None
+		if not isload: return
+		self.shp=Shp(installfile=self.installfile)
+		if isverbose_global: print('Loading %s shape data (%s)'%(filenickname,self.scale),file=sys.stderr)
+		self.shp.loadshapes(window)
 		self.dbf=Dbf(installfile=install.getinstallfile(self.dbfname,[self.scale]))
 	def bynickname2(self,nick):
 		for s in self.shapes:
 			if s.nickname.startswith(nick): return s
 		return None
+	def fetch(self,sas): # decode a shape that was skipped by the window
+		if not sas.isskipped: return sas
+		sas.setshape(self.shp.loadshape(sas.index))
+		self.index=None
+		return sas
+	def loadwindow(self,window): # decode skipped shapes that are in window, or all of them if window is None
+		if not self.shp: return []
+		indices=self.shp.loadskipped(window)
+		for i in indices: self.shapes[i].setshape(self.shp.shapes[i])
+		if indices: self.index=None
+		return indices
+	def getindex(self): # built on first use and kept until shapes change
+		if not self.index: self.index=ShpAdminPartIndex(self.shapes)
+		return self.index
+	def getshapes(self,window): # shapes with a part in window, in order
+		return self.getindex().getshapes(window)
+	def getshapesinview(self,rotation,boxzoomcleave):
+		return self.getshapes(LonLatWindow.makefromview(rotation,boxzoomcleave))
 	def addshape(self,shape,nickname):
+		self.index=None
 		sas=ShpAdminShape(shape,nickname)
 		if nickname:
 #			if nickname in self.bynickname: print('Duplicate nickname:',nickname,file=sys.stderr)
@@ -6008,11 +8199,12 @@ class ShpAdminPart():
 			self.bynickname[np[1]]=sas
 	def loaddbf(self,fields):
 		for f in fields: self.dbf.selectcfield(f[0],f[1])
-		self.dbf.loadrecords()
+		self.dbf.loadrecords(iscolumnar=True)
+		columns=[]
+		for f in fields: columns.append(self.dbf.getcolumn(f[1]))
 		for i in range(self.dbf.numrecords):
-			r=self.dbf.records[i]
 			vals=[]
-			for f in fields: vals.append(r[f[1]])
+			for c in columns: vals.append(c[i])
 			nickname='.'.join(vals)
 			self.addshape(self.shp.shapes[i],nickname)
 	def loadadmin0dbf(self):
@@ -6098,38 +8290,342 @@ class ShpAdminLines():
 		return ret
 		
 
+class ShpAdminCache(): # admin0 after fixup() with the importances of each part, packed to a file in shpcachedir_global
+	magic=b'pyshpc02'
+	@staticmethod
+	def getfilename(part,label):
+		return shpcachedir_global+'/shpcache-'+part.scale+'-'+part.installfile.nickname[:-4]+'-'+label+'.bin'
+	@staticmethod
+	def getkey(part,label): # changes if the shp or dbf file changes
+		a=[version_global,label]
+		for installfile in (part.installfile,install.getinstallfile(part.dbfname,[part.scale])):
+			a.append(installfile.getcachekey())
+		return '|'.join(a)
+	@staticmethod
+	def save(part,label):
+		fn=ShpAdminCache.getfilename(part,label)
+		if isverbose_global: print('Saving shape cache to %s'%fn,file=sys.stderr)
+		coords=array.array('d')
+		importances=array.array('d')
+		meta=io.BytesIO()
+		for sas in part.shapes:
+			meta.write(struct.pack('<iiiII',sas.index,sas.number,sas.type,
+					sas.partscount if sas.type!=POINT_TYPE_SHP else 0, sas.pointscount if sas.type!=POINT_TYPE_SHP else 1))
+			if sas.type==POLYGON_TYPE_SHP or sas.type==POLYLINE_TYPE_SHP:
+				meta.write(struct.pack('<4d',sas.mbr.minx,sas.mbr.miny,sas.mbr.maxx,sas.mbr.maxy))
+				meta.write(struct.pack('<%dI'%sas.partscount,*sas.partlist))
+				for i in range(sas.partscount): # 0 if the shape was edited, they're made again after loading
+					if not isinstance(sas.pointlist,PointList):
+						meta.write(struct.pack('<I',0))
+						continue
+					limit=sas.partlist[i+1] if i+1!=sas.partscount else sas.pointscount
+					importance=Shape.getimportance(sas,sas.partlist[i],limit)
+					meta.write(struct.pack('<I',len(importance)))
+					importances.extend(importance)
+				for p in sas.pointlist:
+					coords.append(p.lon)
+					coords.append(p.lat)
+			elif sas.type==POINT_TYPE_SHP:
+				coords.append(sas.point.lon)
+				coords.append(sas.point.lat)
+			nickname=sas.nickname.encode()
+			meta.write(struct.pack('<H',len(nickname)))
+			meta.write(nickname)
+			meta.write(struct.pack('<H',len(sas.ccwtypes)))
+			for i in sas.ccwtypes: meta.write(struct.pack('<II',i,sas.ccwtypes[i]))
+		if sys.byteorder=='big':
+			coords.byteswap()
+			importances.byteswap()
+		key=ShpAdminCache.getkey(part,label).encode()
+		f=open(fn+'.tmp','wb')
+		f.write(ShpAdminCache.magic)
+		f.write(struct.pack('<IIII',len(key),len(part.shapes),len(coords),len(importances)))
+		f.write(key)
+		f.write(coords.tobytes())
+		f.write(importances.tobytes())
+		f.write(meta.getvalue())
+		f.close()
+		os.replace(fn+'.tmp',fn)
+	@staticmethod
+	def load(part,label): # fills part.shapes, returns False if the cache is missing or stale
+		fn=ShpAdminCache.getfilename(part,label)
+		try:
+			f=open(fn,'rb')
+		except FileNotFoundError:
+			if isverbose_global: print('Checked cache for %s'%fn,file=sys.stderr)
+			return False
+		data=f.read()
+		f.close()
+		if data[0:8]!=ShpAdminCache.magic: return False
+		(keylen,count,ncoords,nimportances)=struct.unpack_from('<IIII',data,8)
+		offset=24
+		if data[offset:offset+keylen]!=ShpAdminCache.getkey(part,label).encode():
+			if isverbose_global: print('Shape cache %s is stale'%fn,file=sys.stderr)
+			return False
+		if isverbose_global: print('Loading shape cache from %s'%fn,file=sys.stderr)
+		offset+=keylen
+		coords=array.array('d')
+		coords.frombytes(data[offset:offset+8*ncoords])
+		if sys.byteorder=='big': coords.byteswap()
+		offset+=8*ncoords
+		importances=array.array('d')
+		importances.frombytes(data[offset:offset+8*nimportances])
+		if sys.byteorder=='big': importances.byteswap()
+		offset+=8*nimportances
+		start=0
+		istart=0
+		for _ in range(count):
+			(index,number,shapetype,partscount,pointscount)=struct.unpack_from('<iiiII',data,offset)
+			offset+=20
+			shape=Shape(index,number)
+			shape.type=shapetype
+			if shapetype==POLYGON_TYPE_SHP or shapetype==POLYLINE_TYPE_SHP:
+				shape.mbr=Mbr()
+				shape.mbr.set(*struct.unpack_from('<4d',data,offset))
+				offset+=32
+				shape.partlist=list(struct.unpack_from('<%dI'%partscount,data,offset))
+				offset+=4*partscount
+				shape.partscount=partscount
+				shape.pointscount=pointscount
+				shape.pointlist=PointList(coords,start,pointscount)
+				shape.importances=(shape.pointlist,{})
+				for i in range(partscount):
+					limit=shape.partlist[i+1] if i+1!=partscount else pointscount
+					n=struct.unpack_from('<I',data,offset)[0]
+					offset+=4
+					if n: shape.importances[1][(shape.partlist[i],limit)]=importances[istart:istart+n].tolist()
+					istart+=n
+				shape.ccwtypes={}
+				shape.draworderlist=[0]*partscount
+			elif shapetype==POINT_TYPE_SHP:
+				shape.point=DegLonLat(coords[start*2],coords[start*2+1])
+				shape.draworder=0
+			start+=pointscount
+			n=struct.unpack_from('<H',data,offset)[0]
+			nickname=data[offset+2:offset+2+n].decode()
+			offset+=2+n
+			part.addshape(shape,nickname)
+			sas=part.shapes[-1]
+			n=struct.unpack_from('<H',data,offset)[0]
+			offset+=2
+			for i in range(n):
+				(j,c)=struct.unpack_from('<II',data,offset)
+				sas.ccwtypes[j]=c
+				offset+=8
+		return True
+
+class WorldCompressCache(): # WorldCompress blobs and draworder changes, packed to a file in shpcachedir_global
+	magic=b'pywcc004'
+	@staticmethod
+	def getfilename(wc,name):
+		part=wc.shp.admin0
+		return shpcachedir_global+'/wccache-'+part.scale+'-'+part.installfile.nickname[:-4]+'-'+name+'.bin'
+	@staticmethod
+	def getgeometrycrc(shapes): # crc32 of the polygon parts and points, the same for a PointList or an edited list
+		crc=0
+		for shape in shapes:
+			if shape.type!=POLYGON_TYPE_SHP: continue
+			crc=zlib.crc32(struct.pack('<II',shape.partscount,shape.pointscount),crc)
+			crc=zlib.crc32(struct.pack('<%dI'%shape.partscount,*shape.partlist),crc)
+			pl=shape.pointlist
+			if isinstance(pl,PointList):
+				crc=zlib.crc32(memoryview(pl.coords)[pl.start*2:(pl.start+pl.count)*2],crc)
+			else:
+				coords=array.array('d')
+				for p in pl:
+					coords.append(p.lon)
+					coords.append(p.lat)
+				crc=zlib.crc32(coords.tobytes(),crc)
+		return crc
+	@staticmethod
+	def getkey(wc,name): # changes if the shp, the shapes, their points or their draworders change, so this is made before any blobs
+		draworders=array.array('i')
+		for shape in wc.shp.shapes:
+			if shape.type!=POLYGON_TYPE_SHP: continue
+			draworders.append(len(shape.draworderlist))
+			draworders.extend(shape.draworderlist)
+		a=[ShpAdminCache.getkey(wc.shp.admin0,name),str(wc.source_draworder),str(wc.dest_draworder),str(len(wc.shp.shapes)),
+				'%08x'%(zlib.crc32(draworders.tobytes()) if zlib else 0),
+				'%08x'%(WorldCompressCache.getgeometrycrc(wc.shp.shapes) if zlib else 0)]
+		return '|'.join(a)
+	@staticmethod
+	def save(wc,name):
+		if not wc.cachekey: return
+		for shape in wc.shp.shapes:
+			if shape.isskipped: return # the blobs would be missing shapes
+		fn=WorldCompressCache.getfilename(wc,name)
+		if isverbose_global: print('Saving worldcompress cache to %s'%fn,file=sys.stderr)
+		coords=array.array('d')
+		meta=io.BytesIO()
+		for blob in wc.blobs:
+			outline=blob.getoutline()
+			arcs=[]
+			for points in blob.getarcs(): arcs.extend(blob.trimarc(points))
+			meta.write(struct.pack('<IIII',blob.group,len(outline),len(blob.negatives),len(arcs)))
+			for pg in outline:
+				meta.write(struct.pack('<IB',len(pg.points),1 if pg.iscw else 0))
+				for p in pg.points:
+					coords.append(p.lon)
+					coords.append(p.lat)
+			for pg in blob.negatives:
+				meta.write(struct.pack('<iiiIB',pg.index,pg.partindex,pg.ccwtype,len(pg.points),1 if pg.iscw else 0))
+				for p in pg.points:
+					coords.append(p.lon)
+					coords.append(p.lat)
+			for points in arcs:
+				meta.write(struct.pack('<I',len(points)))
+				for (m,p) in points:
+					coords.append(p.lon)
+					coords.append(p.lat)
+		for (index,partindex,group) in wc.setdraworders: meta.write(struct.pack('<III',index,partindex,group))
+		if sys.byteorder=='big': coords.byteswap()
+		key=wc.cachekey.encode()
+		f=open(fn+'.tmp','wb')
+		f.write(WorldCompressCache.magic)
+		f.write(struct.pack('<IIII',len(key),len(coords),len(wc.blobs),len(wc.setdraworders)))
+		f.write(key)
+		f.write(coords.tobytes())
+		f.write(meta.getvalue())
+		f.close()
+		os.replace(fn+'.tmp',fn)
+	@staticmethod
+	def load(wc,name): # fills wc.blobs and sets draworders, returns False if the cache is missing or stale
+		if not shpcachedir_global: return False
+		wc.cachekey=WorldCompressCache.getkey(wc,name)
+		fn=WorldCompressCache.getfilename(wc,name)
+		try:
+			f=open(fn,'rb')
+		except FileNotFoundError:
+			if isverbose_global: print('Checked cache for %s'%fn,file=sys.stderr)
+			return False
+		data=f.read()
+		f.close()
+		if data[0:8]!=WorldCompressCache.magic: return False
+		(keylen,ncoords,nblobs,ndraworders)=struct.unpack_from('<IIII',data,8)
+		offset=24
+		if data[offset:offset+keylen]!=wc.cachekey.encode():
+			if isverbose_global: print('Worldcompress cache %s is stale'%fn,file=sys.stderr)
+			return False
+		if isverbose_global: print('Loading worldcompress cache from %s'%fn,file=sys.stderr)
+		offset+=keylen
+		coords=array.array('d')
+		coords.frombytes(data[offset:offset+8*ncoords])
+		if sys.byteorder=='big': coords.byteswap()
+		offset+=8*ncoords
+		ci=0
+		for _ in range(nblobs):
+			(group,noutline,nnegatives,narcs)=struct.unpack_from('<IIII',data,offset)
+			offset+=16
+			outline=[]
+			for _ in range(noutline):
+				(n,iscw)=struct.unpack_from('<IB',data,offset)
+				offset+=5
+				pg=Polygon(0,0)
+				for i in range(ci,ci+n*2,2): pg.points.append(DegLonLat(coords[i],coords[i+1]))
+				ci+=n*2
+				pg.iscw=(iscw==1)
+				outline.append(pg)
+			negatives=[]
+			for _ in range(nnegatives):
+				(index,partindex,ccwtype,n,iscw)=struct.unpack_from('<iiiIB',data,offset)
+				offset+=17
+				pg=Polygon(index,partindex,ccwtype)
+				for i in range(ci,ci+n*2,2): pg.points.append(DegLonLat(coords[i],coords[i+1]))
+				ci+=n*2
+				pg.iscw=(iscw==1)
+				negatives.append(pg)
+			arcs=[]
+			for _ in range(narcs):
+				n=struct.unpack_from('<I',data,offset)[0]
+				offset+=4
+				points=[]
+				for i in range(ci,ci+n*2,2):
+					p=DegLonLat(coords[i],coords[i+1])
+					points.append((MinusPoint.getmlonlat(p),p))
+				ci+=n*2
+				arcs.append(points)
+			blob=WorldTopoBlob.makefromcache(outline,negatives,arcs)
+			blob.group=group
+			wc.blobs.append(blob)
+		for _ in range(ndraworders):
+			(index,partindex,wc.group)=struct.unpack_from('<III',data,offset)
+			offset+=12
+			wc.setdraworder(wc.shp.shapes[index],partindex)
+		wc.group=0
+		if wc.blobs: wc.currentblob=wc.blobs[-1]
+		return True
+
 class ShpAdmin():
-	def __init__(self,filename,scales):
-		self.admin0=ShpAdminPart(filename,scales)
-		self.admin0.loadadmin0dbf()
-		self.scale=self.admin0.scale
-		self.installfile=self.admin0.installfile
-		self.shapes=self.admin0.shapes
-		self.bynickname=self.admin0.bynickname
+	def __init__(self,filename,scales,window=None,isfixup=False): # window: only decode shapes that might be seen, see loadwindow
+		self.window=window
+		self.pendingfixes={}
 		self.islakesloaded=False
 		self.isdisputedloaded=False
 		self.isadmin1loaded=False
 		self.isadmin1linesloaded=False
+		self.topology=None
+		iscache=isfixup and shpcachedir_global
+		if iscache:
+			self.admin0=ShpAdminPart(filename,scales,isload=False)
+			if not ShpAdminCache.load(self.admin0,'fixup'):
+				self.admin0=None
+				window=None # the cache needs every shape
+		else: self.admin0=None
+		if not self.admin0:
+			self.admin0=ShpAdminPart(filename,scales,window)
+			self.admin0.loadadmin0dbf()
+		self.scale=self.admin0.scale
+		self.installfile=self.admin0.installfile
+		self.shapes=self.admin0.shapes
+		self.bynickname=self.admin0.bynickname
+		if isfixup and self.admin0.shp:
+			self.fixup()
+			if iscache: ShpAdminCache.save(self.admin0,'fixup')
+	def gettopology(self): # WorldTopology of the admin0 shapes, made again if they've changed
+		if not self.topology or not self.topology.isvalid(self.shapes): self.topology=WorldTopology(self.shapes)
+		return self.topology
+	def fixup(self):
+		self.fixantarctica()
+		self.fixrussia()
+		self.fixegypt()
+		self.setccwtypes()
+	def fetch(self,nickname): # decode one skipped admin0 shape, applying any fixes that were waiting for it
+		shape=self.admin0.fetch(self.bynickname[nickname])
+		f=self.pendingfixes.pop(nickname,None)
+		if f: f()
+		return shape
+	def loadwindow(self,window): # decode the shapes that were skipped and fall in window, None for all of them
+		self.window=window
+		parts=[self.admin0]
+		if self.islakesloaded: parts.append(self.lakes)
+		if self.isdisputedloaded: parts.append(self.disputed)
+		if self.isadmin1loaded: parts.append(self.admin1)
+		if self.isadmin1linesloaded: parts.append(self.admin1lines)
+		for part in parts: part.loadwindow(window)
+		for n in list(self.pendingfixes):
+			if self.bynickname[n].isskipped: continue
+			f=self.pendingfixes.pop(n)
+			f()
 	def loadlakes(self):
 		if self.islakesloaded: return
-		self.lakes=ShpAdminPart('lakes.shp',[self.scale])
+		self.lakes=ShpAdminPart('lakes.shp',[self.scale],self.window)
 		self.lakes.loadlakesdbf()
 		self.islakesloaded=True
 	def loaddisputed(self,is10m=True):
 		scale=self.scale
 		if is10m: scale='10m'
 		if self.isdisputedloaded: return
-		self.disputed=ShpAdminPart('admin0-disputed.shp',[scale])
+		self.disputed=ShpAdminPart('admin0-disputed.shp',[scale],self.window)
 		self.disputed.loaddisputeddbf()
 		self.isdisputedloaded=True
 	def loadadmin1(self):
 		if self.isadmin1loaded: return
-		self.admin1=ShpAdminPart('admin1-nolakes.shp',[self.scale])
+		self.admin1=ShpAdminPart('admin1-nolakes.shp',[self.scale],self.window)
 		self.admin1.loadadmin1dbf()
 		self.isadmin1loaded=True
 	def loadadmin1lines(self):
 		if self.isadmin1linesloaded: return
-		self.admin1lines=ShpAdminPart('admin1-lines.shp',[self.scale])
+		self.admin1lines=ShpAdminPart('admin1-lines.shp',[self.scale],self.window)
 		self.admin1lines.loadadmin1linesdbf()
 		self.isadmin1linesloaded=True
 	def setdraworder(self,index,partidx,draworder):
@@ -6144,11 +8640,17 @@ class ShpAdmin():
 		if self.installfile.scale=='10m':
 			if self.installfile.nickname=='admin0-lakes.shp':
 				canada=self.admin0.bynickname['CAN.CAN']
+				if canada.isskipped:
+					self.pendingfixes['CAN.CAN']=self.setccwtypes
+					return
 				if canada.partscount==455:
 					lakes=[1,2,3]
 					for i in lakes: canada.ccwtypes[i]=REVERSE_CCWTYPE
 	def fixantarctica(self):
 		ata=self.bynickname['ATA.ATA']
+		if ata.isskipped:
+			self.pendingfixes['ATA.ATA']=self.fixantarctica
+			return
 		if self.installfile.scale=='50m':
 			if ata.partscount!=108: raise ValueError
 			ata.fixantarctica(2)
@@ -6160,6 +8662,9 @@ class ShpAdmin():
 		else: raise ValueError
 	def fixrussia(self,isdebug=False):
 		rus=self.bynickname['RUS.RUS']
+		if rus.isskipped:
+			self.pendingfixes['RUS.RUS']=self.fixrussia
+			return
 		if self.installfile.scale=='50m':
 			if rus.partscount!=101: raise ValueError
 			rus.fixrussia(18,17,istrimtail=True,isdebug=isdebug)
@@ -6171,6 +8676,9 @@ class ShpAdmin():
 		else: raise ValueError
 	def fixegypt(self):
 		egy=self.bynickname['EGY.EGY']
+		if egy.isskipped:
+			self.pendingfixes['EGY.EGY']=self.fixegypt
+			return
 		if self.installfile.scale=='10m':
 			if egy.partscount!=10: raise ValueError
 			egy.fixegypt(0)
@@ -6194,7 +8702,7 @@ class ShpAdmin():
 	def selectdisputed(self,names,draworder):
 		self.loaddisputed()
 		for n in names:
-			shape=self.disputed.bynickname[n]
+			shape=self.disputed.fetch(self.disputed.bynickname[n])
 			shape.setdraworder(-1,draworder)
 	
 def sphere2_test(): # test ShpAdmin
@@ -7001,7 +9509,7 @@ def loaddbf_locatormap(shp):
 	if isverbose_global: print('Loading admin0 dbf data (%s)'%shp.installfile.scale,file=sys.stderr)
 	dbf.selectcfield('SOV_A3','sov3')
 	dbf.selectcfield('ADM0_A3','adm3')
-	dbf.loadrecords()
+	dbf.loadrecords(iscolumnar=True)
 	for i in range(dbf.numrecords):
 		r=dbf.records[i]
 		nickname=r['sov3']+'.'+r['adm3']
@@ -7088,21 +9596,13 @@ def locatormap(output,overrides,labels):
 
 	full_admin0=ShpAdmin('admin0-nolakes.shp',[options['fullm']])
 
-	sphere_admin0=ShpAdmin('admin0-nolakes.shp',[options['spherem']])
-	sphere_admin0.fixantarctica()
-	sphere_admin0.fixrussia()
-	sphere_admin0.fixegypt()
-	sphere_admin0.setccwtypes()
+	sphere_admin0=ShpAdmin('admin0-nolakes.shp',[options['spherem']],isfixup=True)
 	sphere_admin0.loadlakes()
 
 	if options['zoomm']==options['spherem']:
 		zoom_admin0=sphere_admin0
 	else:
-		zoom_admin0=ShpAdmin('admin0-nolakes.shp',[options['zoomm']])
-		zoom_admin0.fixantarctica()
-		zoom_admin0.fixrussia()
-		zoom_admin0.fixegypt()
-		zoom_admin0.setccwtypes()
+		zoom_admin0=ShpAdmin('admin0-nolakes.shp',[options['zoomm']],isfixup=True)
 		zoom_admin0.loadlakes()
 
 	if 'gsg' in options:
@@ -7220,12 +9720,8 @@ def euromap(output,overrides,labels):
 	moredots=options['euromapdots_50m']
 	rotation=SphereRotation()
 
-	admin0=ShpAdmin('admin0-nolakes.shp',[options['spherem']])
-	admin0.fixantarctica()
-	admin0.fixrussia()
-	admin0.fixegypt()
+	admin0=ShpAdmin('admin0-nolakes.shp',[options['spherem']],isfixup=True)
 	admin0.makecyprusfull()
-	admin0.setccwtypes()
 	if options['islakes']: admin0.loadlakes()
 
 	(lon,lat)=admin0.bynickname['DEU.DEU'].getcenter([-1])
@@ -7255,8 +9751,10 @@ def euromap(output,overrides,labels):
 	if 'SWE.SWE' in options['gsgs'] or 'FI1.FIN' in options['gsgs']: iscompressscandinavia=False
 	eu_wc.addeuro(iscompressscandinavia)
 	other_wc=WorldCompress(admin0,-1)
-	other_wc.addafrica()
-	other_wc.addmiddleeast()
+	if not other_wc.loadcache('africa-middleeast'):
+		other_wc.addafrica()
+		other_wc.addmiddleeast()
+		other_wc.savecache('africa-middleeast')
 
 	if options['gsgs']:
 		for gsg in options['gsgs']:
@@ -7271,16 +9769,14 @@ def euromap(output,overrides,labels):
 		pluses=eu_wc.getpluses(isnegatives=False,isoverlaps=False)
 		for plus in pluses:
 			sasi.addfromplus(plus)
-		for l in admin0.lakes.shapes:
-			sasi.setinside(l)
+		sasi.setinsidepart(admin0.lakes)
 		euborderlakeshapes=sasi.exportlines()
 
 	gsgborderlakeshapes=[]
 	if options['islakes']:
 		sasi=ShpAdminShapeIntersection()
 		sasi.addfromshapes(admin0.shapes,3)
-		for l in admin0.lakes.shapes:
-			sasi.setinside(l)
+		sasi.setinsidepart(admin0.lakes)
 		gsgborderlakeshapes=sasi.exportlines()
 
 #	print_header_svg(output,width,height,css,options['labelfont'],[options['copyright'],options['comment']])
@@ -7429,11 +9925,9 @@ def countrymap(output,overrides,labels):
 	moredots=options['countrymapdots_10m']
 	admin1=options['admin1']
 
-	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']])
-	admin.fixantarctica()
-	admin.fixrussia()
-	admin.fixegypt()
-	admin.setccwtypes()
+	window=None
+	if zoomscale!=1: window=LonLatWindow() # nothing is decoded until the center is known
+	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']],window,isfixup=True)
 #	admin.loadlakes()
 
 	if options['disputed']: admin.selectdisputed(options['disputed'],1)
@@ -7442,6 +9936,7 @@ def countrymap(output,overrides,labels):
 		admin.loadadmin1()
 		admin.loadadmin1lines()
 
+	for gsg in options['gsgs']: admin.fetch(gsg)
 	if options['centerindices_10m']:
 		if isverbose_global: print('Looking for custom center: %s'%str(options['centerindices_10m']),file=sys.stderr)
 		(lon,lat)=admin.bynickname[options['gsg']].getcenter(options['centerindices_10m'])
@@ -7451,6 +9946,7 @@ def countrymap(output,overrides,labels):
 	if options['lat']!=None: lat=options['lat']
 	if isverbose_global: print('Centering on %f,%f'%(lon,lat),file=sys.stderr)
 	rotation.set_deglonlat(lon,lat)
+	if window!=None: admin.loadwindow(LonLatWindow.makefromzoom(lon,lat,zoomscale))
 
 	bzc=None
 	cc=None
@@ -7501,6 +9997,7 @@ def countrymap(output,overrides,labels):
 			if not admin1shape:
 				print('Couldn\'t find admin1 nickname %s in database'%admin1,file=sys.stderr)
 				raise ValueError
+			admin.admin1.fetch(admin1shape)
 			admin1shape.setdraworder(-1,3)
 			admin1lines.addpolygons([admin1shape],None)
 			admin1lines.reducelines()
@@ -7549,15 +10046,13 @@ def countrymap(output,overrides,labels):
 		if isverbose_global: print('Finding admin0 border lakes (%s)'%options['spherem'],file=sys.stderr)
 		sasi=ShpAdminShapeIntersection()
 		sasi.addfromshapes(admin.shapes,2)
-		for l in admin.lakes.shapes:
-			sasi.setinside(l)
+		sasi.setinsidepart(admin.lakes)
 		borderlakeshapes=sasi.exportlines()
 		if admin1shape:
 			if isverbose_global: print('Finding admin1 border lakes (%s)'%options['spherem'],file=sys.stderr)
 			sasi=ShpAdminShapeIntersection()
 			sasi.addfromshapes(admin.admin1.shapes,3)
-			for l in admin.lakes.shapes:
-				sasi.setinside(l)
+			sasi.setinsidepart(admin.lakes)
 			admin1_borderlakeshapes=sasi.exportlines()
 			for plus in borderlakeshapes:
 				if plus.type!=POLYLINE_TYPE_SHP: continue
@@ -7580,7 +10075,7 @@ def countrymap(output,overrides,labels):
 			if options['isdisputed_labels']:
 				if not labels: labels=LabelMaker()
 				for dl in options['disputed_labels']:
-					s=admin.disputed.bynickname[dl[0]]
+					s=admin.disputed.fetch(admin.disputed.bynickname[dl[0]])
 					labels.addlabelshape(s,rotation,width,height,bzc,dl[2],dl[3],dl[4],dl[1],dl[5],dl[6],dl[7],dl[8],dl[9])
 				
 	if moredots:
@@ -7633,36 +10128,130 @@ def countrymap(output,overrides,labels):
 				ishypso=ishypso, isgradients=isgradients)
 		output.prepend(o)
 
+class CollapseTable(dict): # str.translate() table for Options.collapsename, filled in as characters are seen
+	Accents=('İ',)  # this can be converted to multiple chars with .lower(), easiest to just convert them first
+	Nocents=('i',)
+	accents=('é','á','ó','í','ñ','ú','è','ô','ç','š','ø','ä','ö','ậ','ắ','à','đ','ế','ệ','ê','ì','ị','ớ','ò','ồ','ð','ư','ạ','ằ','ẵ','ả','â','ề','ĩ','ơ','ọ','ừ','ũ','ộ','ã','ă','å','ā','č','ĭ','ï','ň','ŏ','õ','ř','ü','ý','ž','ë','ş','ğ','ə','ı','œ','æ','ć','ł','ź','ś','ę', 'ū','ī','ḩ','ţ','î','û','ō','ż','ġ','ħ','ċ','ș','ṭ','ḷ','ṇ','ḍ','ĕ')
+	nocents=('e','a','o','i','n','u','e','o','c','s','o','a','o','a','a','a','d','e','e','e','i','i','o','o','o','d','u','a','a','a','a','a','e','i','o','o','u','u','o','a','a','a','a','c','i','i','n','o','o','r','u','y','z','e','s','g','e','i','o','a','c','l','z','s','e',
+'u','i','h','t','i','u','o','z','g','h','c','s','t','l','n','d','e')
+	ellipses=(' ','\'','-',',','.','–','`','/','\\')
+	def __missing__(self,o):
+		c=chr(o)
+		if c in CollapseTable.ellipses:
+			c=None
+		else:
+			if c in CollapseTable.Accents: c=CollapseTable.Nocents[CollapseTable.Accents.index(c)]
+			c=c.lower()
+			if c in CollapseTable.accents: c=CollapseTable.nocents[CollapseTable.accents.index(c)]
+		self[o]=c
+		return c
+
+class Admin1Index(): # admin1 names grouped by sov3.adm3 for Options, saved to shpcachedir_global
+	magic='pyshpa01'
+	def __init__(self):
+		self.groups={} # gsg -> [(name,type,collapsed name,collapsed type),...] in dbf order
+		self.paths={}
+	def addadmin1(self,gsg,name,t,cname=None,ctype=None):
+		if cname==None: cname=Options.collapsename(name)
+		if ctype==None: ctype=Options.collapsename(t)
+		group=self.groups.get(gsg,None)
+		if group==None:
+			group=[]
+			self.groups[gsg]=group
+		group.append((name,t,cname,ctype))
+	def getpaths(self,gsg): # names under a country path, a type suffix is added when a name isn't unique
+		ret=self.paths.get(gsg,None)
+		if ret!=None: return ret
+		group=self.groups.get(gsg,[])
+		shortnames={}
+		for e in group: shortnames[e[0]]=shortnames.get(e[0],0)+1
+		ret=[]
+		for (name,t,cname,ctype) in group:
+			if shortnames[name]==1: ret.append(cname)
+			else: ret.append(cname+'_'+ctype)
+		self.paths[gsg]=ret
+		return ret
+	def find(self,gsg,cname,ctype=None): # (name,type) of the first match, None if there's no match
+		for e in self.groups.get(gsg,[]):
+			if e[2]!=cname: continue
+			if ctype and e[3]!=ctype: continue
+			return (e[0],e[1])
+		return None
+	@staticmethod
+	def makefromdbf(dbf):
+		sov3s=dbf.getcolumn('sov3')
+		adm3s=dbf.getcolumn('adm3')
+		names=dbf.getcolumn('name')
+		types=dbf.getcolumn('type')
+		ai=Admin1Index()
+		for i in range(len(names)):
+			name=names[i]
+			if not name: name='_blank_'+str(i)
+			ai.addadmin1(sov3s[i]+'.'+adm3s[i],name,types[i])
+		return ai
+	@staticmethod
+	def getfilename(installfile):
+		return shpcachedir_global+'/admin1index-'+installfile.scale+'-'+installfile.nickname[:-4]+'.txt'
+	@staticmethod
+	def getkey(installfile): # includes the version since Options.loadadmin1dbf fixes some names
+		return Admin1Index.magic+'\t'+version_global+'|'+installfile.getcachekey()
+	@staticmethod
+	def make(options):
+		installfile=install.getinstallfile('admin1-nolakes.dbf',['10m'])
+		if shpcachedir_global:
+			ai=Admin1Index.load(installfile)
+			if ai: return ai
+		dbf=options.admin1dbf
+		if not dbf: dbf=options.loadadmin1dbf()
+		ai=Admin1Index.makefromdbf(dbf)
+		if shpcachedir_global: ai.save(installfile)
+		return ai
+	def save(self,installfile):
+		fn=Admin1Index.getfilename(installfile)
+		if isverbose_global: print('Saving admin1 index to %s'%fn,file=sys.stderr)
+		f=open(fn+'.tmp','w',encoding='utf-8')
+		f.write(Admin1Index.getkey(installfile)+'\n')
+		for gsg in self.groups:
+			for e in self.groups[gsg]: f.write('%s\t%s\t%s\t%s\t%s\n'%(gsg,e[0],e[1],e[2],e[3]))
+		f.close()
+		os.replace(fn+'.tmp',fn)
+	@staticmethod
+	def load(installfile): # None if the file is missing or stale
+		fn=Admin1Index.getfilename(installfile)
+		try:
+			f=open(fn,'r',encoding='utf-8')
+		except FileNotFoundError:
+			if isverbose_global: print('Checked admin1 index %s'%fn,file=sys.stderr)
+			return None
+		lines=f.read().split('\n')
+		f.close()
+		if lines[0]!=Admin1Index.getkey(installfile):
+			if isverbose_global: print('Admin1 index %s is stale'%fn,file=sys.stderr)
+			return None
+		if isverbose_global: print('Loading admin1 index from %s'%fn,file=sys.stderr)
+		ai=Admin1Index()
+		for line in lines[1:]:
+			if not line: continue
+			a=line.split('\t')
+			ai.addadmin1(a[0],a[1],a[2],a[3],a[4])
+		return ai
+
 class Options():
+	collapsetable=None
 	@staticmethod
 	def collapsename(name):
-		Accents=('İ',)  # this can be converted to multiple chars with .lower(), easiest to just convert them first
-		Nocents=('i',)
-		accents=('é','á','ó','í','ñ','ú','è','ô','ç','š','ø','ä','ö','ậ','ắ','à','đ','ế','ệ','ê','ì','ị','ớ','ò','ồ','ð','ư','ạ','ằ','ẵ','ả','â','ề','ĩ','ơ','ọ','ừ','ũ','ộ','ã','ă','å','ā','č','ĭ','ï','ň','ŏ','õ','ř','ü','ý','ž','ë','ş','ğ','ə','ı','œ','æ','ć','ł','ź','ś','ę', 'ū','ī','ḩ','ţ','î','û','ō','ż','ġ','ħ','ċ','ș','ṭ','ḷ','ṇ','ḍ','ĕ')
-		nocents=('e','a','o','i','n','u','e','o','c','s','o','a','o','a','a','a','d','e','e','e','i','i','o','o','o','d','u','a','a','a','a','a','e','i','o','o','u','u','o','a','a','a','a','c','i','i','n','o','o','r','u','y','z','e','s','g','e','i','o','a','c','l','z','s','e',
-'u','i','h','t','i','u','o','z','g','h','c','s','t','l','n','d','e')
-		ellipses=(' ','\'','-',',','.','–','`','/','\\')
-		terms=('(','[')
-		a=list(name)
-		n=len(a)
-		i=0
-		while i<n:
-			if a[i] in ellipses:
-				del a[i]
-				n-=1
-				continue
-			if a[i] in terms:
-				del a[i:]
-				n=i
-				continue
-			if a[i] in Accents: a[i]=Nocents[Accents.index(a[i])]
-			a[i]=a[i].lower()
-			if a[i] in accents: a[i]=nocents[accents.index(a[i])]
-			i+=1
-		return ''.join(a)
+		for t in ('(','['):
+			i=name.find(t)
+			if i>=0: name=name[:i]
+		if not Options.collapsetable: Options.collapsetable=CollapseTable()
+		return name.translate(Options.collapsetable)
+	registry=None # root name -> *_options function
 	def __init__(self):
 		self.admin1dbf=None
+		self.admin1index=None
 		self.root=None
+		self.listings={}
+		self.validated=None
 	def basic(self,param,name,gsg=None,isadmin1=False,isdisputed=False,extra=None):
 		if param=='/': return name
 		ret=[]
@@ -7686,31 +10275,23 @@ class Options():
 			a=admin1.split('_')
 			admin1=a[0]
 			a1type=a[1]
-		dbf=self.admin1dbf
-		if not dbf: dbf=self.loadadmin1dbf()
 		gsg=options['gsg']
-		for i in range(dbf.numrecords):
-			r=dbf.records[i]
-			rgsg=r['sov3']+'.'+r['adm3']
-			if rgsg!=gsg: continue
-			name=r['name']
-			if not name: name='_blank_'+str(i)
-			if Options.collapsename(name)!=admin1: continue
-			t=r['type']
-			if a1type:
-				if Options.collapsename(t)!=a1type: continue
-			options['admin1']=gsg+'.'+name+'.'+t
+		m=self.getadmin1index().find(gsg,admin1,a1type)
+		if m:
+			options['admin1']=gsg+'.'+m[0]+'.'+m[1]
 			options['countrymapdots_10m']=[]
-			break
 		else:
 			options['isnotfound']=True
+	def getadmin1index(self):
+		if not self.admin1index: self.admin1index=Admin1Index.make(self)
+		return self.admin1index
 	def loadadmin1dbf(self):
 		dbf=Dbf(installfile=install.getinstallfile('admin1-nolakes.dbf',['10m']))
 		dbf.selectcfield('sov_a3','sov3')
 		dbf.selectcfield('adm0_a3','adm3')
 		dbf.selectcfield('name','name')
 		dbf.selectcfield('type_en','type')
-		dbf.loadrecords()
+		dbf.loadrecords(iscolumnar=True)
 		fixes=((3141,'MEX','MEX','','islaperez'), # 3139 for v4
 				(36,'MWI','MWI','Chitipa','Karonga'), # typo in v5
 				)
@@ -7721,47 +10302,30 @@ class Options():
 		self.admin1dbf=dbf
 		return dbf
 	def loadroot(self):
-		root={}
-		for g in globals():
-			if g.startswith('_'): continue
-			if not g.endswith('_options'): continue
-			f=globals().get(g)
-			l=f('/')
-			if isinstance(l,str): l=(l,)
-			for n in l: root[n]=f
-		self.root=root
-		return root
+		if Options.registry==None:
+			root={}
+			for g in globals():
+				if g.startswith('_'): continue
+				if not g.endswith('_options'): continue
+				f=globals().get(g)
+				l=f('/')
+				if isinstance(l,str): l=(l,)
+				for n in l: root[n]=f
+			Options.registry=root
+		self.root=Options.registry
+		return self.root
+	def getlisting(self,f,path): # f(path) for a directory path, these don't change so they're made once
+		if path not in self.listings: self.listings[path]=f(path)
+		return self.listings[path]
 	def appendadmin1(self,dest,gsg,prefix):
-		dbf=self.admin1dbf
-		if not dbf: dbf=self.loadadmin1dbf()
-		isfound=False
-		shortnames={}
-		for i in range(dbf.numrecords):
-			r=dbf.records[i]
-			rgsg=r['sov3']+'.'+r['adm3']
-			if rgsg!=gsg: continue
-			name=r['name']
-			if not name: name='_blank_'+str(i)
-			shortnames[name]=shortnames.get(name,0)+1
-
-		for i in range(dbf.numrecords):
-			r=dbf.records[i]
-			rgsg=r['sov3']+'.'+r['adm3']
-			if rgsg!=gsg: continue
-			name=r['name']
-			if not name: name='_blank_'+str(i)
-			if shortnames[name]==1:
-				dest.append(prefix+Options.collapsename(name))
-			else:
-				t=r['type']
-				dest.append(prefix+Options.collapsename(name)+'_'+Options.collapsename(t))
-			isfound=True
-		if isfound: dest.append(prefix+'_admin1')
+		paths=self.getadmin1index().getpaths(gsg)
+		for p in paths: dest.append(prefix+p)
+		if len(paths): dest.append(prefix+'_admin1')
 	def listoptionpath2(self,matches):
 		more=[]
 		for n,f in matches:
 			ns=n+'/'
-			r=f(ns)
+			r=self.getlisting(f,ns)
 			if not r: continue
 			more.append((ns,f))
 		for m in more: matches.append(m)
@@ -7788,15 +10352,19 @@ class Options():
 			for n in root: dest.append((n,root[n]))
 			return self.listoptionpath2(dest)
 		(fpath,basedir)=Options.splitpath(path)
-		f=root[basedir]
+		f=root.get(basedir,None)
 		if not f: return None
-		a=f(fpath)
+		a=self.getlisting(f,fpath)
 		if not a: return None
 		ret=[]
 		for m in a: ret.append((m,f))
 		return ret
 	def getoptions(self,path):
 		if path.endswith('/'): return None
+		if self.validated and self.validated[0]==path: # made by isvalidpath just before
+			opts=self.validated[1]
+			self.validated=None
+			return opts
 		root=self.root
 		if not root: root=self.loadroot()
 		(fpath,basedir)=Options.splitpath(path)
@@ -7806,6 +10374,7 @@ class Options():
 	def isvalidpath(self,path):
 		if self.listoptionpath(path): return True
 		opts=self.getoptions(path)
+		self.validated=(path,opts)
 		if not opts: return False
 		if 'isnotfound' in opts: return False
 		return True
@@ -7816,7 +10385,7 @@ class Options():
 			n,f=a.pop()
 			if not n.endswith('/'): r.append(n)
 			else:
-				d=f(n)
+				d=self.getlisting(f,n)
 				for e in d: a.append((e,f))
 		return r
 
@@ -7853,6 +10422,102 @@ class UrlDecoding():
 			if isinstance(o,bytearray): b[i]=o.decode()
 		return ''.join(b)
 
+class PlaceIndex(): # populated_places.dbf by name, sg.name and sg.admin1name.name, saved to shpcachedir_global
+	magic='pyshpp01'
+	def __init__(self):
+		self.places=[] # (name,lon,lat) in dbf order
+		self.rawkeys={}
+		self.collapsedkeys={}
+	@staticmethod
+	def addkey(keys,key,i):
+		l=keys.get(key,None)
+		if l==None: keys[key]=[i]
+		elif l[-1]!=i: l.append(i)
+	def addplace(self,sg,admin1name,name,lon,lat):
+		i=len(self.places)
+		self.places.append((name,lon,lat))
+		PlaceIndex.addkey(self.rawkeys,name,i)
+		PlaceIndex.addkey(self.rawkeys,sg+'.'+name,i)
+		PlaceIndex.addkey(self.rawkeys,sg+'.'+admin1name+'.'+name,i)
+		sg=Options.collapsename(sg)
+		admin1name=Options.collapsename(admin1name)
+		name=Options.collapsename(name)
+		PlaceIndex.addkey(self.collapsedkeys,name,i)
+		PlaceIndex.addkey(self.collapsedkeys,sg+'.'+name,i)
+		PlaceIndex.addkey(self.collapsedkeys,sg+'.'+admin1name+'.'+name,i)
+	def find(self,name): # lowercase names match collapsed names
+		keys=self.collapsedkeys if name[0].islower() else self.rawkeys
+		ret=[]
+		for i in keys.get(name,[]): ret.append(self.places[i])
+		return ret
+	@staticmethod
+	def getfilename(installfile):
+		return shpcachedir_global+'/placeindex-'+installfile.scale+'-'+installfile.nickname[:-4]+'.txt'
+	@staticmethod
+	def makefromdbf(installfile):
+		dbf=Dbf(installfile=installfile)
+		dbf.selectcfield('adm0_a3','sg')
+		dbf.selectcfield('adm1name','admin1name')
+		dbf.selectcfield('name','name')
+		dbf.selectcfield('longitude','lon')
+		dbf.selectcfield('latitude','lat')
+		dbf.loadrecords(iscolumnar=True)
+		sgs=dbf.getcolumn('sg')
+		admin1names=dbf.getcolumn('admin1name')
+		names=dbf.getcolumn('name')
+		lons=dbf.getcolumn('lon')
+		lats=dbf.getcolumn('lat')
+		dbf.close()
+		pi=PlaceIndex()
+		for i in range(len(names)): pi.addplace(sgs[i],admin1names[i],names[i],lons[i],lats[i])
+		return pi
+	@staticmethod
+	def make(installfile):
+		if shpcachedir_global:
+			pi=PlaceIndex.load(installfile)
+			if pi: return pi
+		pi=PlaceIndex.makefromdbf(installfile)
+		if shpcachedir_global: pi.save(installfile)
+		return pi
+	def save(self,installfile):
+		fn=PlaceIndex.getfilename(installfile)
+		if isverbose_global: print('Saving place index to %s'%fn,file=sys.stderr)
+		f=open(fn+'.tmp','w',encoding='utf-8')
+		f.write(PlaceIndex.magic+'\t'+installfile.getcachekey()+'\n')
+		for p in self.places: f.write('p\t%s\t%s\t%s\n'%p)
+		for (c,keys) in (('r',self.rawkeys),('c',self.collapsedkeys)):
+			for k in keys:
+				a=[]
+				for i in keys[k]: a.append(str(i))
+				f.write(c+'\t'+k+'\t'+' '.join(a)+'\n')
+		f.close()
+		os.replace(fn+'.tmp',fn)
+	@staticmethod
+	def load(installfile): # None if the file is missing or stale
+		fn=PlaceIndex.getfilename(installfile)
+		try:
+			f=open(fn,'r',encoding='utf-8')
+		except FileNotFoundError:
+			if isverbose_global: print('Checked place index %s'%fn,file=sys.stderr)
+			return None
+		lines=f.read().split('\n')
+		f.close()
+		if lines[0]!=PlaceIndex.magic+'\t'+installfile.getcachekey():
+			if isverbose_global: print('Place index %s is stale'%fn,file=sys.stderr)
+			return None
+		if isverbose_global: print('Loading place index from %s'%fn,file=sys.stderr)
+		pi=PlaceIndex()
+		for line in lines[1:]:
+			a=line.split('\t')
+			if a[0]=='p':
+				pi.places.append((a[1],a[2],a[3]))
+			elif a[0]=='r' or a[0]=='c':
+				l=[]
+				for i in a[2].split(' '): l.append(int(i))
+				if a[0]=='r': pi.rawkeys[a[1]]=l
+				else: pi.collapsedkeys[a[1]]=l
+		return pi
+
 class LabelMaker():
 	def reset(self):
 		self.fontoffsetx='+0'
@@ -7871,7 +10536,7 @@ class LabelMaker():
 		self.reset()
 		self.labels=[]
 		self.commands=[]
-		self.populateddbf=None
+		self.placeindex=None
 	def addlabel(self,t):
 		self.labels.append(Label(self.dlon,self.dlat,t,self.font,self.fontoffsetx,self.fontoffsety,self.lineoffsetx,self.lineoffsety,
 				self.linegap,self.shadow,self.rotation,self.hidden,self.anchor))
@@ -7925,28 +10590,12 @@ class LabelMaker():
 			print('Unknown label command',n,file=sys.stderr)
 			raise ValueError
 	def populatedplace(self,name):
-		if not self.populateddbf:
-			dbf=Dbf(installfile=install.getinstallfile('populated_places.dbf'))
-			dbf.selectcfield('adm0_a3','sg')
-			dbf.selectcfield('adm1name','admin1name')
-			dbf.selectcfield('name','name')
-			dbf.selectcfield('longitude','lon')
-			dbf.selectcfield('latitude','lat')
-			dbf.loadrecords()
-			self.populateddbf=dbf
-		iscollapse=name[0].islower()
-		for i,r in enumerate(self.populateddbf.records):
-			rsg=r['sg']
-			radmin1name=r['admin1name']
-			rname=r['name']
-			if iscollapse:
-				rsg=Options.collapsename(rsg)
-				radmin1name=Options.collapsename(radmin1name)
-				rname=Options.collapsename(rname)
-			if rname==name or rsg+'.'+rname==name or rsg+'.'+radmin1name+'.'+rname==name:
-				self.dlon=float(r['lon'])
-				self.dlat=float(r['lat'])
-				self.addlabel(r['name'])
+		if not self.placeindex:
+			self.placeindex=PlaceIndex.make(install.getinstallfile('populated_places.dbf'))
+		for (rname,lon,lat) in self.placeindex.find(name):
+			self.dlon=float(lon)
+			self.dlat=float(lat)
+			self.addlabel(rname)
 	def addcommand(self,t):
 		a=t.split('&')
 		for o in a:
@@ -8147,11 +10796,8 @@ def pointmap(output,overrides,labels):
 	splitlimit=options['splitlimit']
 	zoomscale=options['zoom']
 
-	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']])
-	admin.fixantarctica()
-	admin.fixrussia()
-	admin.fixegypt()
-	admin.setccwtypes()
+	window=LonLatWindow.makefromzoom(options['lon'],options['lat'],zoomscale)
+	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']],window,isfixup=True)
 	if options['islakes']: admin.loadlakes()
 
 	if options['isadmin1']: admin.loadadmin1()
@@ -8189,14 +10835,14 @@ def pointmap(output,overrides,labels):
 	if options['isadmin0']:
 		cssfull=LAND_SPHERE_CSS
 		if options['hypso']: cssfull=BORDER_SPHERE_CSS
-		for one in admin.admin0.shapes:
+		for one in admin.admin0.getshapesinview(rotation,bzc):
 			one_sphere_print_svg(output,one,0,rotation,width,height,splitlimit,cssfull=cssfull,csspatch=PATCH_LAND_SPHERE_CSS,
 					boxzoomcleave=bzc)
 
 	if options['isadmin1']:
 		cssfull=LAND_SPHERE_CSS
 		if options['hypso']: cssfull=BORDER_SPHERE_CSS
-		for one in admin.admin1.shapes:
+		for one in admin.admin1.getshapesinview(rotation,bzc):
 			one_sphere_print_svg(output,one,0,rotation,width,height,splitlimit,cssfull=cssfull,csspatch=PATCH_LAND_SPHERE_CSS,
 					boxzoomcleave=bzc)
 
@@ -8205,7 +10851,7 @@ def pointmap(output,overrides,labels):
 		if options['hypso']: cssfull=BORDER_SPHERE_CSS
 		ifile=install.getinstallfile('land.shp',[options['landm']])
 		shp=Shp(installfile=ifile)
-		shp.loadshapes()
+		shp.loadshapes(window)
 		for one in shp.shapes:
 			one_sphere_print_svg(output,one,0,rotation,width,height,splitlimit,cssfull=cssfull,csspatch=PATCH_LAND_SPHERE_CSS,
 					boxzoomcleave=bzc)
@@ -8268,11 +10914,7 @@ def maximap(output,overrides,labels):
 	splitlimit=options['splitlimit']
 	hypsoscale=options['hypsodim']/width
 
-	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']])
-	admin.fixantarctica()
-	admin.fixrussia()
-	admin.fixegypt()
-	admin.setccwtypes()
+	admin=ShpAdmin('admin0-nolakes.shp',[options['spherem']],isfixup=True)
 	if options['islakes']: admin.loadlakes()
 
 	if options['admin1']:
@@ -8331,11 +10973,11 @@ def maximap(output,overrides,labels):
 			print_rectwater_svg(output,width,height)
 
 	if True: # draw plain background countries
-		for one in admin.shapes:
+		for one in admin.admin0.getshapesinview(rotation,bzc):
 			one_sphere_print_svg(output,one,0,rotation,width,height,splitlimit,cssfull=LAND_SPHERE_CSS,csspatch=PATCH_LAND_SPHERE_CSS,
 					boxzoomcleave=bzc)
 	if True:
-		for one in admin.admin1.shapes:
+		for one in admin.admin1.getshapesinview(rotation,bzc):
 			one_sphere_print_svg(output,one,1,rotation,width,height,splitlimit,cssfull=LAND_SPHERE_CSS,csspatch=PATCH_LAND_SPHERE_CSS,
 					boxzoomcleave=bzc)
 	if True:
@@ -8349,8 +10991,7 @@ def maximap(output,overrides,labels):
 				boxzoomcleave=bzc)
 		sasi=ShpAdminShapeIntersection()
 		sasi.addfromshapes((mshape,),3)
-		for l in admin.lakes.shapes:
-			sasi.setinside(l)
+		sasi.setinsidepart(admin.lakes)
 		borderlakeshapes=sasi.exportlines()
 		for plus in borderlakeshapes:
 			if plus.type!=POLYLINE_TYPE_SHP: continue
@@ -12243,6 +14884,9 @@ def scarboroughreef_options(param):
 
 def runparams(params):
 	global isverbose_global
+	global shpcachedir_global
+	global isnumpy_global
+	global lodpixels_global
 	output=Output()
 	labels=None
 	useroptions=UserOptions()
@@ -12258,6 +14902,30 @@ def runparams(params):
 			isverbose_global=True
 		elif param=='verbose':
 			isverbose_global=True
+		elif param=='nonumpy':
+			isnumpy_global=False
+		elif param=='lod':
+			lodpixels_global=1.0
+		elif param=='stream':
+			output.setstream()
+		elif param=='svgz' or param.startswith('svgz='):
+			if not zlib:
+				print('svgz requires zlib and it wasn\'t found, quitting',file=sys.stderr)
+				return
+			if param=='svgz': output.setgzip()
+			else:
+				try:
+					level=int(param[5:])
+				except ValueError:
+					level=None
+				if level==None or level<1 or level>9:
+					print('Unknown command "%s", svgz level is 1 to 9'%param,file=sys.stderr)
+					return
+				output.setgzip(level)
+		elif param=='shpcache':
+			shpcachedir_global='./shpcache'
+			if not os.access(shpcachedir_global,os.X_OK): os.mkdir(shpcachedir_global)
+			install.loadmanifest(shpcachedir_global+'/install.txt')
 		elif param=='publicdomain':
 			useroptions.addnv('copyright','COPYRIGHT: THIS SVG FILE IS RELEASED INTO THE PUBLIC DOMAIN')
 		elif param=='list':
@@ -12342,6 +15010,8 @@ def runparams(params):
 		elif param=='zoom_test': zoom_test()
 		elif param=='tripel_test': tripel_test()
 		elif param=='webmercator_test': webmercator_test()
+		elif param=='shpload_test': shpload_test()
+		elif param=='shpcache_test': shpcache_test()
 		elif param=='province_test': province_test()
 		elif param=='admin1_test': admin1_test()
 		elif param=='admin0info_test': admin0info_test()
@@ -12357,6 +15027,11 @@ def runparams(params):
 			print('Commands:')
 			print('\tverbose          : print more status messages')
 			print('\tcheck            : show file locations and enable verbose messages')
+			print('\tshpcache         : keep fixed-up admin0 shapes in ./shpcache for faster starts')
+			print('\tnonumpy          : don\'t use numpy for projection, even if it\'s installed')
+			print('\tlod              : skip vertices that would move less than a pixel, faster for 10m data')
+			print('\tstream           : keep the svg body in a temporary file instead of memory, for big maps')
+			print('\tsvgz[=level]     : write gzip-compressed svg, level is 1 (fast) to 9 (small), default 6')
 			print('\tlist             : list root location commands')
 			print('\tlistall          : list all location commands')
 			print('\tpublicdomain     : add PD copyright notice in output')
@@ -12400,5 +15075,6 @@ elif len(sys.argv)==2 and (sys.argv[1]=='stdin' or sys.argv[1]=='-'):
 	while a.count(''): a.remove('')
 	runparams(a)
 else: runparams(sys.argv[1:])
+install.flushmanifest()
 
 if debug_global!=0: print('debug: %d'%debug_global,file=sys.stderr)